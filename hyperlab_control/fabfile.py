@@ -1,11 +1,38 @@
+import fnmatch
 import getpass
 import json
 import logging
 import os
-import socket
-
-import paramiko
-from fabric import Connection, task
+import sys
+import threading
+import time
+
+from fabric import Task as FabricTask
+from fabric import task as fabric_task
+
+from hyperlab_control.connections import pool
+from hyperlab_control.daemon import DAEMON_PORT, serve
+from hyperlab_control.desired import SETTLED_STATES, STATE_COMMANDS, configure_command, plan_ensure, read_state
+from hyperlab_control.fanout import for_each_host
+from hyperlab_control.health import HEALTH_TIMEOUT, METALLB_CONFIG, health_targets, metallb_addresses, primary_vms, sweep
+from hyperlab_control.history import HISTORY_INTERVAL, history, parse_duration, parse_time
+from hyperlab_control.inventory import inventory
+from hyperlab_control.jobs import run_vm_jobs
+from hyperlab_control.memory import HOST_RESERVE_MB, apply_memory, minimums_fit, plan_memory, sample_memory
+from hyperlab_control.metrics import cmdlet_of, instrument_task, metrics
+from hyperlab_control.monitor import MONITOR_FIELDS, MONITOR_INTERVAL, HostMonitor
+from hyperlab_control.netindex import network_index
+from hyperlab_control.planner import READY_TIMEOUT, plan_waves, role_of, wait_until_ready
+from hyperlab_control.power import QUIESCE_BUDGET, power_action, wait_offline
+from hyperlab_control.powershell import USE_SESSIONS, batch_vm_action, get_session, quote
+from hyperlab_control.provision import (GOLDEN_VHDX, WORKER_CPUS, WORKER_DISK_BUDGET_GB, WORKER_DISK_DIR,
+                                        WORKER_MEMORY_MB, WORKER_PREFIX, WORKER_SWITCH, create_script, new_macs,
+                                        next_worker_names, plan_placement, read_capacity)
+from hyperlab_control.retention import (RETENTION_KEEP_LAST, RETENTION_KEEP_PATTERNS, RETENTION_MAX_AGE_DAYS,
+                                        list_checkpoints, plan_retention, prune_job_script)
+from hyperlab_control.status import collect_host_status
+from hyperlab_control.timeouts import command_timeout, deadline_passed, with_deadline
+from hyperlab_control.wake import send_magic_packet, wake_host
 
 # Logging Configuration
 logging.basicConfig(
@@ -15,26 +42,86 @@ logging.basicConfig(
 
 VM_HOSTS = ["atlas"]
 
+# Get-VM name filter selecting the lab VMs
+HYPERLAB_PATTERN = "hyperlab*"
+
+# MetalLB manifest health sweeps by default, unless HYPERLAB_METALLB_CONFIG names another one.
+# The fabfile is run from its checkout, so the repository's cluster directory is next to it.
+METALLB_MANIFEST = METALLB_CONFIG or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                  "cluster", "metallb-config.yaml")
+
+# Checkpoint name used by create_hyperlab_checkpoints and reset_lab; `$name` is replaced by the VM name
+CHECKPOINT_NAME = "Checkpoint-$name"
+
+# Log prefix for each state command ensure issues
+ENSURE_MESSAGES = {
+    "Start-VM": "▶️ Started",
+    "Stop-VM": "🛑 Stopped",
+    "Save-VM": "💾 Saved state of",
+    "Resume-VM": "⏯️ Resumed",
+    "Remove-VMSavedState": "🗑️ Discarded saved state of",
+}
+
+# Options task() adds to every task, with their help
+TASK_OPTIONS = {
+    "metrics": "Dump timings as json, prometheus or to a file",
+    "deadline": "Seconds the whole task may take across all hosts",
+}
+
 MAC_ADDRESSES = {
     "atlas": "58:47:CA:75:EB:98"
 }
 
 
+class LabTask(FabricTask):
+    """Fabric task whose options added by task() only have long flags, leaving short ones to the task's own."""
+
+    def arg_opts(self, name, default, taken_names):
+        opts = super().arg_opts(name, default, taken_names)
+        if name in TASK_OPTIONS:
+            opts["names"] = opts["names"][:1]
+        return opts
+
+
+def task(body):
+    """
+    Declare a fabric task whose remote operations are recorded in the metrics under its name.
+
+    Every task accepts --metrics=json|prometheus|<file> to dump the metrics when it finishes,
+    with '.prom' files written in the Prometheus textfile collector format, and
+    --deadline=<seconds> to stop waiting for hosts that have not finished by then.
+    """
+    return fabric_task(instrument_task(with_deadline(body)), klass=LabTask, help=dict(TASK_OPTIONS))
+
+
 def get_connection(host):
-    """Establish an SSH connection to the given host."""
-    user = getpass.getuser()
+    """Return a pooled SSH connection to the given host, or None if it cannot be reached."""
     try:
-        logging.info(f"🔄 Connecting to {host} as {user}...")
-        return Connection(host=host, user=user)
+        return pool.get(host)
     except Exception as e:
         logging.error(f"❌ Failed to connect to {host}: {e}")
         return None
 
 
+def on_vm_hosts(body, hosts=None):
+    """Run body(host, conn) on all VM hosts in parallel, skipping hosts that cannot be reached."""
+
+    def run(host):
+        conn = get_connection(host)
+        if conn:
+            return body(host, conn)
+
+    return for_each_host(run, VM_HOSTS if hosts is None else hosts)
+
+
 def execute_command(conn, command):
-    """Execute a PowerShell command and return stdout, or None if it fails."""
+    """Execute a PowerShell command in the host's persistent session and return stdout, or None if it fails."""
     try:
-        return conn.run(f'powershell -Command "{command}"', hide=True).stdout.strip()
+        timeout = command_timeout(cmdlet_of(command))
+        if USE_SESSIONS:
+            return get_session(conn).run(command, timeout=timeout)
+        with metrics.timer("execute", host=pool.host_of(conn), cmdlet=cmdlet_of(command)):
+            return conn.run(f'powershell -Command "{command}"', hide=True, timeout=timeout).stdout.strip()
     except Exception as e:
         logging.error(f"⚠️ Command execution failed: {command}\n{e}")
         return None
@@ -43,50 +130,230 @@ def execute_command(conn, command):
 @task
 def check_connectivity(c):
     """Check connectivity to all VM hosts."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
+
+    def on_host(host, conn):
         result = execute_command(conn, "whoami")
         if result:
             logging.info(f"✅ Connected to {host} as {result}")
 
+    on_vm_hosts(on_host)
+
 
 @task
 def check_disk_space(c):
     """Check disk space usage on all VM hosts."""
     command = """Get-PSDrive C | Select-Object @{Name='Used (GB)'; Expression={[math]::Round($_.Used / 1GB,2)}}, 
                  @{Name='Free (GB)'; Expression={[math]::Round($_.Free / 1GB,2)}}"""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if conn:
-            result = execute_command(conn, command)
-            if result:
-                logging.info(f"📂 {host} Disk Space:\n{result}")
+
+    def on_host(host, conn):
+        result = execute_command(conn, command)
+        if result:
+            logging.info(f"📂 {host} Disk Space:\n{result}")
+
+    on_vm_hosts(on_host)
 
 
 @task
 def check_uptime(c):
     """Check system uptime for all VM hosts."""
     command = "(get-date) - (gcim Win32_OperatingSystem).LastBootUpTime"
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if conn:
-            result = execute_command(conn, command)
-            if result:
-                logging.info(f"⏳ {host} System Uptime:\n{result}")
+
+    def on_host(host, conn):
+        result = execute_command(conn, command)
+        if result:
+            logging.info(f"⏳ {host} System Uptime:\n{result}")
+
+    on_vm_hosts(on_host)
+
+
+def retrieve_host_status(host):
+    """
+    Retrieve disk, uptime, VMs, checkpoints and adapters of a host in one round trip.
+
+    Args:
+        host (str): The remote machine's hostname or IP.
+
+    Returns:
+        dict | None: The host status document (see collect_host_status), or None on failure.
+    """
+    conn = get_connection(host)
+    if not conn:
+        return None
+    status = collect_host_status(conn)
+    if status is None:
+        logging.error(f"⚠️ Failed to collect status from {host}.")
+    return status
 
 
 @task
-def list_vms(c):
-    """List all VMs on all VM hosts."""
-    command = "Get-VM"
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if conn:
-            result = execute_command(conn, command)
-            if result:
-                logging.info(f"🖥️ {host} VMs:\n{result}")
+def host_status(c):
+    """Collect a full status snapshot of every VM host in a single remote call each, printed as JSON."""
+    results = for_each_host(retrieve_host_status, VM_HOSTS)
+    statuses = [result.value for result in results.values() if result.value]
+
+    for status in statuses:
+        running = sum(1 for vm in status["VMs"] if vm["State"] == "Running")
+        logging.info(f"📊 {status['Host']}: {running}/{len(status['VMs'])} VMs running, "
+                     f"{status['Disk']['FreeGB']} GB free, up {status['UptimeSeconds'] // 3600}h")
+
+    if statuses:
+        print(json.dumps(statuses, indent=4))
+    else:
+        logging.info("⚠️ No host status retrieved.")
+
+
+@task
+def collect_history(c, interval=HISTORY_INTERVAL, duration=0):
+    """
+    Record host and VM metrics into the local history every --interval seconds.
+
+    Runs until Ctrl+C or for --duration seconds; --duration=1 takes a single sample,
+    e.g. from a scheduled task.
+    """
+    end = time.monotonic() + float(duration) if float(duration) > 0 else None
+    try:
+        while True:
+            started = time.monotonic()
+            results = for_each_host(retrieve_host_status, VM_HOSTS)
+            sample_time = time.time()
+            recorded = sum(history.record(result.value, sample_time) for result in results.values() if result.value)
+            history.compact(sample_time)
+            logging.info(f"🗃️ Recorded {recorded} values from "
+                         f"{sum(1 for result in results.values() if result.value)}/{len(results)} hosts")
+            if end is not None and time.monotonic() + float(interval) > end:
+                break
+            time.sleep(max(0, float(interval) - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+
+
+@task
+def show_history(c, metric="disk_used_gb", host="*", vm="*", since="1d", until="", step="1h"):
+    """
+    Show a recorded metric over time, averaged per --step (e.g. 15m, 1h, 1d).
+
+    Metrics: disk_used_gb, disk_free_gb, uptime_s (per host); cpu_pct, mem_assigned_mb,
+    mem_demand_mb, checkpoints (per VM). --since and --until take '7d', '12h' or ISO dates.
+    """
+    from tabulate import tabulate
+
+    now = time.time()
+    since_time, until_time = parse_time(since, now), parse_time(until, now)
+    columns = {}
+    for series in history.series(metric, host, vm):
+        label = f"{series['Host']} {series['VMName']}".strip()
+        columns[label] = dict(history.points(series, since_time, until_time, parse_duration(step) or 0))
+    if not any(columns.values()):
+        logging.info(f"⚠️ No '{metric}' history recorded for the selected range.")
+        return
+
+    times = sorted({t for points in columns.values() for t in points})
+    time_format = "%Y-%m-%d %H:%M" if (parse_duration(step) or 0) >= 60 else "%Y-%m-%d %H:%M:%S"
+    rows = [[time.strftime(time_format, time.localtime(t))]
+            + [round(points[t], 2) if t in points else "" for points in columns.values()] for t in times]
+    print(tabulate(rows, headers=["Time", *columns]))
+
+
+@task
+def top_history(c, metric="mem_demand_mb", by="growth", since="7d", until="", count=10, host="*", vm="*"):
+    """
+    Rank hosts or VMs by a recorded metric over a time range.
+
+    --by is growth (last minus first value), mean, max or min, e.g. the VMs whose memory
+    demand grew most this week, or when C: filled fastest with --metric=disk_used_gb.
+    """
+    from tabulate import tabulate
+
+    now = time.time()
+    ranked = history.top(metric, parse_time(since, now), parse_time(until, now), count=int(count), by=by,
+                         host=host, vm=vm)
+    if not ranked:
+        logging.info(f"⚠️ No '{metric}' history recorded for the selected range.")
+        return
+    rows = [[entry["Host"], entry["VMName"], entry["Value"], entry["First"], entry["Last"], entry["Mean"],
+             entry["Min"], entry["Max"], entry["Samples"]] for entry in ranked]
+    print(tabulate(rows, headers=["Host", "VM", by.capitalize(), "First", "Last", "Mean", "Min", "Max", "Samples"]))
+
+
+@task
+def list_vms(c, fresh=False):
+    """List all VMs on all VM hosts (use --fresh to bypass the inventory cache)."""
+    from tabulate import tabulate
+
+    def on_host(host, conn):
+        vms = inventory.vms(conn, fresh=fresh, need_state=True)
+        if vms:
+            rows = [
+                [vm["Name"], vm["State"], vm["CPUUsage"], (vm["MemoryAssigned"] or 0) // 2 ** 20, vm["Uptime"],
+                 vm["Status"]]
+                for vm in vms
+            ]
+            table = tabulate(rows, headers=["Name", "State", "CPUUsage(%)", "MemoryAssigned(M)", "Uptime", "Status"])
+            logging.info(f"🖥️ {host} VMs:\n{table}")
+
+    on_vm_hosts(on_host)
+
+
+@task
+def monitor(c, interval=MONITOR_INTERVAL, duration=0, pattern="*", csv_file="", jsonl_file=""):
+    """
+    Watch live CPU, memory, disk and network load of the VMs on all VM hosts.
+
+    One sampler per host streams only the values that changed. Runs until Ctrl+C or for
+    --duration seconds; --csv-file and --jsonl-file also record every change.
+    """
+    import csv
+
+    from tabulate import tabulate
+
+    connections = {host: conn for host, conn in ((host, get_connection(host)) for host in VM_HOSTS) if conn}
+    if not connections:
+        return
+
+    csv_handle = open(csv_file, "a", newline="") if csv_file else None
+    csv_writer = csv.writer(csv_handle) if csv_handle else None
+    if csv_handle and csv_handle.tell() == 0:
+        csv_writer.writerow(["Time", "Host", "VMName"] + [key for key, _ in MONITOR_FIELDS])
+    jsonl_handle = open(jsonl_file, "a") if jsonl_file else None
+    write_lock = threading.Lock()
+
+    def on_record(host, record):
+        with write_lock:
+            if jsonl_handle:
+                jsonl_handle.write(json.dumps({"host": host, **record}) + "\n")
+            if csv_writer:
+                for vm_name in record.get("d") or {}:
+                    vm = monitors[host].vms.get(vm_name, {})
+                    csv_writer.writerow([record.get("t"), host, vm_name] + [vm.get(key) for key, _ in MONITOR_FIELDS])
+
+    monitors = {host: HostMonitor(host, conn, interval, pattern, on_record) for host, conn in connections.items()}
+    for host_monitor in monitors.values():
+        host_monitor.start()
+
+    interactive = sys.stdout.isatty()
+    deadline = time.monotonic() + float(duration) if float(duration) > 0 else None
+    try:
+        while any(host_monitor.is_alive() for host_monitor in monitors.values()):
+            if deadline and time.monotonic() >= deadline:
+                break
+            time.sleep(max(1, int(interval)))
+            rows = [
+                [host, vm_name] + [values.get(key, "") for key, _ in MONITOR_FIELDS]
+                for host, host_monitor in monitors.items()
+                for vm_name, values in sorted(host_monitor.snapshot().items())
+            ]
+            table = tabulate(rows, headers=["Host", "VM"] + [header for _, header in MONITOR_FIELDS])
+            if interactive:
+                sys.stdout.write("\033[H\033[J")
+            print(f"{time.strftime('%H:%M:%S')}  (Ctrl+C to stop)\n{table}\n", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for host_monitor in monitors.values():
+            host_monitor.stop()
+        for handle in (csv_handle, jsonl_handle):
+            if handle:
+                handle.close()
 
 
 @task
@@ -96,12 +363,13 @@ def manage_vm(c, vm_name, action):
         logging.error("❌ Invalid action. Use 'Start', 'Stop', or 'Save'.")
         return
 
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if conn:
-            result = execute_command(conn, f"{action}-VM -Name {vm_name}")
-            if result is not None:
-                logging.info(f"✅ {action}ed {vm_name} on {host}")
+    def on_host(host, conn):
+        result = execute_command(conn, f"{action}-VM -Name {vm_name}")
+        inventory.invalidate(host, [vm_name])
+        if result is not None:
+            logging.info(f"✅ {action}ed {vm_name} on {host}")
+
+    on_vm_hosts(on_host)
 
 
 @task
@@ -116,59 +384,166 @@ def stop_vm(c, vm_name):
     manage_vm(c, vm_name, "Stop")
 
 
-def get_hyperlab_vms(conn):
-    """Retrieve the list of HyperLab VMs from a connection."""
-    result = execute_command(conn,
-                             "Get-VM | Where-Object { $_.Name -like 'hyperlab*' } | Select-Object -ExpandProperty Name")
-    return [vm.strip() for vm in result.split("\n") if vm.strip()] if result else []
+def get_hyperlab_vms(conn, fresh=False):
+    """Retrieve the list of HyperLab VMs from a connection, using the inventory cache unless fresh is set."""
+    return inventory.vm_names(conn, HYPERLAB_PATTERN, fresh=fresh)
+
+
+def run_vm_batch(host, conn, command, done_message, failed_message, vm_names=None, pattern=HYPERLAB_PATTERN,
+                 as_jobs=False, deadline=None):
+    """
+    Run a per-VM command for all target VMs on a host in one round trip and log each outcome.
+
+    With as_jobs, the command runs as throttled Hyper-V background jobs instead, so long
+    operations overlap across VMs (see run_vm_jobs).
+
+    Args:
+        host (str): The host name, used in log messages.
+        conn (fabric.Connection): Connection to the host.
+        command (str): PowerShell command with the VM name in `$name`.
+        done_message (str): Success message template with {vm_name} and {host} fields.
+        failed_message (str): Failure message template with {vm_name} and {host} fields.
+        vm_names (list[str], optional): Explicit VMs to target instead of `pattern`.
+        pattern (str): Get-VM wildcard selecting the VMs on the host.
+        as_jobs (bool): Run the command with -AsJob under the per-operation concurrency limit.
+        deadline (float, optional): time.monotonic() value after which jobs are no longer waited for.
+
+    Returns:
+        list[dict] | None: The per-VM results, or None if the batch could not be run.
+    """
+    if as_jobs:
+        if vm_names is None:
+            vm_names = inventory.vm_names(conn, pattern)
+        results = run_vm_jobs(conn, command, vm_names, deadline=deadline)
+    else:
+        results = batch_vm_action(conn, command, vm_names=vm_names, pattern=pattern)
+    if results is None:
+        logging.error(f"⚠️ Batch operation failed on {host}.")
+        return None
+    if not results:
+        logging.info(f"⚠️ No VMs matching '{pattern}' found on {host}. Skipping.")
+        return results
+
+    inventory.invalidate(host, [result["VMName"] for result in results])
+    for result in results:
+        message_fields = {"vm_name": result["VMName"], "host": host}
+        if result["Success"]:
+            logging.info(done_message.format(**message_fields) + f" ({result['Seconds']:.1f}s)")
+        else:
+            logging.error(failed_message.format(**message_fields) + f" {result['Error']}")
+    return results
 
 
 @task
-def list_hyperlab_vms(c):
-    """List only VMs that start with 'hyperlab' on all VM hosts."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
-        hyperlab_vms = get_hyperlab_vms(conn)
+def list_hyperlab_vms(c, fresh=False):
+    """List only VMs that start with 'hyperlab' on all VM hosts (use --fresh to bypass the inventory cache)."""
+
+    def on_host(host, conn):
+        hyperlab_vms = get_hyperlab_vms(conn, fresh=fresh)
         if hyperlab_vms:
             logging.info(f"🖥️ {host} HyperLab VMs:\n" + "\n".join(hyperlab_vms))
         else:
             logging.info(f"⚠️ No HyperLab VMs found on {host}.")
 
+    on_vm_hosts(on_host)
+
 
 @task
-def create_hyperlab_checkpoints(c):
-    """Create checkpoints for all HyperLab VMs on all VM hosts."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
+def create_hyperlab_checkpoints(c, name=CHECKPOINT_NAME, prune=False):
+    """
+    Create checkpoints for all HyperLab VMs on all VM hosts.
 
-        hyperlab_vms = get_hyperlab_vms(conn)
-        if not hyperlab_vms:
-            logging.info(f"⚠️ No HyperLab VMs found on {host}. Skipping checkpoint creation.")
-            continue
+    Use --name to choose the checkpoint name ('$name' is replaced by the VM name) and
+    --prune to apply the default retention afterwards.
+    """
 
-        for vm_name in hyperlab_vms:
-            checkpoint_name = f"Checkpoint-{vm_name}"
-            result = execute_command(conn, f'Checkpoint-VM -Name {vm_name} -SnapshotName "{checkpoint_name}"')
-            if result is not None:
-                logging.info(f"✅ Created checkpoint '{checkpoint_name}' for {vm_name} on {host}")
+    def on_host(host, conn):
+        run_vm_batch(host, conn, f"Checkpoint-VM -Name $name -SnapshotName {checkpoint_name(name)}",
+                     f"✅ Created checkpoint '{name.replace('$name', '{vm_name}')}' for {{vm_name}} on {{host}}",
+                     "⚠️ Failed to create checkpoint for {vm_name} on {host}.",
+                     as_jobs=True)
+        if prune:
+            prune_host_checkpoints(host, conn, apply=True)
+
+    on_vm_hosts(on_host)
+
+
+def checkpoint_name(name):
+    """Render a checkpoint name as a PowerShell expression with '$name' replaced by the VM's name."""
+    return f"({quote(name)}.Replace('$name', $name))"
+
+
+def prune_host_checkpoints(host, conn, keep_last=RETENTION_KEEP_LAST, max_age_days=RETENTION_MAX_AGE_DAYS,
+                           keep_patterns=None, apply=False):
+    """
+    Apply the checkpoint retention policy to the HyperLab VMs of one host.
+
+    Pruned checkpoints are removed as background jobs, at most JOB_LIMITS["Remove-VMSnapshot"]
+    VMs merging at once, and each VM's job waits for its disk merge to finish.
+
+    Returns:
+        list[dict] | None: The per-VM job results, or None if nothing was pruned.
+    """
+    from tabulate import tabulate
+
+    checkpoints = list_checkpoints(conn, HYPERLAB_PATTERN)
+    if checkpoints is None:
+        logging.error(f"⚠️ Failed to list checkpoints on {host}.")
+        return None
+    plan = plan_retention(checkpoints, keep_last=int(keep_last), max_age_days=float(max_age_days),
+                          keep_patterns=keep_patterns)
+    pruned = [checkpoint for checkpoint in plan if checkpoint["Action"] == "prune"]
+    if plan:
+        rows = [[checkpoint["VMName"], checkpoint["Name"], checkpoint["AgeDays"], checkpoint["Action"],
+                 checkpoint["Reason"]] for checkpoint in plan]
+        table = tabulate(rows, headers=["VM", "Checkpoint", "Age(d)", "Action", "Kept because"])
+        logging.info(f"🗂️ {host} checkpoint retention ({len(pruned)}/{len(plan)} to prune):\n{table}")
+    if not pruned or not apply:
+        return None
+
+    vm_names = sorted({checkpoint["VMName"] for checkpoint in pruned})
+    results = run_vm_jobs(conn, "Remove-VMSnapshot", vm_names, script=prune_job_script(plan))
+    if results is None:
+        logging.error(f"⚠️ Failed to prune checkpoints on {host}.")
+        return None
+
+    reclaimed = 0
+    for result in results:
+        output = result.get("Output") or {}
+        if result["Success"]:
+            reclaimed += output.get("ReclaimedBytes") or 0
+            logging.info(f"🧹 Pruned {output.get('Removed', '?')} checkpoints of {result['VMName']} on {host}: "
+                         f"{(output.get('ReclaimedBytes') or 0) / 2 ** 30:.2f} GB reclaimed, "
+                         f"merge {output.get('MergeSeconds', '?')}s, total {result['Seconds']:.1f}s")
+        else:
+            logging.error(f"❌ Failed to prune checkpoints of {result['VMName']} on {host}: {result['Error']}")
+    logging.info(f"✅ Reclaimed {reclaimed / 2 ** 30:.2f} GB on {host}")
+    return results
 
 
 @task
-def list_hyperlab_checkpoints(c):
+def prune_checkpoints(c, keep_last=RETENTION_KEEP_LAST, max_age_days=RETENTION_MAX_AGE_DAYS,
+                      keep=",".join(RETENTION_KEEP_PATTERNS), apply=False):
+    """
+    Prune HyperLab checkpoints beyond the retention policy on all VM hosts.
+
+    Keeps the --keep-last newest per VM, those younger than --max-age-days and baselines
+    matching the comma-separated --keep patterns. Shows the plan by default; use --apply
+    to remove the rest.
+    """
+    keep_patterns = [pattern.strip() for pattern in keep.split(",") if pattern.strip()]
+    on_vm_hosts(lambda host, conn: prune_host_checkpoints(host, conn, keep_last, max_age_days, keep_patterns, apply))
+
+
+@task
+def list_hyperlab_checkpoints(c, fresh=False):
     """List checkpoints for all HyperLab VMs on all VM hosts (without table formatting)."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
 
-        hyperlab_vms = get_hyperlab_vms(conn)
+    def on_host(host, conn):
+        hyperlab_vms = get_hyperlab_vms(conn, fresh=fresh)
         if not hyperlab_vms:
             logging.info(f"⚠️ No HyperLab VMs found on {host}.")
-            continue
+            return
 
         for vm_name in hyperlab_vms:
             checkpoint_data = execute_command(conn, f'Get-VMSnapshot -VMName {vm_name}')
@@ -177,128 +552,388 @@ def list_hyperlab_checkpoints(c):
             else:
                 logging.info(f"⚠️ No checkpoints found for {vm_name} on {host}.")
 
+    on_vm_hosts(on_host)
+
 
 @task
 def save_hyperlab_vms(c):
     """Save (pause) all HyperLab VMs on all VM hosts."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
 
-        hyperlab_vms = get_hyperlab_vms(conn)
-        if not hyperlab_vms:
-            logging.info(f"⚠️ No HyperLab VMs found on {host}. Skipping save operation.")
+    def on_host(host, conn):
+        run_vm_batch(host, conn, "Save-VM -Name $name",
+                     "💾 Saved state of {vm_name} on {host}",
+                     "⚠️ Failed to save state of {vm_name} on {host}.",
+                     as_jobs=True)
+
+    on_vm_hosts(on_host)
+
+
+def start_in_waves(vms, wait=True, timeout=READY_TIMEOUT, running=()):
+    """
+    Start VMs in dependency-ordered waves, gating each wave on the readiness of the previous one.
+
+    Args:
+        vms (list[tuple[str, str]]): (host, vm_name) pairs to start.
+        wait (bool): Wait for each wave to become ready before starting the next.
+        running (collection[tuple[str, str]]): VMs already running, which are only waited for.
+        timeout (float): Seconds each wave may take to become ready.
+
+    Returns:
+        dict[tuple[str, str], float | None]: Seconds until each VM was ready, None if it was not
+        (or was not waited for). VMs that failed or timed out starting, and VMs of waves that
+        were never started, are left out.
+    """
+    ready = {}
+    waves = plan_waves(vms)
+    for number, wave in enumerate(waves, 1):
+        roles = sorted({role_of(vm_name) for _, vm_name in wave})
+        logging.info(f"🌊 Wave {number}/{len(waves)} ({', '.join(roles)}): {', '.join(vm for _, vm in wave)}")
+
+        wave_vms = {}
+        for host, vm_name in wave:
+            if (host, vm_name) not in running:
+                wave_vms.setdefault(host, []).append(vm_name)
+
+        results = on_vm_hosts(lambda host, conn: run_vm_batch(host, conn, "Start-VM -Name $name",
+                                                              "▶️ Started {vm_name} on {host}",
+                                                              "⚠️ Failed to start {vm_name} on {host}.",
+                                                              vm_names=wave_vms[host], as_jobs=True),
+                              hosts=list(wave_vms))
+        started = {(host, result["VMName"]) for host, host_result in results.items()
+                   for result in host_result.value or [] if result["Success"]}
+        failed = [vm for vm in wave if vm not in running and vm not in started]
+        wave = [vm for vm in wave if vm not in failed]
+        if deadline_passed():
+            ready.update({vm: None for vm in wave})
+            logging.error(f"⏱️ Task deadline reached in wave {number}. Not starting the remaining waves.")
+            break
+        if not wait:
+            ready.update({vm: None for vm in wave})
             continue
 
-        for vm_name in hyperlab_vms:
-            result = execute_command(conn, f'Save-VM -Name {vm_name}')
-            if result is not None:
-                logging.info(f"💾 Saved state of {vm_name} on {host}")
-            else:
-                logging.error(f"⚠️ Failed to save state of {vm_name} on {host}.")
+        wave_ready = wait_until_ready(wave, lookup_vm_ips, timeout=float(timeout))
+        ready.update(wave_ready)
+        not_ready = [vm_name for (_, vm_name), seconds in wave_ready.items() if seconds is None]
+        not_ready += [vm_name for _, vm_name in failed]
+        if not_ready:
+            logging.error(f"❌ Wave {number} not ready after {timeout}s: {', '.join(not_ready)}. "
+                          f"Not starting the remaining waves.")
+            break
+        logging.info(f"✅ Wave {number} ready after {max(wave_ready.values(), default=0):.1f}s")
+    return ready
 
 
 @task
-def start_lab(c):
-    """Start all HyperLab VMs on all VM hosts."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
+def start_lab(c, wait=True, timeout=READY_TIMEOUT):
+    """
+    Start all HyperLab VMs on all VM hosts in dependency-ordered waves.
 
-        hyperlab_vms = get_hyperlab_vms(conn)
-        if not hyperlab_vms:
-            logging.info(f"⚠️ No HyperLab VMs found on {host}. Skipping start operation.")
-            continue
+    Each wave starts in parallel and the next one only begins once every VM in it answers
+    on its role's readiness port (use --no-wait to start all waves without gating).
+    """
+    results = on_vm_hosts(lambda host, conn: read_state(conn, HYPERLAB_PATTERN))
+    states = {(host, vm["Name"]): vm["State"] for host, result in results.items() for vm in result.value or []}
+    if not states:
+        logging.info("⚠️ No HyperLab VMs found. Skipping start operation.")
+        return
 
-        for vm_name in hyperlab_vms:
-            result = execute_command(conn, f'Start-VM -Name {vm_name}')
-            if result is not None:
-                logging.info(f"▶️ Started {vm_name} on {host}")
-            else:
-                logging.error(f"⚠️ Failed to start {vm_name} on {host}.")
+    lab_start = time.monotonic()
+    running = {vm for vm, state in states.items() if state == "Running"}
+    ready = start_in_waves(list(states), wait=wait, timeout=timeout, running=running)
+    if len(ready) == len(states) and (not wait or None not in ready.values()):
+        logging.info(f"🏁 Lab started in {time.monotonic() - lab_start:.1f}s")
 
 
 @task
 def stop_lab(c):
-    """Stop all HyperLab VMs on all VM hosts."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
+    """Stop the running HyperLab VMs on all VM hosts."""
+    on_vm_hosts(lambda host, conn: ensure_host(host, conn, [{"pattern": HYPERLAB_PATTERN, "state": "stopped"}]))
 
-        hyperlab_vms = get_hyperlab_vms(conn)
-        if not hyperlab_vms:
-            logging.info(f"⚠️ No HyperLab VMs found on {host}. Skipping stop operation.")
-            continue
 
-        for vm_name in hyperlab_vms:
-            result = execute_command(conn, f'Stop-VM -Name {vm_name}')
-            if result is not None:
-                logging.info(f"🛑 Stopped {vm_name} on {host}")
-            else:
-                logging.error(f"⚠️ Failed to stop {vm_name} on {host}.")
+def ensure_host(host, conn, specs, pattern=HYPERLAB_PATTERN, dry_run=False):
+    """
+    Bring the VMs of a host to their desired state, issuing only the commands needed.
+
+    The actual state is read in one query. VMs that must be off for a settings change are
+    stopped (or their saved state discarded), all settings are applied in one batch, and each state command then runs as
+    throttled jobs for just the VMs that need it. A converged host costs the single read.
+
+    Args:
+        host (str): The host name, used in log messages.
+        conn (fabric.Connection): Connection to the host.
+        specs (list[dict]): Desired state entries (see desired.desired_for).
+        pattern (str): Get-VM wildcard selecting the VMs to read.
+        dry_run (bool): Only log the changes.
+
+    Returns:
+        list[dict] | None: The plans (see desired.plan_ensure), or None if the host could not be read.
+    """
+    vms = read_state(conn, pattern)
+    if vms is None:
+        logging.error(f"⚠️ Failed to read the VM state on {host}.")
+        return None
+    plans = plan_ensure(vms, specs)
+    for plan in plans:
+        if plan["Note"]:
+            logging.warning(f"⚠️ {plan['Name']} on {host}: {plan['Note']}")
+    changes = [plan for plan in plans if plan["Changes"]]
+    if not changes:
+        logging.info(f"✅ {host}: {len(vms)} VMs already in the desired state")
+        return plans
+    logging.info(f"🧭 {host} changes{' (dry run)' if dry_run else ''}:\n"
+                 + "\n".join(f"  {plan['Name']}: {', '.join(plan['Changes'])}" for plan in changes))
+    if dry_run:
+        return plans
+
+    failed = set()
+    first_commands = {}
+    for plan in plans:
+        if plan["First"]:
+            first_commands.setdefault(plan["First"], []).append(plan["Name"])
+    for command, vm_names in first_commands.items():
+        cmdlet = command.split()[0]
+        results = run_vm_batch(host, conn, command, f"{ENSURE_MESSAGES[cmdlet]} {{vm_name}} on {{host}}",
+                               f"⚠️ {cmdlet} failed for {{vm_name}} on {{host}}.", vm_names=vm_names,
+                               as_jobs=cmdlet != "Remove-VMSavedState")
+        failed |= set(vm_names) if results is None else {result["VMName"] for result in results
+                                                         if not result["Success"]}
+    configured = [plan for plan in plans if plan["Configure"] and plan["Name"] not in failed]
+    if configured:
+        run_vm_batch(host, conn, configure_command(configured), "🔧 Configured {vm_name} on {host}",
+                     "⚠️ Failed to configure {vm_name} on {host}.", vm_names=[plan["Name"] for plan in configured])
+
+    by_command = {}
+    for plan in plans:
+        if plan["Then"] and plan["Name"] not in failed:
+            by_command.setdefault(plan["Then"], []).append(plan["Name"])
+    for command, vm_names in by_command.items():
+        cmdlet = command.split()[0]
+        run_vm_batch(host, conn, command, f"{ENSURE_MESSAGES[cmdlet]} {{vm_name}} on {{host}}",
+                     f"⚠️ {cmdlet} failed for {{vm_name}} on {{host}}.", vm_names=vm_names,
+                     as_jobs=cmdlet != "Remove-VMSavedState")
+    return plans
 
 
 @task
-def stop_all_vms(c):
-    """Stop all VMs on all VM hosts."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
+def ensure(c, state="", pattern=HYPERLAB_PATTERN, memory_mb=0, nested="", spec="", dry_run=False):
+    """
+    Converge VMs on all VM hosts to a desired state, issuing only the commands needed.
 
-        # Get all VMs
-        all_vms = execute_command(conn, "Get-VM | Select-Object -ExpandProperty Name")
-        vms = [vm.strip() for vm in all_vms.split("\n") if vm.strip()] if all_vms else []
+    --state (running, off, saved or stopped), --memory-mb (startup memory) and --nested
+    (on or off) apply to the VMs matching --pattern. --spec names a JSON file with a list of
+    such entries, e.g. [{"pattern": "hyperlab-worker*", "state": "running", "nested": true}],
+    where later entries override earlier ones. A converged lab costs one query per host.
+    """
+    specs = []
+    if spec:
+        with open(spec) as spec_file:
+            specs = json.load(spec_file)
+    if state or memory_mb or nested:
+        nested_values = {"on": True, "true": True, "off": False, "false": False}
+        if nested and nested.lower() not in nested_values:
+            logging.error(f"⚠️ Invalid --nested '{nested}': use on or off.")
+            return
+        specs.append({"pattern": pattern, "state": state.lower() or None, "memory_mb": int(memory_mb) or None,
+                      "nested": nested_values[nested.lower()] if nested else None})
+    invalid = [entry["state"] for entry in specs if entry.get("state") and entry["state"] not in STATE_COMMANDS]
+    if invalid:
+        logging.error(f"⚠️ Invalid state {', '.join(invalid)}: use one of {', '.join(STATE_COMMANDS)}.")
+        return
+    if not specs:
+        logging.error("⚠️ Nothing to ensure: give --state, --memory-mb, --nested or --spec.")
+        return
 
-        if not vms:
-            logging.info(f"⚠️ No VMs found on {host}. Skipping stop operation.")
-            continue
+    read_pattern = pattern if not spec else "*"
+    on_vm_hosts(lambda host, conn: ensure_host(host, conn, specs, pattern=read_pattern, dry_run=dry_run))
+
+
+@task
+def reset_lab(c, checkpoint=CHECKPOINT_NAME, wait=True, timeout=READY_TIMEOUT):
+    """
+    Reset all HyperLab VMs to a checkpoint and bring the lab back up.
+
+    Running VMs are turned off rather than shut down, since their state is discarded anyway.
+    The checkpoint ('$name' is replaced by the VM name) is then restored on all VMs as
+    throttled background jobs, the restored VMs start in dependency-ordered waves, and a
+    per-VM readiness summary is logged (use --no-wait to skip the readiness gating).
+    """
+    from tabulate import tabulate
+
+    reset_start = time.monotonic()
+
+    def restore_on_host(host, conn):
+        vms = inventory.vms(conn, fresh=True)
+        if vms is None:
+            logging.error(f"⚠️ Failed to list VMs on {host}.")
+            return None
+        lab_vms = [vm for vm in vms if fnmatch.fnmatch(vm["Name"].lower(), HYPERLAB_PATTERN.lower())]
+        if not lab_vms:
+            logging.info(f"⚠️ No HyperLab VMs found on {host}. Skipping.")
+            return []
+        running = [vm["Name"] for vm in lab_vms if vm["State"] not in ("Off", "Saved")]
+        if running:
+            run_vm_batch(host, conn, "Stop-VM -Name $name -TurnOff -Force",
+                         "⏹️ Turned off {vm_name} on {host}",
+                         "⚠️ Failed to turn off {vm_name} on {host}.",
+                         vm_names=running, as_jobs=True)
+        return run_vm_batch(host, conn, f"Restore-VMSnapshot -VMName $name -Name {checkpoint_name(checkpoint)} "
+                                        f"-Confirm:$false",
+                            "⏪ Restored {vm_name} on {host}",
+                            "⚠️ Failed to restore {vm_name} on {host}.",
+                            vm_names=[vm["Name"] for vm in lab_vms], as_jobs=True)
+
+    restored = {(host, result["VMName"]): result
+                for host, host_result in on_vm_hosts(restore_on_host).items()
+                for result in host_result.value or []}
+    if not restored:
+        logging.info("⚠️ No HyperLab VMs restored. Skipping start operation.")
+        return
+    restore_seconds = time.monotonic() - reset_start
+
+    start_begin = time.monotonic()
+    ready = start_in_waves([vm for vm, result in restored.items() if result["Success"]], wait=wait, timeout=timeout)
+    start_seconds = time.monotonic() - start_begin
+
+    rows = []
+    for (host, vm_name), result in sorted(restored.items()):
+        if not result["Success"]:
+            status = "restore failed"
+        elif (host, vm_name) not in ready:
+            status = "not started"
+        elif not wait:
+            status = "started"
+        elif ready[(host, vm_name)] is None:
+            status = "not ready"
+        else:
+            status = f"ready after {ready[(host, vm_name)]:.1f}s"
+        rows.append([host, vm_name, role_of(vm_name), f"{result['Seconds']:.1f}s", status])
+    ready_count = sum(1 for seconds in ready.values() if seconds is not None)
+    logging.info("📋 Lab reset summary:\n" + tabulate(rows, headers=["Host", "VM", "Role", "Restore", "Status"]))
+    logging.info(f"🏁 Lab reset to '{checkpoint}' in {time.monotonic() - reset_start:.1f}s "
+                 f"(restore {restore_seconds:.1f}s, start {start_seconds:.1f}s"
+                 + (f", {ready_count}/{len(restored)} ready)" if wait else ")"))
+
+
+@task
+def provision_workers(c, count=0, total=0, memory_mb=WORKER_MEMORY_MB, cpus=WORKER_CPUS, nested=True,
+                      switch=WORKER_SWITCH, golden=GOLDEN_VHDX, disk_dir=WORKER_DISK_DIR, host="", start=False,
+                      register=True, dry_run=False):
+    """
+    Create --count new workers (or enough for --total) from the golden image on differencing disks.
+
+    Workers are placed on the hosts with the most uncommitted memory (or on --host), all
+    hosts in parallel and each host's workers as throttled Hyper-V jobs. Each worker gets a
+    static MAC, which --register records in the network index right away.
+    """
+    from tabulate import tabulate
+
+    capacities = {host_name: result.value for host_name, result in
+                  on_vm_hosts(lambda host_name, conn: read_capacity(conn, golden, disk_dir)).items()}
+    if None in capacities.values():
+        logging.error("⚠️ Not every VM host could be read, so new worker names might clash. Aborting.")
+        return
+    existing = [name for capacity in capacities.values() for name in capacity["VMs"]
+                if name.lower().startswith(WORKER_PREFIX)]
+    count = int(count) or max(0, int(total) - len(existing))
+    if not count:
+        logging.info(f"✅ Already {len(existing)} workers, nothing to provision.")
+        return
+
+    candidates = {name: capacity for name, capacity in capacities.items() if not host or name == host}
+    for name, capacity in candidates.items():
+        if not capacity["Golden"]:
+            logging.warning(f"⚠️ {name} has no golden image at {golden}; not placing workers there.")
+    names = next_worker_names([name for capacity in capacities.values() for name in capacity["VMs"]], count)
+    placement, unplaced = plan_placement(candidates, names, int(memory_mb))
+    if unplaced:
+        logging.error(f"⚠️ No host has {memory_mb} MB uncommitted for: {', '.join(unplaced)}")
+    macs = dict(zip(names, new_macs(len(names), [mac for capacity in capacities.values() for mac in capacity["Macs"]]
+                                    + [entry["MAC"] for entry in network_index.entries()])))
+    rows = []
+    for host_name, workers in placement.items():
+        disk_needed = len(workers) * WORKER_DISK_BUDGET_GB
+        free_disk = capacities[host_name]["FreeDiskGB"]
+        if free_disk is not None and free_disk < disk_needed:
+            logging.warning(f"⚠️ {host_name} has {free_disk} GB free for {disk_needed} GB of new differencing disks.")
+        rows += [[host_name, name, macs[name], memory_mb, cpus, "on" if nested else "off"] for name in workers]
+    if not rows:
+        return
+    logging.info("🧬 Worker plan:\n" + tabulate(rows, headers=["Host", "VM", "MAC", "Memory MB", "CPUs", "Nested"]))
+    if dry_run:
+        return
 
-        for vm_name in vms:
-            result = execute_command(conn, f'Stop-VM -Name {vm_name}')
-            if result is not None:
-                logging.info(f"🛑 Stopped {vm_name} on {host}")
+    def on_host(host_name, conn):
+        workers = placement[host_name]
+        script = create_script({name: macs[name] for name in workers}, golden=golden, disk_dir=disk_dir,
+                               memory_mb=memory_mb, cpus=cpus, nested=nested, switch=switch, start=start)
+        results = run_vm_jobs(conn, "New-VM", workers, script=script)
+        inventory.invalidate(host_name)
+        if results is None:
+            logging.error(f"⚠️ Could not create workers on {host_name}.")
+            return None
+        for result in results:
+            if result["Success"]:
+                logging.info(f"🧬 Created {result['VMName']} on {host_name} ({result['Seconds']:.1f}s)")
             else:
-                logging.error(f"⚠️ Failed to stop {vm_name} on {host}.")
+                logging.error(f"⚠️ Failed to create {result['VMName']} on {host_name}: {result['Error']}")
+        if register and any(result["Success"] for result in results):
+            network_index.refresh(conn, full=True)
+        return results
+
+    results = on_vm_hosts(on_host, hosts=list(placement))
+    created = sum(1 for result in results.values() for vm in result.value or [] if vm["Success"])
+    logging.info(f"🏁 Provisioned {created}/{len(names)} workers"
+                 + (", registered in the network index" if register and created else ""))
+
+
+@task
+def stop_all_vms(c):
+    """Stop all running VMs on all VM hosts."""
+    on_vm_hosts(lambda host, conn: ensure_host(host, conn, [{"pattern": "*", "state": "stopped"}], pattern="*"))
 
 
 @task
 def save_vm(c, vm_name):
     """Save (pause) a specific VM on all VM hosts."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
 
+    def on_host(host, conn):
         result = execute_command(conn, f'Save-VM -Name {vm_name}')
+        inventory.invalidate(host, [vm_name])
         if result is not None:
             logging.info(f"💾 Saved state of {vm_name} on {host}")
         else:
             logging.error(f"⚠️ Failed to save state of {vm_name} on {host}.")
 
+    on_vm_hosts(on_host)
+
 
 @task
 def wake_on_lan(c, host):
     """Send a Wake-on-LAN magic packet."""
-    mac_bytes = bytes.fromhex(MAC_ADDRESSES[host].replace(':', '').replace('-', ''))
-    magic_packet = b'\xff' * 6 + mac_bytes * 16
+    send_magic_packet(MAC_ADDRESSES[host])
+
+
+@task
+def wake_and_wait(c, host, timeout=300, start=False):
+    """Wake a host, wait until SSH and Hyper-V are ready, and optionally continue with start_lab (--start)."""
+    timings = wake_host(host, MAC_ADDRESSES[host], timeout=float(timeout))
+    breakdown = ", ".join(f"{phase} {timings[phase]}s" for phase in ("ping", "ssh", "hyperv") if phase in timings)
+
+    if not timings["ready"]:
+        logging.error(f"❌ {host} not ready after {timings['total']}s "
+                      f"(stuck waiting for {timings['failed_phase']}; {breakdown or 'no response'})")
+        return
 
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sock.sendto(magic_packet, ('255.255.255.255', 9))
+    logging.info(f"✅ {host} ready in {timings['total']}s ({breakdown})")
+    if start:
+        start_lab(c)
 
 
 @task
 def get_host_mac(c):
     """Retrieve the MAC address of the primary network adapter for each host."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
 
+    def on_host(host, conn):
         command = 'Get-NetAdapter | Where-Object { $_.Status -eq `"Up`" } | Select-Object -ExpandProperty MacAddress'
         result = execute_command(conn, command)
 
@@ -307,15 +942,14 @@ def get_host_mac(c):
         else:
             logging.error(f"⚠️ Failed to retrieve MAC address for {host}.")
 
+    on_vm_hosts(on_host)
+
 
 @task
 def get_host_mac(c):
     """Retrieve the MAC address of the primary network adapter for each host."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
 
+    def on_host(host, conn):
         command = 'wmic nic where "NetEnabled=true" get MACAddress'
         result = execute_command(conn, command)
 
@@ -328,57 +962,131 @@ def get_host_mac(c):
         else:
             logging.error(f"⚠️ Failed to retrieve MAC address for {host}.")
 
+    on_vm_hosts(on_host)
 
-@task
-def shutdown_host(c):
-    """Shutdown the host machine."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
 
-        logging.info(f"🛑 Shutting down {host}...")
-        result = execute_command(conn, 'powershell -ExecutionPolicy Bypass -NoProfile -Command "Stop-Computer -Force"')
+def power_down_host(host, conn, action, vm_state="saved", pattern=HYPERLAB_PATTERN, budget=QUIESCE_BUDGET,
+                    force=False, wait=True):
+    """
+    Save or stop a host's lab VMs, confirm they got there, and only then issue the host power action.
 
-        if result is not None:
-            logging.info(f"✅ {host} is shutting down.")
+    Every running VM is quiesced at once as throttled Hyper-V jobs within `budget` seconds, and
+    their states are confirmed in one query. The host is left alone if any VM is still running
+    or in transition, unless `force` is set.
+
+    Args:
+        host (str): The host name.
+        conn (fabric.Connection): Connection to the host.
+        action (str): "shutdown", "restart" or "hibernate" (see power.POWER_ACTIONS).
+        vm_state (str): "saved" to keep the guests' memory, or "stopped" to shut them down.
+        pattern (str): Get-VM wildcard selecting the VMs to quiesce.
+        budget (float): Seconds the VMs get to reach `vm_state`.
+        force (bool): Power down even if some VMs did not reach a safe state.
+        wait (bool): Wait for a host that shuts down or hibernates to go offline.
+
+    Returns:
+        dict: Seconds spent in each phase, with structure:
+        {"quiesce": 41.2, "confirm": 0.4, "power": 0.3, "offline": 12.8, "total": 54.7,
+         "powered": true, "failed_phase": null}
+    """
+    start = time.monotonic()
+    timings = {"powered": False, "failed_phase": None}
+
+    def phase(name, phase_start):
+        timings[name] = round(time.monotonic() - phase_start, 2)
+        return time.monotonic()
+
+    vms = read_state(conn, pattern)
+    running = {}
+    for vm in vms or []:
+        command = STATE_COMMANDS[vm_state].get(vm["State"])
+        if command:
+            running.setdefault(command, []).append(vm["Name"])
+    for command, vm_names in running.items():
+        cmdlet = command.split()[0]
+        run_vm_batch(host, conn, command, f"{ENSURE_MESSAGES[cmdlet]} {{vm_name}} on {{host}}",
+                     f"⚠️ {cmdlet} failed for {{vm_name}} on {{host}}.", vm_names=vm_names, as_jobs=True,
+                     deadline=start + budget)
+    phase_start = phase("quiesce", start)
+
+    # Jobs left running past the budget show up here as VMs still saving or stopping
+    vms = read_state(conn, pattern) if vms is not None else None
+    phase_start = phase("confirm", phase_start)
+    if vms is None:
+        logging.error(f"⚠️ Failed to read the VM state on {host}.")
+        unsettled = ["(unknown)"]
+    else:
+        unsettled = [f"{vm['Name']} ({vm['State']})" for vm in vms if vm["State"] not in SETTLED_STATES["stopped"]]
+    if unsettled:
+        logging.error(f"⚠️ {len(unsettled)} VMs on {host} not saved or off: {', '.join(unsettled)}")
+        if not force:
+            timings["failed_phase"] = "confirm"
+            timings["total"] = round(time.monotonic() - start, 2)
+            return timings
+
+    if not power_action(conn, action):
+        timings["failed_phase"] = "power"
+        timings["total"] = round(time.monotonic() - start, 2)
+        return timings
+    timings["powered"] = True
+    # The host goes away with the connection and its session, so later tasks reconnect
+    pool.discard(host, conn.user)
+    inventory.invalidate(host)
+    phase_start = phase("power", phase_start)
+
+    if wait and action != "restart":
+        if not wait_offline(host):
+            timings["failed_phase"] = "offline"
+        phase("offline", phase_start)
+    timings["total"] = round(time.monotonic() - start, 2)
+    return timings
+
+
+def power_down_hosts(action, vm_state, budget, force, wait, done_message):
+    """Run power_down_host on every VM host and log each host's per-phase timings."""
+    if vm_state not in ("saved", "stopped"):
+        logging.error(f"⚠️ Invalid --vm-state '{vm_state}': use saved or stopped.")
+        return
+
+    def on_host(host, conn):
+        logging.info(f"🔌 Powering down {host} ({action}), {vm_state} VMs first...")
+        timings = power_down_host(host, conn, action, vm_state=vm_state, budget=float(budget), force=force,
+                                  wait=wait)
+        breakdown = ", ".join(f"{phase} {timings[phase]}s" for phase in ("quiesce", "confirm", "power", "offline")
+                              if phase in timings)
+        if not timings["powered"]:
+            logging.error(f"❌ {host} left powered on after {timings['total']}s "
+                          f"(failed at {timings['failed_phase']}; {breakdown})")
+        elif timings["failed_phase"]:
+            logging.warning(f"⚠️ {host} still accepts SSH {timings['total']}s after {action} ({breakdown})")
         else:
-            logging.error(f"⚠️ Failed to shut down {host}.")
+            logging.info(f"✅ {host} {done_message} after {timings['total']}s ({breakdown})")
+        return timings
 
+    on_vm_hosts(on_host)
 
-@task
-def hibernate_host(c):
-    """Hibernate the host machine."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
 
-        logging.info(f"💤 Hibernating {host}...")
-        result = execute_command(conn, 'powershell -ExecutionPolicy Bypass -NoProfile -Command "shutdown /h"')
+@task
+def shutdown_host(c, vm_state="saved", budget=QUIESCE_BUDGET, force=False, wait=True):
+    """
+    Save the lab VMs, then shut down the host machine.
 
-        if result is not None:
-            logging.info(f"✅ {host} is hibernating.")
-        else:
-            logging.error(f"⚠️ Failed to hibernate {host}.")
+    --vm-state=stopped shuts the guests down instead. The host is only shut down once every
+    VM is confirmed saved or off within --budget seconds, unless --force is given.
+    """
+    power_down_hosts("shutdown", vm_state, budget, force, wait, "is shut down")
 
 
 @task
-def restart_host(c):
-    """Restart the host machine."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
+def hibernate_host(c, vm_state="saved", budget=QUIESCE_BUDGET, force=False, wait=True):
+    """Save the lab VMs, then hibernate the host machine (options as for shutdown-host)."""
+    power_down_hosts("hibernate", vm_state, budget, force, wait, "is hibernating")
 
-        logging.info(f"🔄 Restarting {host}...")
-        result = execute_command(conn,
-                                 'powershell -ExecutionPolicy Bypass -NoProfile -Command "Restart-Computer -Force"')
 
-        if result is not None:
-            logging.info(f"✅ {host} is restarting.")
-        else:
-            logging.error(f"⚠️ Failed to restart {host}.")
+@task
+def restart_host(c, vm_state="saved", budget=QUIESCE_BUDGET, force=False):
+    """Save the lab VMs, then restart the host machine (options as for shutdown-host)."""
+    power_down_hosts("restart", vm_state, budget, force, False, "is restarting")
 
 
 def get_ssh_key_path():
@@ -422,39 +1130,22 @@ def setup_ssh(c):
 
 
 @task
-def get_vm_macs(c):
-    """Retrieve VM names and their MAC addresses for all VM hosts."""
-    all_vms = []
-
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
+def get_vm_macs(c, fresh=False):
+    """Retrieve VM names and their MAC addresses for all VM hosts (use --fresh to re-query every VM)."""
 
+    def on_host(host):
         logging.info(f"🔍 Retrieving VM MAC addresses from {host}...")
+        if not refresh_network_index(host, full=fresh):
+            logging.error(f"⚠️ No VM MAC addresses found on {host}.")
+            return
 
-        # Force use of 64-bit PowerShell and load Hyper-V module
-        command = (
-            'powershell -NoProfile -ExecutionPolicy Bypass -Command "Get-VM | Get-VMNetworkAdapter | Select-Object VMName,MacAddress | ConvertTo-Json -Depth 1'
-        )
+        vms = [{"VMName": entry["VMName"], "MacAddress": entry["MAC"], "Host": host}
+               for entry in network_index.entries(host)]
+        logging.info(f"✅ Retrieved {len(vms)} VM MACs from {host}.")
+        return vms
 
-        result = execute_command(conn, command)
-
-        if result:
-            try:
-                vms = json.loads(result.strip())
-                if isinstance(vms, dict):  # Single VM case
-                    vms = [vms]
-
-                for vm in vms:
-                    vm["Host"] = host
-
-                all_vms.extend(vms)
-                logging.info(f"✅ Retrieved {len(vms)} VM MACs from {host}.")
-            except json.JSONDecodeError as e:
-                logging.error(f"⚠️ Failed to parse JSON from {host}: {e}\nRaw Output:\n{result}")
-        else:
-            logging.error(f"⚠️ No VM MAC addresses found on {host}.")
+    results = for_each_host(on_host, VM_HOSTS)
+    all_vms = [vm for result in results.values() for vm in result.value or []]
 
     if all_vms:
         print(json.dumps(all_vms, indent=4))
@@ -464,7 +1155,7 @@ def get_vm_macs(c):
 
 def retrieve_vm_macs_via_ssh(host):
     """
-    Retrieve VM MAC addresses via direct SSH and return as a list of dictionaries.
+    Retrieve VM MAC addresses from the network index, refreshing it from the host first.
 
     Args:
         host (str): The remote machine's hostname or IP.
@@ -472,68 +1163,23 @@ def retrieve_vm_macs_via_ssh(host):
     Returns:
         list[dict]: A list of VM MAC addresses with structure:
         [
-            {"Host": "atlas", "VMName": "VM1", "MacAddress": "00:15:5D:23:4A:12"},
-            {"Host": "atlas", "VMName": "VM2", "MacAddress": "00:15:5D:67:89:AB"}
+            {"Host": "atlas", "VMName": "VM1", "MacAddress": "00155D234A12"},
+            {"Host": "atlas", "VMName": "VM2", "MacAddress": "00155D6789AB"}
         ]
     """
-    username = getpass.getuser()
-    mac_list = []
-
-    try:
-        logging.info(f"🔍 Connecting via SSH to {host}...")
-
-        # Establish SSH connection
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(hostname=host, username=username)
-
-        logging.info(f"✅ SSH connection established with {host}")
-
-        # Run PowerShell command to retrieve VM MAC addresses
-        command = (
-            'powershell -NoProfile -ExecutionPolicy Bypass -Command '
-            '"Get-VM | Get-VMNetworkAdapter | Select-Object VMName,MacAddress | ConvertTo-Json -Depth 1"'
-        )
-        stdin, stdout, stderr = client.exec_command(command)
-
-        output = stdout.read().decode().strip()
-        error = stderr.read().decode().strip()
-
-        client.close()
-
-        if error:
-            logging.error(f"⚠️ PowerShell Error from {host}:\n{error}")
-            return mac_list  # Return empty list if error occurs
-
-        if output:
-            try:
-                vms = json.loads(output)
-
-                if isinstance(vms, dict):  # Single VM case
-                    vms = [vms]
-
-                for vm in vms:
-                    vm["Host"] = host  # Attach host info
-
-                mac_list.extend(vms)
-                logging.info(f"✅ Retrieved {len(vms)} VM MACs from {host}.")
-            except json.JSONDecodeError as e:
-                logging.error(f"⚠️ Failed to parse JSON from {host}: {e}\nRaw Output:\n{output}")
-
-    except Exception as e:
-        logging.error(f"❌ SSH connection failed to {host}: {e}")
-
-    return mac_list  # Return list of VM MAC addresses
+    if not refresh_network_index(host):
+        return []
+    mac_list = [{"VMName": entry["VMName"], "MacAddress": entry["MAC"], "Host": host}
+                for entry in network_index.entries(host)]
+    logging.info(f"✅ Retrieved {len(mac_list)} VM MACs from {host}.")
+    return mac_list
 
 
 @task
 def vm_macs(c):
     """Fabric task to retrieve VM MAC addresses via direct SSH and display them."""
-    all_vm_macs = []
-
-    for host in VM_HOSTS:
-        vm_macs = retrieve_vm_macs_via_ssh(host)
-        all_vm_macs.extend(vm_macs)
+    results = for_each_host(retrieve_vm_macs_via_ssh, VM_HOSTS)
+    all_vm_macs = [vm for result in results.values() for vm in result.value or []]
 
     # Print structured output
     if all_vm_macs:
@@ -544,7 +1190,7 @@ def vm_macs(c):
 
 def retrieve_vm_network_info(host):
     """
-    Retrieve VM names, MAC addresses, and IP addresses via SSH using PowerShell.
+    Retrieve VM names, MAC addresses, and IP addresses from the network index, refreshing it first.
 
     Args:
         host (str): The remote machine's hostname or IP.
@@ -552,96 +1198,106 @@ def retrieve_vm_network_info(host):
     Returns:
         list[dict]: A list of VM network information with structure:
         [
-            {"Host": "atlas", "VMName": "VM1", "IP": "192.168.1.101", "MAC": "00:15:5D:23:4A:12"},
-            {"Host": "atlas", "VMName": "VM2", "IP": "192.168.1.102", "MAC": "00:15:5D:67:89:AB"}
+            {"Host": "atlas", "VMName": "VM1", "IP": "192.168.1.101", "MAC": "00155D234A12"},
+            {"Host": "atlas", "VMName": "VM2", "IP": "192.168.1.102", "MAC": "00155D6789AB"}
         ]
     """
-    username = getpass.getuser()
-    vm_network_info = []
+    if not refresh_network_index(host):
+        return []
+    return [{"Host": host, "VMName": entry["VMName"], "MAC": entry["MAC"], "IP": entry["IP"] or "Unknown"}
+            for entry in network_index.entries(host)]
 
-    try:
-        logging.info(f"🔍 Connecting via SSH to {host}...")
-
-        # Establish SSH connection
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(hostname=host, username=username)
-
-        logging.info(f"✅ SSH connection established with {host}")
-
-        # PowerShell command to get VM Names, MAC addresses, and IP addresses
-        command = (
-            'powershell -NoProfile -ExecutionPolicy Bypass -Command '
-            '"Get-VM | Get-VMNetworkAdapter | Select-Object VMName, MacAddress, IPAddresses | '
-            'ConvertTo-Json -Depth 2"'
-        )
-
-        stdin, stdout, stderr = client.exec_command(command)
 
-        output = stdout.read().decode().strip()
-        error = stderr.read().decode().strip()
+def refresh_network_index(host, full=False):
+    """Refresh the network index for a host, re-querying only changed VMs unless full is set."""
+    conn = get_connection(host)
+    if not conn:
+        return None
+    stats = network_index.refresh(conn, full=full)
+    if stats is None:
+        logging.error(f"⚠️ Failed to refresh the network index from {host}.")
+    return stats
 
-        client.close()
 
-        if error:
-            logging.error(f"⚠️ PowerShell Error from {host}:\n{error}")
-            return vm_network_info  # Return empty list if error occurs
+def lookup_vm_ips(host):
+    """Return {vm_name: ip} for the VMs on a host that currently report an IP address."""
+    refresh_network_index(host)
+    return network_index.vm_ips(host)
 
-        if output:
-            try:
-                vms = json.loads(output)
 
-                if isinstance(vms, dict):  # Single VM case
-                    vms = [vms]
+@task
+def get_vm_net_info(c):
+    """Fabric task to retrieve VM names, MAC, and IP addresses via SSH."""
+    results = for_each_host(retrieve_vm_network_info, VM_HOSTS)
+    all_vm_network_data = [vm for result in results.values() for vm in result.value or []]
 
-                for vm in vms:
-                    ip_addresses = vm.get("IPAddresses", [])
-                    primary_ip = ip_addresses[0] if ip_addresses else "Unknown"
+    # Print structured output
+    if all_vm_network_data:
+        print(json.dumps(all_vm_network_data, indent=4))
+    else:
+        logging.info("⚠️ No VM network information retrieved.")
 
-                    vm_data = {
-                        "Host": host,
-                        "VMName": vm.get("VMName", "Unknown"),
-                        "MAC": vm.get("MacAddress", "Unknown"),
-                        "IP": primary_ip
-                    }
 
-                    vm_network_info.append(vm_data)
+@task
+def lookup_vm(c, key, refresh=False):
+    """
+    Look up VMs by name, MAC address or IP address in the local network index.
 
-                logging.info(f"✅ Retrieved {len(vm_network_info)} VM network entries from {host}.")
+    Answers from the index without contacting the hosts; --refresh (or a miss) refreshes it first.
+    """
+    matches = [] if refresh else network_index.lookup(key)
+    if not matches:
+        for_each_host(refresh_network_index, VM_HOSTS)
+        matches = network_index.lookup(key)
 
-            except json.JSONDecodeError as e:
-                logging.error(f"⚠️ Failed to parse JSON from {host}: {e}\nRaw Output:\n{output}")
+    if matches:
+        print(json.dumps(matches, indent=4))
+    else:
+        logging.info(f"⚠️ No VM found for {key}.")
 
-    except Exception as e:
-        logging.error(f"❌ SSH connection failed to {host}: {e}")
 
-    return vm_network_info  # Return list of VM network information
+@task
+def health(c, timeout=HEALTH_TIMEOUT, pattern=HYPERLAB_PATTERN, metallb_config=METALLB_MANIFEST):
+    """
+    Probe SSH, kube-apiserver and kubelet on the lab VMs and the MetalLB pool addresses, printed as one table.
 
+    All probes run concurrently, so the sweep takes about --timeout seconds however many there are.
+    VM IPs come from the network index, refreshed from the hosts first.
+    """
+    from tabulate import tabulate
+
+    results = for_each_host(retrieve_vm_network_info, VM_HOSTS)
+    vms = [vm for result in results.values() for vm in result.value or []
+           if fnmatch.fnmatch(vm["VMName"].lower(), pattern.lower())]
+    targets = health_targets(primary_vms(vms), metallb_addresses(metallb_config) if metallb_config else [])
+    if not targets:
+        logging.info("⚠️ Nothing to probe.")
+        return
 
-@task
-def get_vm_net_info(c):
-    """Fabric task to retrieve VM names, MAC, and IP addresses via SSH."""
-    all_vm_network_data = []
+    start = time.monotonic()
+    probes = sweep(targets, timeout=float(timeout))
+    elapsed = time.monotonic() - start
 
-    for host in VM_HOSTS:
-        network_data = retrieve_vm_network_info(host)
-        all_vm_network_data.extend(network_data)
+    rows = [[probe["Target"], probe["Host"], probe["Address"] or "-", probe["Check"], probe["Port"], probe["Status"],
+             probe["LatencyMs"] if probe["LatencyMs"] is not None else "-", probe["Detail"]] for probe in probes]
+    table = tabulate(rows, headers=["Target", "Host", "Address", "Check", "Port", "Status", "Latency ms", "Detail"])
+    logging.info(f"🩺 Health:\n{table}")
 
-    # Print structured output
-    if all_vm_network_data:
-        print(json.dumps(all_vm_network_data, indent=4))
-    else:
-        logging.info("⚠️ No VM network information retrieved.")
+    vm_probes = [probe for probe in probes if probe["Target"] != "metallb"]
+    pool_probes = [probe for probe in probes if probe["Target"] == "metallb"]
+    healthy = sum(1 for probe in vm_probes if probe["Status"] == "up")
+    # A refused connection still means some node answers for the address
+    answering = {probe["Address"] for probe in pool_probes if probe["Status"] in ("up", "refused")}
+    pool = {probe["Address"] for probe in pool_probes}
+    logging.info(f"🏁 {healthy}/{len(vm_probes)} VM checks up, {len(answering)}/{len(pool)} MetalLB addresses "
+                 f"answering, {len(probes)} probes in {elapsed:.1f}s")
 
 
 @task
 def enable_nested_virtualization(c, vm_name):
     """Enable Nested Virtualization for a specific VM."""
-    for host in VM_HOSTS:
-        conn = get_connection(host)
-        if not conn:
-            continue
 
+    def on_host(host, conn):
         logging.info(f"🔧 Enabling Nested Virtualization for {vm_name} on {host}...")
 
         # PowerShell command to enable Nested Virtualization
@@ -653,8 +1309,78 @@ def enable_nested_virtualization(c, vm_name):
         else:
             logging.error(f"⚠️ Failed to enable Nested Virtualization for {vm_name} on {host}.")
 
+    on_vm_hosts(on_host)
+
+
+@task
+def rebalance_memory(c, apply=False, samples=3, interval=2):
+    """
+    Right-size dynamic memory of the running hyperlab VMs from their sampled peak demand.
+
+    Shows the planned changes by default; use --apply to make them, in one call per host.
+    """
+    from tabulate import tabulate
+
+    def on_host(host, conn):
+        sample = sample_memory(conn, HYPERLAB_PATTERN, samples=samples, interval=interval)
+        if sample is None:
+            logging.error(f"⚠️ Failed to sample memory on {host}.")
+            return
+        plans = plan_memory(sample)
+        if not plans:
+            logging.info(f"ℹ️ No running hyperlab VMs with dynamic memory on {host}.")
+            return
+
+        def change(plan, key):
+            old, new = plan["Current"][key], plan["Target"][key]
+            return str(old) if old == new else f"{old} → {new}"
+
+        rows = [
+            [plan["Name"], plan["Role"], plan["DemandMB"], plan["Pressure"], change(plan, "MinimumMB"),
+             change(plan, "StartupMB"), change(plan, "MaximumMB"), plan["Note"]]
+            for plan in plans
+        ]
+        table = tabulate(rows, headers=["VM", "Role", "Peak demand(M)", "Pressure", "Minimum(M)", "Startup(M)",
+                                        "Maximum(M)", "Note"])
+        logging.info(f"🧮 {host} memory plan ({sample['FreeMB']}/{sample['TotalMB']} MB free):\n{table}")
+        if not minimums_fit(sample, plans):
+            logging.warning(f"⚠️ Planned minimums on {host} exceed its memory less the {HOST_RESERVE_MB} MB reserve.")
+
+        if not apply:
+            return
+        results = apply_memory(conn, plans)
+        if results is None:
+            logging.error(f"⚠️ Failed to apply memory changes on {host}.")
+            return
+        inventory.invalidate(host, [result["VMName"] for result in results])
+        for result in results:
+            if result["Success"]:
+                logging.info(f"✅ Memory updated for {result['VMName']} on {host}")
+            else:
+                logging.error(f"❌ Failed to update memory for {result['VMName']} on {host}: {result['Error']}")
+        if not results:
+            logging.info(f"ℹ️ No memory changes can be applied on {host} while the VMs are running.")
+
+    on_vm_hosts(on_host)
+
+
+@task
+def daemon(c, port=DAEMON_PORT):
+    """
+    Run the HyperLab daemon, keeping connections, inventory and metrics warm between tasks.
+
+    While it runs, hyperlab.bat forwards tasks to it over a loopback port instead of starting
+    a new Python process per task. Stop it with Ctrl-C; restart it after updating the code.
+    """
+    from invoke import Collection
+
+    serve(Collection.from_module(sys.modules[__name__]), port=int(port))
+
 
 @task
 def lst(c):
-    c.run("fab --list")
+    """List the available tasks (same as --list, without starting another interpreter)."""
+    from fabric.main import make_program
+
+    make_program().run(["fab", f"--search-root={os.path.dirname(os.path.abspath(__file__))}", "--list"], exit=False)
 
@@ -0,0 +1,100 @@
+"""
+Thin command line client: forwards a fab command line to a running HyperLab daemon and
+streams its output back, or runs the task in this process when no daemon is running.
+
+Usage: python -m hyperlab_control.client <fab arguments>
+"""
+import json
+import os
+import socket
+import sys
+
+from hyperlab_control.daemon import DAEMON_STATE_FILE
+
+# Tasks that need the local terminal (prompts, Ctrl-C to stop) and always run in this process
+LOCAL_TASKS = {"daemon", "monitor", "setup-ssh", "setup_ssh"}
+
+# Command lines answered by reading the fabfile instead of importing fabric
+LIST_COMMANDS = [["--list"], ["-l"], ["lst"]]
+
+# Seconds to wait for the daemon to accept the connection before running in-process
+CONNECT_TIMEOUT = 0.5
+
+
+def forward(argv, state_file=DAEMON_STATE_FILE):
+    """
+    Run a fab command line on the daemon, streaming its output to stdout and stderr.
+
+    Returns:
+        int | None: The task's exit code, or None if no daemon could be reached.
+    """
+    try:
+        with open(state_file) as daemon_state:
+            state = json.load(daemon_state)
+        sock = socket.create_connection(("127.0.0.1", state["port"]), timeout=CONNECT_TIMEOUT)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    with sock:
+        sock.settimeout(None)
+        sock.sendall((json.dumps({"token": state["token"], "argv": argv}) + "\n").encode("utf-8"))
+        for line in sock.makefile("rb"):
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            stream = sys.stdout if "out" in message else sys.stderr
+            stream.write(message.get("out", message.get("err", "")))
+            stream.flush()
+    # The task may already have done its work, so it is not retried in-process
+    print("Connection to the HyperLab daemon was lost before the task finished.", file=sys.stderr)
+    return 1
+
+
+def list_tasks(fabfile="fabfile.py"):
+    """Print the fabfile's tasks like `fab --list`, read from its source so fabric is never imported."""
+    import ast
+
+    with open(fabfile, encoding="utf-8") as source:
+        tree = ast.parse(source.read())
+    tasks = {}
+    for node in tree.body:
+        decorators = [decorator.func if isinstance(decorator, ast.Call) else decorator
+                      for decorator in getattr(node, "decorator_list", [])]
+        if isinstance(node, ast.FunctionDef) and any(getattr(d, "id", None) == "task" for d in decorators):
+            docstring = (ast.get_docstring(node) or "").splitlines()
+            tasks[node.name.replace("_", "-")] = docstring[0] if docstring else ""
+    import shutil
+    import textwrap
+
+    width = max(map(len, tasks), default=0)
+    indent = " " * (width + 5)
+    columns = shutil.get_terminal_size().columns
+    print("Available tasks:\n")
+    for name in sorted(tasks):
+        lines = textwrap.wrap(tasks[name], width=max(20, columns - len(indent) - 1)) or [""]
+        print(f"  {name.ljust(width)}   {lines[0]}".rstrip())
+        for line in lines[1:]:
+            print(indent + line)
+    print()
+
+
+def run_in_process(argv):
+    from fabric.main import program
+
+    program.run(["fab", "--collection=fabfile", *argv])
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv in LIST_COMMANDS and os.path.exists("fabfile.py"):
+        list_tasks()
+        return
+    if not LOCAL_TASKS.intersection(argv):
+        code = forward(argv)
+        if code is not None:
+            sys.exit(code)
+    run_in_process(argv)
+
+
+if __name__ == "__main__":
+    main()
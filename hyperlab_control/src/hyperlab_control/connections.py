@@ -0,0 +1,119 @@
+import atexit
+import getpass
+import logging
+import socket
+import threading
+
+from hyperlab_control.metrics import metrics
+from hyperlab_control.timeouts import CONNECT_TIMEOUT, capped
+
+# Seconds between SSH keepalive packets on pooled transports
+KEEPALIVE_INTERVAL = 30
+
+
+class ConnectionPool:
+    """
+    Keep one authenticated SSH connection per (host, user) alive and share it.
+
+    Every command runs as a new channel on the pooled transport, so repeated
+    tasks against the same host only pay for the SSH handshake once.
+    """
+
+    def __init__(self, keepalive=KEEPALIVE_INTERVAL, connect_kwargs=None):
+        self.keepalive = keepalive
+        self.connect_kwargs = connect_kwargs or {}
+        self._connections = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, user=None):
+        """Return a live connection to the host, opening or replacing it if needed."""
+        user = user or getpass.getuser()
+        key = (host, user)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            conn = self._connections.get(key)
+            if conn is not None:
+                if self.is_alive(conn):
+                    return conn
+                logging.warning(f"♻️ Connection to {host} is dead, reconnecting...")
+                self._close(conn)
+
+            conn = self._open(host, user)
+            with self._lock:
+                self._connections[key] = conn
+            return conn
+
+    def _open(self, host, user):
+        from fabric import Connection
+
+        logging.info(f"🔄 Connecting to {host} as {user}...")
+        conn = Connection(host=host, user=user, connect_timeout=capped(CONNECT_TIMEOUT),
+                          connect_kwargs=dict(self.connect_kwargs))
+        if "sock" not in conn.connect_kwargs and conn.gateway is None:
+            # Open the TCP connection separately so its latency is not mixed into the SSH handshake
+            with metrics.timer("connect", host=host):
+                conn.connect_kwargs["sock"] = socket.create_connection((conn.host, conn.port), conn.connect_timeout)
+        try:
+            with metrics.timer("auth", host=host):
+                conn.open()
+        except Exception:
+            sock = conn.connect_kwargs.get("sock")
+            if sock is not None:
+                sock.close()
+            raise
+        if self.keepalive:
+            conn.transport.set_keepalive(self.keepalive)
+        return conn
+
+    @staticmethod
+    def is_alive(conn):
+        """Check that the connection's transport is still usable."""
+        transport = conn.transport
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def host_of(self, conn):
+        """Return the host name a pooled connection was requested for, as listed in VM_HOSTS."""
+        with self._lock:
+            for (host, _), pooled in self._connections.items():
+                if pooled is conn:
+                    return host
+        return conn.host
+
+    def discard(self, host, user=None):
+        """Drop the pooled connection for a host so the next get() reconnects."""
+        key = (host, user or getpass.getuser())
+        with self._lock:
+            conn = self._connections.pop(key, None)
+        if conn is not None:
+            self._close(conn)
+
+    def close_all(self):
+        """Close every pooled connection."""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logging.debug(f"Ignoring error while closing connection to {conn.host}: {e}")
+
+    def __len__(self):
+        return len(self._connections)
+
+
+pool = ConnectionPool()
+atexit.register(pool.close_all)
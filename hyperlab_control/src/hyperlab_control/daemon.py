@@ -0,0 +1,151 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import secrets
+import socketserver
+import threading
+import traceback
+
+# Loopback port the daemon listens on; 0 picks a free port and records it in DAEMON_STATE_FILE
+DAEMON_PORT = int(os.environ.get("HYPERLAB_DAEMON_PORT", 0))
+
+# Where a running daemon records its port and access token for clients
+DAEMON_STATE_FILE = os.environ.get(
+    "HYPERLAB_DAEMON_STATE", os.path.join(os.path.expanduser("~"), ".cache", "hyperlab", "daemon.json")
+)
+
+LOG_FORMAT = "%(asctime)s - [%(levelname)s] - %(message)s"
+
+# Protocol: the client sends one JSON line {"token": "...", "argv": ["list-hyperlab-vms", "--fresh"]}
+# and receives JSON lines {"out": text} and {"err": text} while the task runs, then {"exit": code}.
+
+
+class _StreamWriter(io.TextIOBase):
+    """File-like object forwarding everything written to it as one kind of message."""
+
+    def __init__(self, send, kind):
+        self._send = send
+        self._kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text:
+            self._send({self._kind: text})
+        return len(text)
+
+
+class _ForwardingHandler(logging.Handler):
+    def __init__(self, send):
+        super().__init__()
+        self._send = send
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def emit(self, record):
+        try:
+            self._send({"err": self.format(record) + "\n"})
+        except Exception:
+            self.handleError(record)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        if not isinstance(request, dict) or not secrets.compare_digest(str(request.get("token")), self.server.token):
+            logging.warning(f"🚫 Rejected daemon request from {self.client_address[0]}: bad token")
+            return
+        self.server.run_task(request.get("argv") or [], self._send)
+
+    def _send(self, message):
+        # A client that went away must not abort the task it started
+        with contextlib.suppress(OSError):
+            self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class DaemonServer(socketserver.ThreadingTCPServer):
+    """
+    Loopback server running fabric tasks in a long-lived process.
+
+    Tasks run against the process-wide connection pool, inventory cache and metrics,
+    so after the first invocation no task pays for imports, SSH handshakes or VM
+    discovery again. Tasks run one at a time, since their output is captured from
+    the process-wide stdout, stderr and root logger.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, namespace, port=DAEMON_PORT):
+        super().__init__(("127.0.0.1", port), _RequestHandler)
+        self.namespace = namespace
+        self.token = secrets.token_hex(16)
+        self._task_lock = threading.Lock()
+
+    def run_task(self, argv, send):
+        """Run one fab command line and stream its output and exit code through `send`."""
+        from fabric.main import make_program
+
+        with self._task_lock:
+            logging.info(f"📨 Daemon running: {' '.join(argv)}")
+            program = make_program()
+            program.namespace = self.namespace
+            handler = _ForwardingHandler(send)
+            logging.getLogger().addHandler(handler)
+            code = 0
+            try:
+                with contextlib.redirect_stdout(_StreamWriter(send, "out")), \
+                        contextlib.redirect_stderr(_StreamWriter(send, "err")):
+                    try:
+                        program.run(["fab", *argv])
+                    except SystemExit as e:
+                        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                    except Exception:
+                        traceback.print_exc()
+                        code = 1
+            finally:
+                logging.getLogger().removeHandler(handler)
+            send({"exit": code})
+
+    def write_state(self, path=DAEMON_STATE_FILE):
+        """Record the port and token so clients can find and authenticate to the daemon."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w") as state_file:
+            json.dump({"port": self.server_address[1], "token": self.token, "pid": os.getpid()}, state_file)
+
+    @staticmethod
+    def remove_state(path=DAEMON_STATE_FILE):
+        """Remove the state file if it still belongs to this process."""
+        with contextlib.suppress(OSError, ValueError):
+            with open(path) as state_file:
+                owner = json.load(state_file).get("pid")
+            if owner == os.getpid():
+                os.remove(path)
+
+
+def serve(namespace, port=DAEMON_PORT, state_file=DAEMON_STATE_FILE):
+    """
+    Serve fabric tasks from `namespace` on a loopback port until interrupted.
+
+    Args:
+        namespace (invoke.Collection): The tasks clients may run.
+        port (int): Loopback port, 0 for any free port.
+        state_file (str): Where to record the port and token for clients.
+    """
+    server = DaemonServer(namespace, port=port)
+    server.write_state(state_file)
+    logging.info(f"🛰️ HyperLab daemon listening on 127.0.0.1:{server.server_address[1]} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.remove_state(state_file)
+        logging.info("🛰️ HyperLab daemon stopped")
@@ -0,0 +1,139 @@
+import fnmatch
+
+from hyperlab_control.powershell import quote, run_json_script
+
+# Command taking a VM from its actual state to a desired one; actual states without an
+# entry are already there (or cannot get there, e.g. an Off VM cannot be saved)
+STATE_COMMANDS = {
+    "running": {"Off": "Start-VM -Name $name", "Saved": "Start-VM -Name $name", "Paused": "Resume-VM -Name $name"},
+    "off": {"Running": "Stop-VM -Name $name", "Paused": "Stop-VM -Name $name",
+            "Saved": "Remove-VMSavedState -VMName $name"},
+    "saved": {"Running": "Save-VM -Name $name", "Paused": "Save-VM -Name $name"},
+    # Not running, without discarding saved state
+    "stopped": {"Running": "Stop-VM -Name $name", "Paused": "Stop-VM -Name $name"},
+}
+
+# Hyper-V states that satisfy each desired state
+SETTLED_STATES = {"running": ["Running"], "off": ["Off"], "saved": ["Saved"], "stopped": ["Off", "Saved"]}
+
+# Everything ensure compares, for all matching VMs in one round trip
+STATE_SCRIPT = """
+$nested = @{{}}
+foreach ($processor in @(Get-VMProcessor -VMName {pattern} -ErrorAction SilentlyContinue)) {{
+    $nested[$processor.VMName] = $processor.ExposeVirtualizationExtensions
+}}
+$vms = foreach ($vm in @(Get-VM -Name {pattern})) {{
+    [pscustomobject]@{{
+        Name = $vm.Name
+        State = "$($vm.State)"
+        MemoryStartupMB = [math]::Round($vm.MemoryStartup / 1MB)
+        Nested = [bool]$nested[$vm.Name]
+    }}
+}}
+ConvertTo-Json -InputObject @($vms) -Compress -Depth 3
+"""
+
+
+def read_state(conn, pattern):
+    """
+    Read the power state and ensure-managed settings of the VMs matching a Get-VM wildcard.
+
+    Returns:
+        list[dict] | None: VMs with structure:
+        [
+            {"Name": "hyperlab-worker-1", "State": "Running", "MemoryStartupMB": 4096, "Nested": false}
+        ]
+        or None if the host could not be queried.
+    """
+    vms = run_json_script(conn, STATE_SCRIPT.format(pattern=quote(pattern)), retry_failures=True)
+    if vms is None:
+        return None
+    return [vm for vm in vms if vm]
+
+
+def desired_for(vm_name, specs):
+    """
+    Merge the specs matching a VM into its desired state; later specs override earlier ones.
+
+    Args:
+        vm_name (str): The VM name.
+        specs (list[dict]): Entries like {"pattern": "hyperlab-worker*", "state": "running",
+            "memory_mb": 4096, "nested": true}; every key but "pattern" is optional.
+
+    Returns:
+        dict | None: The desired state, or None if no spec matches the VM.
+    """
+    desired = None
+    for spec in specs:
+        if fnmatch.fnmatch(vm_name.lower(), spec.get("pattern", "*").lower()):
+            settings = {key: value for key, value in spec.items() if key != "pattern" and value is not None}
+            desired = dict(desired or {}, **settings)
+    return desired
+
+
+def plan_ensure(vms, specs):
+    """
+    Work out the commands bringing each VM to its desired state, and nothing more.
+
+    Memory and nested-virtualization changes need the VM off, so a running VM that needs
+    them is stopped first and then brought to its desired state, as is a saved or paused
+    VM that should be off anyway (its saved state is discarded). Changes to a saved or
+    paused VM that should keep its state are deferred, since stopping it would lose it.
+
+    Returns:
+        list[dict]: One plan per VM that needs changes, with structure:
+        [
+            {"Name": "hyperlab-worker-1", "State": "Running", "Target": "running", "First": "Stop-VM -Name $name",
+             "Configure": ["Set-VMProcessor -VMName 'hyperlab-worker-1' -ExposeVirtualizationExtensions $true"],
+             "Then": "Start-VM -Name $name", "Changes": ["nested on"], "Note": ""}
+        ]
+    """
+    plans = []
+    for vm in vms:
+        desired = desired_for(vm["Name"], specs)
+        if desired is None:
+            continue
+        target = desired.get("state")
+
+        configure, changes = [], []
+        memory_mb = desired.get("memory_mb")
+        if memory_mb and int(memory_mb) != vm["MemoryStartupMB"]:
+            configure.append(f"Set-VMMemory -VMName {quote(vm['Name'])} -StartupBytes {int(memory_mb)}MB")
+            changes.append(f"memory {vm['MemoryStartupMB']} -> {int(memory_mb)} MB")
+        nested = desired.get("nested")
+        if nested is not None and bool(nested) != vm["Nested"]:
+            configure.append(f"Set-VMProcessor -VMName {quote(vm['Name'])} "
+                             f"-ExposeVirtualizationExtensions ${'true' if nested else 'false'}")
+            changes.append(f"nested {'on' if nested else 'off'}")
+
+        state, first, note = vm["State"], None, ""
+        if configure and state != "Off":
+            if state == "Running" and target in (None, "running", "off", "stopped"):
+                first, state = "Stop-VM -Name $name", "Off"
+            elif state in ("Saved", "Paused") and target == "off":
+                first, state = STATE_COMMANDS["off"][state], "Off"
+            else:
+                note = f"{', '.join(changes)} deferred: needs the VM off"
+                configure, changes = [], []
+
+        if not target:
+            # Only settings were asked for, so a VM stopped to apply them is started again
+            then = "Start-VM -Name $name" if first else None
+        else:
+            then = STATE_COMMANDS[target].get(state)
+            if vm["State"] not in SETTLED_STATES[target]:
+                if then or first:
+                    changes.insert(0, f"{vm['State']} -> {target}")
+                else:
+                    note = note or f"cannot go from {vm['State']} to {target}"
+        if first or configure or then or note:
+            plans.append({"Name": vm["Name"], "State": vm["State"], "Target": target, "First": first,
+                          "Configure": configure, "Then": then, "Changes": changes, "Note": note})
+    return plans
+
+
+def configure_command(plans):
+    """Return a batch command applying each planned VM's settings, with the VM name in `$name`."""
+    blocks = "; ".join(f"{quote(plan['Name'])} = {{ {'; '.join(plan['Configure'])} }}"
+                       for plan in plans if plan["Configure"])
+    return f"& (@{{ {blocks} }}[$name])"
@@ -0,0 +1,129 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from hyperlab_control.timeouts import DeadlineExceeded, time_left
+
+# Maximum number of hosts worked on at the same time
+MAX_PARALLEL_HOSTS = 16
+
+# Maximum number of concurrent operations against a single host
+MAX_PER_HOST = 4
+
+HostResult = namedtuple("HostResult", ["host", "value", "error", "elapsed"])
+
+_local = threading.local()
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+
+class _HostLogBuffer(logging.Filter):
+    """
+    Hold back log records emitted by fan-out workers so they can be replayed in host order.
+
+    It filters the root logger's handlers rather than the root logger itself, since logger
+    filters never see records propagated from child loggers such as paramiko's.
+    """
+
+    def filter(self, record):
+        records = getattr(_local, "records", None)
+        if records is None:
+            return True
+        # Every root handler asks about the same record, but it is replayed only once
+        if not records or records[-1] is not record:
+            records.append(record)
+        return False
+
+
+_buffer = _HostLogBuffer()
+
+
+def _install_log_buffer():
+    """Attach the host log buffer to every root handler, including ones added since the last fan-out."""
+    for handler in logging.getLogger().handlers:
+        if _buffer not in handler.filters:
+            handler.addFilter(_buffer)
+
+
+@contextmanager
+def host_slot(host):
+    """Limit the number of concurrent operations against a single host."""
+    with _host_slots_lock:
+        slot = _host_slots.setdefault(host, threading.BoundedSemaphore(MAX_PER_HOST))
+    with slot:
+        yield
+
+
+def _run_buffered(func, host):
+    _local.records = records = []
+    start = time.perf_counter()
+    try:
+        with host_slot(host):
+            value = func(host)
+        return HostResult(host, value, None, time.perf_counter() - start), records
+    except Exception as e:
+        logging.error(f"❌ {host}: {e}")
+        return HostResult(host, None, e, time.perf_counter() - start), records
+    finally:
+        _local.records = None
+
+
+def for_each_host(func, hosts, max_workers=MAX_PARALLEL_HOSTS):
+    """
+    Run func(host) on all hosts concurrently and collect the results per host.
+
+    Log output produced by each host is buffered and replayed in the order of
+    `hosts`, so the output is deterministic no matter which host finishes first.
+
+    Args:
+        func (callable): The per-host body, called with the host name.
+        hosts (list[str]): The hosts to run on.
+        max_workers (int): Global cap on the number of hosts worked on at once.
+
+    Once the task deadline passes, hosts that have not finished are no longer waited
+    for: their result carries a DeadlineExceeded error and their output is dropped.
+
+    Returns:
+        dict[str, HostResult]: Results keyed by host, in the order of `hosts`.
+    """
+    hosts = list(dict.fromkeys(hosts))
+    results = {}
+    if not hosts:
+        return results
+
+    _install_log_buffer()
+    logger = logging.getLogger()
+    start = time.perf_counter()
+    expired = False
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(hosts)))
+    try:
+        # Each host runs in its own copy of the caller's context, so it sees the task deadline
+        futures = [executor.submit(contextvars.copy_context().run, _run_buffered, func, host) for host in hosts]
+        # Replay each host's output as soon as it and every host before it are done
+        for host, future in zip(hosts, futures):
+            try:
+                left = time_left()
+                result, records = future.result(timeout=None if left is None else max(left, 0))
+            except TimeoutError:
+                expired = True
+                error = DeadlineExceeded(f"Task deadline reached before {host} finished")
+                results[host] = HostResult(host, None, error, time.perf_counter() - start)
+                continue
+            for record in records:
+                logger.handle(record)
+            results[result.host] = result
+    finally:
+        # Hosts still working past the deadline are left to finish in the background
+        executor.shutdown(wait=not expired, cancel_futures=True)
+
+    timed_out = [host for host, result in results.items() if isinstance(result.error, TimeoutError)]
+    failed = [host for host, result in results.items() if result.error is not None and host not in timed_out]
+    if failed:
+        logging.error(f"⚠️ Failed on {len(failed)}/{len(hosts)} hosts: {', '.join(failed)}")
+    if timed_out:
+        logging.error(f"⏱️ Timed out on {len(timed_out)}/{len(hosts)} hosts: {', '.join(timed_out)}")
+    return results
@@ -0,0 +1,244 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import ssl
+import time
+
+import yaml
+
+from hyperlab_control.netindex import primary_ip
+from hyperlab_control.planner import role_of
+from hyperlab_control.timeouts import capped
+from hyperlab_control.wake import SSH_PORT
+
+# MetalLB manifest whose IPAddressPool addresses are swept; the fabfile falls back to the
+# manifest in the repository's cluster directory
+METALLB_CONFIG = os.environ.get("HYPERLAB_METALLB_CONFIG", "")
+
+# Seconds each probe may take; a whole sweep takes about this long however many targets there are
+HEALTH_TIMEOUT = float(os.environ.get("HYPERLAB_HEALTH_TIMEOUT", 3))
+
+# Probes in flight at once, kept to half the usual limit of 1024 open files; larger sweeps run in rounds
+HEALTH_CONCURRENCY = 512
+
+# Ports probed on every MetalLB pool address, for the LoadBalancer services usually behind them
+METALLB_PORTS = [80, 443]
+
+# Pool addresses swept at most, so a pool given as a large CIDR does not turn into a port scan
+METALLB_MAX_ADDRESSES = 256
+
+KUBE_APISERVER_PORT = 6443
+KUBELET_PORT = 10250
+
+# Checks run against each VM by lab role; roles not listed only get DEFAULT_CHECKS
+ROLE_CHECKS = {
+    "control-plane": ["ssh", "kube-apiserver", "kubelet"],
+    "worker": ["ssh", "kubelet"],
+}
+DEFAULT_CHECKS = ["ssh"]
+
+
+class Unhealthy(Exception):
+    """The service answered, but not with what a healthy one would."""
+
+
+def metallb_addresses(path=METALLB_CONFIG, limit=METALLB_MAX_ADDRESSES):
+    """
+    Read the addresses of every IPAddressPool in a MetalLB manifest.
+
+    Pool entries may be single addresses, CIDRs or 'first-last' ranges. Network and
+    broadcast addresses of IPv4 CIDRs are skipped, and no more than `limit` addresses
+    are returned.
+
+    Returns:
+        list[str]: The pool addresses, or an empty list if the manifest cannot be read.
+    """
+    try:
+        with open(path) as f:
+            documents = [document for document in yaml.safe_load_all(f) if document]
+    except (OSError, yaml.YAMLError) as e:
+        logging.error(f"⚠️ Failed to read MetalLB pools from {path}: {e}")
+        return []
+
+    addresses = []
+    for document in documents:
+        if document.get("kind") != "IPAddressPool":
+            continue
+        for entry in (document.get("spec") or {}).get("addresses") or []:
+            first, _, last = str(entry).partition("-")
+            if last:
+                start, end = ipaddress.ip_address(first.strip()), ipaddress.ip_address(last.strip())
+                pool = (ipaddress.ip_address(value) for value in range(int(start), int(end) + 1))
+            else:
+                network = ipaddress.ip_network(first.strip(), strict=False)
+                pool = network.hosts() if network.num_addresses > 2 else iter(network)
+            for address in pool:
+                if len(addresses) == limit:
+                    logging.warning(f"⚠️ MetalLB pools in {path} hold more than {limit} addresses, "
+                                    f"sweeping the first {limit}.")
+                    return addresses
+                addresses.append(str(address))
+    return addresses
+
+
+def primary_vms(vms):
+    """
+    Collapse network index entries, one per adapter, to one entry per VM.
+
+    Each VM keeps the primary address among those of all its adapters, so a VM with
+    several NICs is probed once.
+
+    Args:
+        vms (list[dict]): Entries with "Host", "VMName" and "IP" keys, in any order.
+
+    Returns:
+        list[dict]: One entry per (Host, VMName) in first-seen order, with IP "Unknown" if no adapter has one.
+    """
+    addresses = {}
+    for vm in vms:
+        ips = addresses.setdefault((vm["Host"], vm["VMName"]), [])
+        if vm.get("IP") not in (None, "", "Unknown"):
+            ips.append(vm["IP"])
+    return [{"Host": host, "VMName": name, "IP": primary_ip(ips) or "Unknown"}
+            for (host, name), ips in addresses.items()]
+
+
+def health_targets(vms, pool_addresses=(), pool_ports=METALLB_PORTS):
+    """
+    List the probes of a sweep.
+
+    Args:
+        vms (list[dict]): VMs with "Host", "VMName" and "IP" keys, as the network index lists them.
+        pool_addresses (list[str]): MetalLB pool addresses.
+        pool_ports (list[int]): Ports probed on each pool address.
+
+    Returns:
+        list[dict]: One probe each with structure:
+        {"Host": "atlas", "Target": "hyperlab-control-1", "Address": "192.168.8.20", "Check": "ssh", "Port": 22}
+        where Address is None for VMs without a known IP.
+    """
+    ports = {"ssh": SSH_PORT, "kube-apiserver": KUBE_APISERVER_PORT, "kubelet": KUBELET_PORT}
+    targets = []
+    for vm in vms:
+        ip = vm["IP"] if vm.get("IP") not in (None, "", "Unknown") else None
+        for check in ROLE_CHECKS.get(role_of(vm["VMName"]), DEFAULT_CHECKS):
+            targets.append({"Host": vm["Host"], "Target": vm["VMName"], "Address": ip, "Check": check,
+                            "Port": ports[check]})
+    for address in pool_addresses:
+        for port in pool_ports:
+            targets.append({"Host": "", "Target": "metallb", "Address": address, "Check": "tcp", "Port": port})
+    return targets
+
+
+def _tls_context():
+    """Return a TLS context for the lab's self-signed cluster certificates."""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def _close(writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, ssl.SSLError):
+        pass
+
+
+async def _probe_ssh(address, port):
+    reader, writer = await asyncio.open_connection(address, port)
+    try:
+        banner = (await reader.readline()).decode(errors="replace").strip()
+    finally:
+        await _close(writer)
+    if not banner.startswith("SSH-"):
+        raise Unhealthy(f"unexpected banner {banner[:40]!r}")
+    return banner
+
+
+async def _probe_apiserver(address, port):
+    reader, writer = await asyncio.open_connection(address, port, ssl=_tls_context())
+    try:
+        writer.write(f"GET /livez HTTP/1.1\r\nHost: {address}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status = (await reader.readline()).decode(errors="replace").split()
+    finally:
+        await _close(writer)
+    code = status[1] if len(status) > 1 else "?"
+    if code == "200":
+        return "livez ok"
+    if code in ("401", "403"):
+        # Serving, but anonymous access to the health endpoints has been turned off
+        return f"livez HTTP {code}"
+    raise Unhealthy(f"livez HTTP {code}")
+
+
+async def _probe_tls(address, port):
+    _, writer = await asyncio.open_connection(address, port, ssl=_tls_context())
+    await _close(writer)
+    return "TLS handshake ok"
+
+
+async def _probe_tcp(address, port):
+    _, writer = await asyncio.open_connection(address, port)
+    await _close(writer)
+    return "open"
+
+
+PROBES = {
+    "ssh": _probe_ssh,
+    "kube-apiserver": _probe_apiserver,
+    "kubelet": _probe_tls,
+    "tcp": _probe_tcp,
+}
+
+
+async def _run_probe(target, timeout, slots):
+    result = dict(target, Status="no-ip", LatencyMs=None, Detail="")
+    if target["Address"] is None:
+        return result
+    async with slots:
+        start = time.perf_counter()
+        try:
+            result["Detail"] = await asyncio.wait_for(PROBES[target["Check"]](target["Address"], target["Port"]),
+                                                      timeout)
+            result["Status"] = "up"
+        except asyncio.TimeoutError:
+            result["Status"] = "timeout"
+        except ConnectionRefusedError:
+            result["Status"] = "refused"
+        except Unhealthy as e:
+            result["Status"], result["Detail"] = "unhealthy", str(e)
+        except (OSError, ssl.SSLError, asyncio.IncompleteReadError) as e:
+            result["Status"], result["Detail"] = "error", str(e) or type(e).__name__
+        if result["Status"] != "timeout":
+            result["LatencyMs"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+async def _sweep(targets, timeout, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(_run_probe(target, timeout, slots) for target in targets))
+
+
+def sweep(targets, timeout=HEALTH_TIMEOUT, concurrency=HEALTH_CONCURRENCY):
+    """
+    Run every probe concurrently, each given at most `timeout` seconds.
+
+    Statuses are "up", "unhealthy" (answered wrongly), "refused", "timeout", "error"
+    and "no-ip" (nothing to probe).
+
+    Args:
+        targets (list[dict]): Probes from health_targets.
+        timeout (float): Seconds per probe, never past the task deadline.
+        concurrency (int): Probes in flight at once.
+
+    Returns:
+        list[dict]: The targets in order, each with "Status", "LatencyMs" (None on timeout
+        or without an IP) and "Detail" added.
+    """
+    if not targets:
+        return []
+    return asyncio.run(_sweep(targets, capped(float(timeout)), max(1, int(concurrency))))
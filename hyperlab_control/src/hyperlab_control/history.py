@@ -0,0 +1,446 @@
+import fnmatch
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+# SQLite file holding the host and VM metrics history
+HISTORY_FILE = os.environ.get(
+    "HYPERLAB_HISTORY", os.path.join(os.path.expanduser("~"), ".cache", "hyperlab", "history.sqlite3")
+)
+
+# Seconds between samples taken by the collector
+HISTORY_INTERVAL = 60
+
+# Days samples are kept at full resolution before they are averaged into HISTORY_DOWNSAMPLE_STEP buckets
+HISTORY_RAW_DAYS = int(os.environ.get("HYPERLAB_HISTORY_RAW_DAYS", 14))
+HISTORY_DOWNSAMPLE_STEP = 900
+
+# Days after which samples are deleted
+HISTORY_RETENTION_DAYS = int(os.environ.get("HYPERLAB_HISTORY_RETENTION_DAYS", 365))
+
+# Recorded metrics: name -> (scale, value from the host status or one of its VMs). Values are
+# stored as integers in units of 1/scale, which is what makes the delta encoding compact.
+HOST_METRICS = {
+    "disk_used_gb": (100, lambda status: status["Disk"]["UsedGB"]),
+    "disk_free_gb": (100, lambda status: status["Disk"]["FreeGB"]),
+    "uptime_s": (1, lambda status: status["UptimeSeconds"]),
+}
+VM_METRICS = {
+    "cpu_pct": (1, lambda vm: vm["CPUUsage"]),
+    "mem_assigned_mb": (1, lambda vm: (vm["MemoryAssigned"] or 0) / 2 ** 20),
+    "mem_demand_mb": (1, lambda vm: (vm["MemoryDemand"] or 0) / 2 ** 20),
+    "checkpoints": (1, lambda vm: len(vm.get("Checkpoints") or [])),
+}
+METRICS = {**HOST_METRICS, **VM_METRICS}
+
+# Ranking criteria of top(): value of a series' summary over the queried range
+TOP_CRITERIA = {
+    "growth": lambda summary: summary["last"] - summary["first"],
+    "mean": lambda summary: summary["sum"] / summary["count"],
+    "max": lambda summary: summary["max"],
+    "min": lambda summary: summary["min"],
+}
+
+# New samples land in `recent`. Once an hour they are packed into one block per series and
+# day, and blocks older than HISTORY_RAW_DAYS are downsampled. Each block keeps summary
+# columns, so ranking queries only decode the blocks cut by the queried range.
+SCHEMA = """
+PRAGMA auto_vacuum = INCREMENTAL;
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY, host TEXT NOT NULL, vm TEXT NOT NULL, metric TEXT NOT NULL,
+    UNIQUE (host, vm, metric)
+);
+CREATE TABLE IF NOT EXISTS recent (
+    series INTEGER NOT NULL, t INTEGER NOT NULL, value INTEGER NOT NULL,
+    PRIMARY KEY (series, t)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blocks (
+    series INTEGER NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL, step INTEGER NOT NULL,
+    count INTEGER NOT NULL, first INTEGER NOT NULL, last INTEGER NOT NULL,
+    min INTEGER NOT NULL, max INTEGER NOT NULL, sum INTEGER NOT NULL, data BLOB NOT NULL,
+    PRIMARY KEY (series, start)
+);
+CREATE INDEX IF NOT EXISTS blocks_end ON blocks (end);
+"""
+
+DAY = 86400
+HOUR = 3600
+
+
+def _put_varint(buffer, number):
+    # Zigzag first, so small negative deltas stay small
+    number = number * 2 if number >= 0 else -number * 2 - 1
+    while number >= 0x80:
+        buffer.append(number & 0x7F | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+
+def _varints(data):
+    number = shift = 0
+    for byte in data:
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield number >> 1 if not number & 1 else -(number >> 1) - 1
+        number = shift = 0
+
+
+def encode_block(times, values):
+    """
+    Pack a series' samples into a compressed blob.
+
+    Timestamps are stored as delta-of-deltas and values as deltas, both as zigzag varints,
+    so a regular sampling interval and slowly changing values take a fraction of a byte
+    per sample once compressed.
+
+    Args:
+        times (list[int]): Sample times in epoch seconds, ascending.
+        values (list[int]): Scaled integer values, one per time.
+    """
+    import zlib
+
+    buffer = bytearray()
+    previous_time, previous_delta, previous_value = times[0], 0, 0
+    for t, value in zip(times, values):
+        delta = t - previous_time
+        _put_varint(buffer, delta - previous_delta)
+        _put_varint(buffer, value - previous_value)
+        previous_time, previous_delta, previous_value = t, delta, value
+    return zlib.compress(bytes(buffer), 9)
+
+
+def decode_block(start, data):
+    """Unpack a blob made by encode_block into (times, values), given the block's first sample time."""
+    import zlib
+
+    numbers = _varints(zlib.decompress(data))
+    times, values = [], []
+    t, delta, value = start, 0, 0
+    for delta_of_delta in numbers:
+        delta += delta_of_delta
+        t += delta
+        value += next(numbers)
+        times.append(t)
+        values.append(value)
+    return times, values
+
+
+def parse_duration(spec):
+    """Turn a duration like '90s', '15m', '12h', '7d' or '2w' into seconds, or return None if it is not one."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([smhdw])", str(spec).strip())
+    if not match:
+        return None
+    return int(float(match.group(1)) * {"s": 1, "m": 60, "h": HOUR, "d": DAY, "w": 7 * DAY}[match.group(2)])
+
+
+def parse_time(spec, now=None):
+    """
+    Turn a time spec into epoch seconds.
+
+    Args:
+        spec (str): A duration before now like '12h' or '7d' (see parse_duration), an ISO
+            date or datetime like '2025-03-01' or '2025-03-01T08:00', or '' for now.
+    """
+    now = time.time() if now is None else now
+    spec = str(spec).strip()
+    if not spec:
+        return int(now)
+    duration = parse_duration(spec)
+    if duration is not None:
+        return int(now - duration)
+    return int(datetime.fromisoformat(spec).timestamp())
+
+
+def _summarize(times, values, since, until):
+    """Summary of the samples within [since, until], or None if there are none."""
+    selected = [value for t, value in zip(times, values) if since <= t <= until]
+    if not selected:
+        return None
+    return {"count": len(selected), "sum": sum(selected), "min": min(selected), "max": max(selected),
+            "first": selected[0], "last": selected[-1]}
+
+
+def _merge(summary, part):
+    """Append a later part's summary to a series' running summary."""
+    if summary is None:
+        return dict(part)
+    summary.update(count=summary["count"] + part["count"], sum=summary["sum"] + part["sum"],
+                   min=min(summary["min"], part["min"]), max=max(summary["max"], part["max"]), last=part["last"])
+    return summary
+
+
+class MetricsHistory:
+    """
+    Local SQLite time series of host and VM metrics, stored as compressed blocks.
+
+    A minute-by-minute sample of a few dozen VMs takes a few hundred KB per day at full
+    resolution and a fraction of that once downsampled, and range and ranking queries
+    only decode the blocks they need.
+    """
+
+    def __init__(self, path=HISTORY_FILE, raw_days=HISTORY_RAW_DAYS, retention_days=HISTORY_RETENTION_DAYS,
+                 downsample_step=HISTORY_DOWNSAMPLE_STEP):
+        self.path = path
+        self.raw_days = raw_days
+        self.retention_days = retention_days
+        self.downsample_step = downsample_step
+        self._db = None
+        self._series = {}
+        self._compacted_hour = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            import sqlite3
+
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.executescript(SCHEMA)
+            self._series = {(row["host"], row["vm"], row["metric"]): row["id"]
+                            for row in self._db.execute("SELECT * FROM series")}
+        return self._db
+
+    def _series_id(self, db, host, vm, metric):
+        key = (host, vm, metric)
+        if key not in self._series:
+            self._series[key] = db.execute("INSERT INTO series (host, vm, metric) VALUES (?, ?, ?)", key).lastrowid
+        return self._series[key]
+
+    def record(self, status, t=None):
+        """
+        Append one sample of every metric of a host status snapshot.
+
+        Args:
+            status (dict): A snapshot from status.collect_host_status.
+            t (int, optional): Sample time in epoch seconds, defaults to now.
+
+        Returns:
+            int: The number of values recorded.
+        """
+        t = int(time.time() if t is None else t)
+        rows = []
+        for metric, (scale, value_of) in HOST_METRICS.items():
+            rows.append((status["Host"], "", metric, value_of(status), scale))
+        for vm in status.get("VMs") or []:
+            for metric, (scale, value_of) in VM_METRICS.items():
+                rows.append((status["Host"], vm["Name"], metric, value_of(vm), scale))
+
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO recent VALUES (?, ?, ?)", [
+                    (self._series_id(db, host, vm, metric), t, round(value * scale))
+                    for host, vm, metric, value, scale in rows if value is not None
+                ])
+        return len(rows)
+
+    def compact(self, now=None, force=False):
+        """
+        Pack samples from before the current hour into their day's blocks, then downsample
+        and expire old blocks.
+
+        Only does work on the first call in each hour, unless forced, so it is cheap to
+        call after every sample.
+
+        Returns:
+            dict: Counts with structure {"Packed": 1920, "Downsampled": 0, "Expired": 0}.
+        """
+        now = int(time.time() if now is None else now)
+        hour_start = now // HOUR * HOUR
+        counts = {"Packed": 0, "Downsampled": 0, "Expired": 0}
+        with self._lock:
+            if hour_start == self._compacted_hour and not force:
+                return counts
+            db = self._connect()
+            rows = db.execute("SELECT series, t, value FROM recent WHERE t < ? ORDER BY series, t",
+                              (hour_start,)).fetchall()
+
+            with db:
+                # Samples join their series' block for the same day, so there is one block per series and day
+                days = {}
+                for row in rows:
+                    days.setdefault((row["series"], row["t"] // DAY), []).append((row["t"], row["value"]))
+                for (series, day), samples in days.items():
+                    step = 0
+                    for block in self._take_blocks(db, "series = ? AND start / ? = ?", (series, DAY, day)):
+                        samples += zip(*decode_block(block["start"], block["data"]))
+                        step = max(step, block["step"])
+                    if step:
+                        # Late samples for a day that was already downsampled are averaged into its
+                        # buckets, each existing bucket counting as one sample
+                        buckets = {}
+                        for t, value in samples:
+                            buckets.setdefault(t // step * step, []).append(value)
+                        samples = [(t, round(sum(bucket) / len(bucket))) for t, bucket in buckets.items()]
+                    times, values = zip(*sorted(samples))
+                    self._write_block(db, series, times, values, step)
+                db.execute("DELETE FROM recent WHERE t < ?", (hour_start,))
+                counts["Packed"] = len(rows)
+
+                step = self.downsample_step
+                for block in self._take_blocks(db, "step = 0 AND end < ?", (now - self.raw_days * DAY,)):
+                    buckets = {}
+                    for t, value in zip(*decode_block(block["start"], block["data"])):
+                        buckets.setdefault(t // step * step, []).append(value)
+                    times = sorted(buckets)
+                    self._write_block(db, block["series"], times,
+                                      [round(sum(buckets[t]) / len(buckets[t])) for t in times], step)
+                    counts["Downsampled"] += 1
+
+                counts["Expired"] = db.execute("DELETE FROM blocks WHERE end < ?",
+                                               (now - self.retention_days * DAY,)).rowcount
+                if counts["Expired"]:
+                    db.execute("DELETE FROM series WHERE id NOT IN (SELECT series FROM blocks) "
+                               "AND id NOT IN (SELECT series FROM recent)")
+                    self._series = {(row["host"], row["vm"], row["metric"]): row["id"]
+                                    for row in db.execute("SELECT * FROM series")}
+            if counts["Downsampled"] or counts["Expired"]:
+                db.execute("PRAGMA incremental_vacuum")
+            self._compacted_hour = hour_start
+        logging.debug(f"History compaction: {counts}")
+        return counts
+
+    @staticmethod
+    def _take_blocks(db, where, parameters):
+        """Remove and return the blocks matching a condition, oldest first."""
+        blocks = db.execute(f"SELECT * FROM blocks WHERE {where} ORDER BY series, start", parameters).fetchall()
+        db.execute(f"DELETE FROM blocks WHERE {where}", parameters)
+        return blocks
+
+    @staticmethod
+    def _write_block(db, series, times, values, step):
+        db.execute("INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                   (series, times[0], times[-1], step, len(values), values[0], values[-1], min(values), max(values),
+                    sum(values), encode_block(times, values)))
+
+    def series(self, metric, host="*", vm="*"):
+        """
+        Return the recorded series of a metric whose host and VM match wildcard patterns.
+
+        Host-level metrics have an empty VM name, which `vm='*'` matches.
+
+        Returns:
+            list[dict]: Series with structure [{"Id": 3, "Host": "atlas", "VMName": "hyperlab-1", "Metric": "cpu_pct"}]
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of: {', '.join(METRICS)}")
+        with self._lock:
+            self._connect()
+            keys = sorted(self._series.items())
+        return [{"Id": series_id, "Host": key[0], "VMName": key[1], "Metric": key[2]}
+                for key, series_id in keys if key[2] == metric
+                and fnmatch.fnmatch(key[0].lower(), host.lower()) and fnmatch.fnmatch(key[1].lower(), vm.lower())]
+
+    def points(self, series, since, until, step=0):
+        """
+        Return the samples of a series between two epoch times, averaged into `step`-second buckets if given.
+
+        Returns:
+            list[tuple[int, float]]: (time, value) pairs in the metric's unit, oldest first.
+        """
+        scale = METRICS[series["Metric"]][0]
+        times, values = [], []
+        with self._lock:
+            db = self._connect()
+            for block in db.execute("SELECT start, data FROM blocks WHERE series = ? AND end >= ? AND start <= ? "
+                                    "ORDER BY start", (series["Id"], since, until)):
+                block_times, block_values = decode_block(block["start"], block["data"])
+                times += block_times
+                values += block_values
+            for row in db.execute("SELECT t, value FROM recent WHERE series = ? AND t BETWEEN ? AND ? ORDER BY t",
+                                  (series["Id"], since, until)):
+                times.append(row["t"])
+                values.append(row["value"])
+
+        samples = [(t, value) for t, value in zip(times, values) if since <= t <= until]
+        if not step:
+            return [(t, value / scale) for t, value in samples]
+        buckets = {}
+        for t, value in samples:
+            buckets.setdefault(t // step * step, []).append(value)
+        return [(t, sum(bucket) / len(bucket) / scale) for t, bucket in sorted(buckets.items())]
+
+    def top(self, metric, since, until, count=10, by="growth", host="*", vm="*"):
+        """
+        Rank the series of a metric over a time range.
+
+        Blocks entirely inside the range contribute their stored summaries, so only the
+        blocks cut by the range edges are decoded.
+
+        Args:
+            by (str): One of TOP_CRITERIA: "growth" (last minus first value), "mean", "max" or "min".
+
+        Returns:
+            list[dict]: The top `count` series, highest first, with structure:
+            [
+                {"Host": "atlas", "VMName": "hyperlab-1", "Metric": "mem_demand_mb", "Value": 812.0,
+                 "First": 1024.0, "Last": 1836.0, "Mean": 1411.3, "Min": 1010.0, "Max": 1902.0, "Samples": 10080}
+            ]
+        """
+        if by not in TOP_CRITERIA:
+            raise ValueError(f"Unknown ranking '{by}', expected one of: {', '.join(TOP_CRITERIA)}")
+        selected = {series["Id"]: series for series in self.series(metric, host, vm)}
+        summaries = {}
+        with self._lock:
+            db = self._connect()
+            # Only blocks cut by the range need their samples
+            for block in db.execute("SELECT series, start, count, sum, min, max, first, last, "
+                                    "CASE WHEN start >= ? AND end <= ? THEN NULL ELSE data END AS data "
+                                    "FROM blocks WHERE end >= ? AND start <= ? ORDER BY series, start",
+                                    (since, until, since, until)):
+                if block["series"] not in selected:
+                    continue
+                if block["data"] is None:
+                    part = {key: block[key] for key in ("count", "sum", "min", "max", "first", "last")}
+                else:
+                    part = _summarize(*decode_block(block["start"], block["data"]), since, until)
+                if part:
+                    summaries[block["series"]] = _merge(summaries.get(block["series"]), part)
+            recent = {}
+            for row in db.execute("SELECT series, t, value FROM recent WHERE t BETWEEN ? AND ? ORDER BY series, t",
+                                  (since, until)):
+                if row["series"] in selected:
+                    recent.setdefault(row["series"], ([], []))
+                    recent[row["series"]][0].append(row["t"])
+                    recent[row["series"]][1].append(row["value"])
+        for series_id, (times, values) in recent.items():
+            summaries[series_id] = _merge(summaries.get(series_id), _summarize(times, values, since, until))
+
+        scale = METRICS[metric][0]
+        ranked = sorted(summaries.items(), key=lambda item: TOP_CRITERIA[by](item[1]), reverse=True)[:int(count)]
+        return [{
+            "Host": selected[series_id]["Host"], "VMName": selected[series_id]["VMName"], "Metric": metric,
+            "Value": round(TOP_CRITERIA[by](summary) / scale, 2),
+            "First": summary["first"] / scale, "Last": summary["last"] / scale,
+            "Mean": round(summary["sum"] / summary["count"] / scale, 2),
+            "Min": summary["min"] / scale, "Max": summary["max"] / scale, "Samples": summary["count"],
+        } for series_id, summary in ranked]
+
+    def stats(self):
+        """Return {"Series": 195, "Blocks": 5460, "Recent": 1170, "Bytes": 2310144} for the store."""
+        with self._lock:
+            db = self._connect()
+            page_count = db.execute("PRAGMA page_count").fetchone()[0]
+            page_size = db.execute("PRAGMA page_size").fetchone()[0]
+            return {
+                "Series": db.execute("SELECT COUNT(*) FROM series").fetchone()[0],
+                "Blocks": db.execute("SELECT COUNT(*) FROM blocks").fetchone()[0],
+                "Recent": db.execute("SELECT COUNT(*) FROM recent").fetchone()[0],
+                "Bytes": page_count * page_size,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+history = MetricsHistory()
@@ -0,0 +1,125 @@
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+
+from hyperlab_control.connections import pool
+from hyperlab_control.powershell import run_json_lines
+
+# Seconds a host's VM inventory is served from the cache before it is queried again
+INVENTORY_TTL = float(os.environ.get("HYPERLAB_INVENTORY_TTL", 60))
+
+# Optional JSON file that keeps the inventory across invocations (disabled when empty)
+INVENTORY_CACHE_FILE = os.environ.get("HYPERLAB_INVENTORY_CACHE", "")
+
+# One JSON line per VM, parsed as it arrives
+INVENTORY_SCRIPT = """
+foreach ($vm in Get-VM) {
+    ConvertTo-Json -Compress -Depth 4 -InputObject ([pscustomobject]@{
+        Name = $vm.Name
+        State = "$($vm.State)"
+        Status = $vm.Status
+        CPUUsage = $vm.CPUUsage
+        MemoryAssigned = $vm.MemoryAssigned
+        Uptime = "$($vm.Uptime)"
+        Adapters = @($vm.NetworkAdapters | ForEach-Object {
+            [pscustomobject]@{ MacAddress = $_.MacAddress; SwitchName = $_.SwitchName; IPAddresses = @($_.IPAddresses) }
+        })
+    })
+}
+"""
+
+
+class InventoryCache:
+    """
+    Per-host cache of the VMs on each Hyper-V host, with their state and network adapters.
+
+    VM names stay valid until the TTL expires. State-changing operations mark the
+    affected VMs as stale, so only callers that need up-to-date state re-query the host.
+    """
+
+    def __init__(self, ttl=INVENTORY_TTL, path=INVENTORY_CACHE_FILE):
+        self.ttl = ttl
+        self.path = path
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def vms(self, conn, fresh=False, need_state=False):
+        """
+        Return the VMs on the connection's host, from the cache when possible.
+
+        Args:
+            conn (fabric.Connection): Connection to the Hyper-V host.
+            fresh (bool): Bypass the cache and query the host.
+            need_state (bool): Re-query if any cached VM state has been invalidated.
+
+        Returns:
+            list[dict] | None: The VM records, or None if the host could not be queried.
+        """
+        host = pool.host_of(conn)
+        with self._lock:
+            entry = self._load().get(host)
+        if not fresh and self._usable(entry, need_state):
+            return entry["vms"]
+
+        vms = run_json_lines(conn, INVENTORY_SCRIPT, retry_failures=True)
+        if vms is None:
+            return None
+        with self._lock:
+            self._load()[host] = {"fetched": time.time(), "vms": vms, "stale": []}
+            self._save()
+        return vms
+
+    def vm_names(self, conn, pattern="*", fresh=False):
+        """Return the names of the VMs matching a case-insensitive wildcard pattern."""
+        vms = self.vms(conn, fresh=fresh)
+        if vms is None:
+            return []
+        return [vm["Name"] for vm in vms if fnmatch.fnmatch(vm["Name"].lower(), pattern.lower())]
+
+    def invalidate(self, host, vm_names=None):
+        """Mark the state of some VMs on a host as stale, or drop the whole host entry."""
+        with self._lock:
+            entries = self._load()
+            if vm_names is None:
+                entries.pop(host, None)
+            elif host in entries:
+                entries[host]["stale"] = sorted(set(entries[host]["stale"]) | set(vm_names))
+            self._save()
+
+    def clear(self):
+        """Forget every cached host."""
+        with self._lock:
+            self._entries = {}
+            self._save()
+
+    def _usable(self, entry, need_state):
+        if entry is None or time.time() - entry["fetched"] > self.ttl:
+            return False
+        return not (need_state and entry["stale"])
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path) as f:
+                        self._entries = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logging.warning(f"⚠️ Ignoring unreadable inventory cache {self.path}: {e}")
+        return self._entries
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump(self._entries, f)
+        except OSError as e:
+            logging.warning(f"⚠️ Failed to write inventory cache {self.path}: {e}")
+
+
+inventory = InventoryCache()
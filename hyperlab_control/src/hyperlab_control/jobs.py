@@ -0,0 +1,197 @@
+import logging
+import time
+
+from hyperlab_control.connections import pool
+from hyperlab_control.metrics import metrics
+from hyperlab_control.powershell import USE_SESSIONS, batch_vm_action, quote_list, run_json_script
+from hyperlab_control.progress import show_progress
+from hyperlab_control.timeouts import deadline_passed
+
+# Maximum number of concurrent Hyper-V jobs per host for each operation class.
+# Checkpoint creation and merges are disk-bound, so they get the tightest limits.
+JOB_LIMITS = {
+    "Checkpoint-VM": 2,
+    "New-VM": 4,
+    "Remove-VMSnapshot": 2,
+    "Restore-VMSnapshot": 3,
+    "Save-VM": 4,
+    "Stop-VM": 8,
+    "Start-VM": 8,
+}
+DEFAULT_JOB_LIMIT = 4
+
+# Seconds a single VM's job may run before it is stopped and reported as timed out
+JOB_TIMEOUT = 600
+
+# Seconds between polls of the running jobs
+POLL_INTERVAL = 1.0
+
+# Each tick stops timed-out jobs, reports finished ones and submits queued VMs into the
+# free slots, all in one round trip. Jobs live in the host's persistent PowerShell session.
+TICK_SCRIPT = """
+$ProgressPreference = 'SilentlyContinue'
+foreach ($id in @({cancel})) {{
+    Stop-Job -Id $id -ErrorAction SilentlyContinue
+    Remove-Job -Id $id -Force -ErrorAction SilentlyContinue
+}}
+$running = 0
+$jobs = foreach ($id in @({poll})) {{
+    $job = Get-Job -Id $id -ErrorAction SilentlyContinue
+    if (-not $job) {{
+        [pscustomobject]@{{ Id = $id; State = 'Missing'; Error = 'Job no longer exists'; Seconds = $null }}
+        continue
+    }}
+    if ($job.State -notin 'Completed', 'Failed', 'Stopped') {{
+        $running++
+        [pscustomobject]@{{ Id = $id; State = "$($job.State)"; Error = $null; Seconds = $null }}
+        continue
+    }}
+    $jobErrors = @()
+    $output = @(Receive-Job -Job $job -ErrorAction SilentlyContinue -ErrorVariable jobErrors) | Select-Object -Last 1
+    $message = @($jobErrors | ForEach-Object {{ $_.ToString() }})
+    if ($job.State -eq 'Failed' -and $job.ChildJobs[0].JobStateInfo.Reason) {{
+        $message += $job.ChildJobs[0].JobStateInfo.Reason.Message
+    }}
+    $seconds = $null
+    if ($job.PSBeginTime -and $job.PSEndTime) {{ $seconds = [math]::Round(($job.PSEndTime - $job.PSBeginTime).TotalSeconds, 3) }}
+    [pscustomobject]@{{
+        Id = $id; State = "$($job.State)"; Error = (($message | Select-Object -Unique) -join '; '); Seconds = $seconds
+        Output = $output
+    }}
+    Remove-Job -Job $job -Force
+}}
+$queue = {queue}
+$submitted = foreach ($name in ($queue | Select-Object -First ([math]::Max(0, {limit} - $running)))) {{
+    try {{
+        $job = {submit}
+        [pscustomobject]@{{ VMName = $name; Id = $job.Id; Error = $null }}
+    }} catch {{
+        [pscustomobject]@{{ VMName = $name; Id = $null; Error = $_.Exception.Message }}
+    }}
+}}
+ConvertTo-Json -Compress -Depth 5 -InputObject ([pscustomobject]@{{ Jobs = @($jobs); Submitted = @($submitted) }})
+"""
+
+
+def job_limit(command):
+    """Return the per-host concurrency limit for the cmdlet a command starts with."""
+    return JOB_LIMITS.get(command.split()[0], DEFAULT_JOB_LIMIT)
+
+
+def run_vm_jobs(conn, command, vm_names, limit=None, timeout=None, poll_interval=None, script=None, deadline=None):
+    """
+    Run a per-VM Hyper-V command as background jobs on the host and wait for all of them.
+
+    At most `limit` jobs run at once. Each tick stops timed-out jobs, collects finished ones
+    and submits queued VMs in a single round trip, so the total time is close to the
+    slowest VMs rather than the sum of all of them. When the task deadline passes, queued
+    VMs are not submitted and running jobs are left to finish on the host; both are
+    reported as timed out.
+
+    Args:
+        conn (fabric.Connection): Connection to the Hyper-V host.
+        command (str): Cmdlet invocation supporting -AsJob, with the VM name in `$name`,
+            e.g. 'Checkpoint-VM -Name $name'.
+        vm_names (list[str]): The VMs to target.
+        limit (int, optional): Concurrent jobs on the host, defaults to the cmdlet's JOB_LIMITS entry.
+        timeout (float, optional): Seconds before a VM's job is stopped, defaults to JOB_TIMEOUT.
+        poll_interval (float, optional): Seconds between polls, defaults to POLL_INTERVAL.
+        script (str, optional): Per-VM script run with Start-Job instead of `command -AsJob`, for
+            operations that take more than one cmdlet. The VM name is in `$name`, and `command`
+            then only names the operation for limits and reporting.
+        deadline (float, optional): time.monotonic() value treated like the task deadline, for
+            a time budget of its own that ends before the task's.
+
+    Returns:
+        list[dict] | None: One result per VM, in the order of `vm_names`, with structure:
+        [
+            {"VMName": "hyperlab-1", "Success": true, "Error": null, "Seconds": 41.2, "TimedOut": false,
+             "Output": null}
+        ]
+        where Output is the last object the job emitted.
+        or None if the host could not be driven at all.
+    """
+    if not vm_names:
+        return []
+    if not USE_SESSIONS:
+        # Jobs die with the powershell.exe that started them, so run them in one batch instead
+        return batch_vm_action(conn, f"& {{ {script} }}" if script else command, vm_names=vm_names)
+
+    limit = limit or job_limit(command)
+    timeout = timeout or JOB_TIMEOUT
+    poll_interval = poll_interval or POLL_INTERVAL
+    operation = command.split()[0]
+    if script:
+        submit = f"Start-Job -ArgumentList $name -ErrorAction Stop -ScriptBlock {{ param($name) {script} }}"
+    else:
+        submit = f"{command} -AsJob -ErrorAction Stop"
+    host = pool.host_of(conn)
+    progress_key = (host, operation)
+    pending = list(vm_names)
+    running = {}
+    results = {}
+
+    def finish(vm_name, success, error, seconds, timed_out=False, output=None):
+        results[vm_name] = {
+            "VMName": vm_name, "Success": success, "Error": error, "Seconds": round(seconds or 0.0, 3),
+            "TimedOut": timed_out, "Output": output,
+        }
+
+    try:
+        while pending or running:
+            now = time.monotonic()
+            if deadline_passed() or (deadline is not None and now >= deadline):
+                for vm_name, started in running.values():
+                    finish(vm_name, False, "Deadline reached, job left running on the host", now - started,
+                           timed_out=True)
+                for vm_name in pending:
+                    finish(vm_name, False, "Deadline reached before the job was submitted", 0.0, timed_out=True)
+                break
+            cancel = [job_id for job_id, (_, started) in running.items() if now - started > timeout]
+            for job_id in cancel:
+                vm_name, started = running.pop(job_id)
+                finish(vm_name, False, f"Timed out after {timeout}s", now - started, timed_out=True)
+
+            with metrics.tagged(cmdlet=operation):
+                response = run_json_script(conn, TICK_SCRIPT.format(
+                    cancel=", ".join(str(job_id) for job_id in cancel),
+                    poll=", ".join(str(job_id) for job_id in running),
+                    queue=quote_list(pending),
+                    limit=limit,
+                    submit=submit,
+                ))
+            if not isinstance(response, dict):
+                expired = deadline_passed()
+                for vm_name, started in running.values():
+                    finish(vm_name, False, "Lost track of the job", time.monotonic() - started, timed_out=expired)
+                for vm_name in pending:
+                    finish(vm_name, False, "Job was never submitted", 0.0, timed_out=expired)
+                break
+
+            for job in response.get("Jobs") or []:
+                if job is None or job["State"] not in ("Completed", "Failed", "Stopped", "Missing"):
+                    continue
+                vm_name, started = running.pop(job["Id"])
+                seconds = job["Seconds"] if job["Seconds"] is not None else time.monotonic() - started
+                finish(vm_name, job["State"] == "Completed" and not job["Error"], job["Error"] or None, seconds,
+                       output=job.get("Output"))
+
+            for submission in response.get("Submitted") or []:
+                if submission is None:
+                    continue
+                pending.remove(submission["VMName"])
+                if submission["Id"] is None:
+                    finish(submission["VMName"], False, submission["Error"], 0.0)
+                else:
+                    running[submission["Id"]] = (submission["VMName"], time.monotonic())
+
+            show_progress(progress_key, f"{operation}: {len(results)}/{len(vm_names)} done, {len(running)} running")
+            if pending or running:
+                time.sleep(poll_interval)
+    finally:
+        show_progress(progress_key, None)
+
+    timed_out = [vm_name for vm_name, result in results.items() if result["TimedOut"]]
+    if timed_out:
+        logging.warning(f"⏱️ {operation} timed out on {host} for: {', '.join(timed_out)}")
+    return [results[vm_name] for vm_name in vm_names]
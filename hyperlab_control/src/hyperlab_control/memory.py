@@ -0,0 +1,200 @@
+import json
+import math
+
+from hyperlab_control.planner import role_of
+from hyperlab_control.powershell import quote, run_json_script
+
+# Dynamic memory bounds in MB for each lab role: no VM's minimum goes below "min" and no
+# maximum goes above "max", whatever its demand
+ROLE_MEMORY_BOUNDS = {
+    "control-plane": {"min": 2048, "max": 8192},
+    "storage": {"min": 1024, "max": 4096},
+    "worker": {"min": 1024, "max": 8192},
+    "other": {"min": 512, "max": 4096},
+}
+
+# Extra memory on top of the peak demand for the startup target, as a fraction
+MEMORY_HEADROOM = 0.2
+
+# Maximum memory is sized at this multiple of the peak demand, so VMs can still burst
+MEMORY_BURST_FACTOR = 2.0
+
+# Average pressure above which a VM is short of memory and keeps at least its current maximum
+MEMORY_PRESSURE_LIMIT = 100
+
+# Targets are rounded up to a multiple of this many MB (Hyper-V needs multiples of 2 MB)
+MEMORY_STEP_MB = 128
+
+# MB of physical memory kept free for the host itself when checking that minimums fit
+HOST_RESERVE_MB = 4096
+
+# Samples memory demand and pressure several times in one round trip and reports the peaks
+MEMORY_SAMPLE_SCRIPT = """
+$ProgressPreference = 'SilentlyContinue'
+$peaks = @{{}}
+for ($i = 0; $i -lt {samples}; $i++) {{
+    if ($i) {{ Start-Sleep -Seconds {interval} }}
+    $pressure = @{{}}
+    $counter = Get-Counter '\\Hyper-V Dynamic Memory VM(*)\\Average Pressure' -ErrorAction SilentlyContinue
+    foreach ($sample in @($counter.CounterSamples)) {{
+        $pressure[$sample.InstanceName] = $sample.CookedValue
+    }}
+    foreach ($vm in @(Get-VM -Name {pattern})) {{
+        $peak = $peaks[$vm.Name]
+        if (-not $peak) {{ $peak = $peaks[$vm.Name] = @{{ Demand = 0; Assigned = 0; Pressure = 0 }} }}
+        $peak.Demand = [math]::Max($peak.Demand, $vm.MemoryDemand)
+        $peak.Assigned = [math]::Max($peak.Assigned, $vm.MemoryAssigned)
+        if ($pressure.ContainsKey($vm.Name)) {{ $peak.Pressure = [math]::Max($peak.Pressure, $pressure[$vm.Name]) }}
+    }}
+}}
+$vms = foreach ($memory in @(Get-VMMemory -VMName {pattern})) {{
+    $peak = $peaks[$memory.VMName]
+    [pscustomobject]@{{
+        Name = $memory.VMName
+        State = "$((Get-VM -Name $memory.VMName).State)"
+        DynamicMemoryEnabled = $memory.DynamicMemoryEnabled
+        MinimumMB = [math]::Round($memory.Minimum / 1MB)
+        StartupMB = [math]::Round($memory.Startup / 1MB)
+        MaximumMB = [math]::Round($memory.Maximum / 1MB)
+        DemandMB = if ($peak) {{ [math]::Round($peak.Demand / 1MB) }} else {{ 0 }}
+        AssignedMB = if ($peak) {{ [math]::Round($peak.Assigned / 1MB) }} else {{ 0 }}
+        Pressure = if ($peak) {{ $peak.Pressure }} else {{ 0 }}
+    }}
+}}
+$os = Get-CimInstance Win32_OperatingSystem
+ConvertTo-Json -Compress -Depth 3 -InputObject ([pscustomobject]@{{
+    TotalMB = [math]::Round($os.TotalVisibleMemorySize / 1KB)
+    FreeMB = [math]::Round($os.FreePhysicalMemory / 1KB)
+    VMs = @($vms)
+}})
+"""
+
+# Applies every change for a host in one round trip, with one result per VM
+MEMORY_APPLY_SCRIPT = """
+$ProgressPreference = 'SilentlyContinue'
+$results = foreach ($change in @(ConvertFrom-Json {changes})) {{
+    try {{
+        $arguments = @{{ VMName = $change.Name; ErrorAction = 'Stop' }}
+        if ($null -ne $change.MinimumMB) {{ $arguments.MinimumBytes = [int64]$change.MinimumMB * 1MB }}
+        if ($null -ne $change.StartupMB) {{ $arguments.StartupBytes = [int64]$change.StartupMB * 1MB }}
+        if ($null -ne $change.MaximumMB) {{ $arguments.MaximumBytes = [int64]$change.MaximumMB * 1MB }}
+        Set-VMMemory @arguments
+        [pscustomobject]@{{ VMName = $change.Name; Success = $true; Error = $null }}
+    }} catch {{
+        [pscustomobject]@{{ VMName = $change.Name; Success = $false; Error = $_.Exception.Message }}
+    }}
+}}
+ConvertTo-Json -InputObject @($results) -Compress -Depth 3
+"""
+
+
+def sample_memory(conn, pattern, samples=3, interval=2):
+    """
+    Sample memory demand and pressure of the matching VMs, keeping the peak of each.
+
+    Returns:
+        dict | None: The host memory view with structure:
+        {
+            "TotalMB": 131072, "FreeMB": 20480,
+            "VMs": [
+                {"Name": "hyperlab-worker-1", "State": "Running", "DynamicMemoryEnabled": true,
+                 "MinimumMB": 512, "StartupMB": 4096, "MaximumMB": 16384,
+                 "DemandMB": 2300, "AssignedMB": 4096, "Pressure": 56}
+            ]
+        }
+        or None if the host could not be sampled.
+    """
+    sample = run_json_script(conn, MEMORY_SAMPLE_SCRIPT.format(
+        pattern=quote(pattern), samples=max(1, int(samples)), interval=max(1, int(interval))), retry_failures=True)
+    if not isinstance(sample, dict):
+        return None
+    sample["VMs"] = [vm for vm in sample.get("VMs") or [] if vm]
+    return sample
+
+
+def _round_up(mb):
+    return int(math.ceil(mb / MEMORY_STEP_MB) * MEMORY_STEP_MB)
+
+
+def memory_targets(vm):
+    """
+    Compute the minimum, startup and maximum memory in MB a VM should have.
+
+    Startup covers the peak demand plus MEMORY_HEADROOM, maximum allows bursting to
+    MEMORY_BURST_FACTOR times the peak, and minimum drops to the role's floor so idle
+    VMs can give memory back. All targets stay within the role's bounds.
+    """
+    bounds = ROLE_MEMORY_BOUNDS.get(role_of(vm["Name"]), ROLE_MEMORY_BOUNDS["other"])
+    demand = vm["DemandMB"]
+    startup = min(max(_round_up(demand * (1 + MEMORY_HEADROOM)), bounds["min"]), bounds["max"])
+    maximum = min(max(_round_up(demand * MEMORY_BURST_FACTOR), startup), bounds["max"])
+    if vm["Pressure"] > MEMORY_PRESSURE_LIMIT:
+        maximum = min(max(maximum, vm["MaximumMB"]), bounds["max"])
+    return {"MinimumMB": min(bounds["min"], startup), "StartupMB": startup, "MaximumMB": maximum}
+
+
+def plan_memory(sample):
+    """
+    Work out the memory changes for the VMs of one host.
+
+    Only running VMs with dynamic memory report a demand, so only they are planned. While a
+    VM runs, Hyper-V only lets its minimum go down and its maximum go up; other changes are
+    reported as deferred until the VM is off.
+
+    Returns:
+        list[dict]: One plan per VM with structure:
+        [
+            {"Name": "hyperlab-worker-1", "Role": "worker", "DemandMB": 2300, "Pressure": 56,
+             "Current": {"MinimumMB": 512, "StartupMB": 4096, "MaximumMB": 16384},
+             "Target": {"MinimumMB": 1024, "StartupMB": 2816, "MaximumMB": 4608},
+             "Apply": {"MinimumMB": null, "StartupMB": null, "MaximumMB": null},
+             "Note": "startup, maximum, minimum need the VM off"}
+        ]
+    """
+    plans = []
+    for vm in sample["VMs"]:
+        if not vm["DynamicMemoryEnabled"] or vm["State"] != "Running":
+            continue
+        current = {key: vm[key] for key in ("MinimumMB", "StartupMB", "MaximumMB")}
+        target = memory_targets(vm)
+        apply = {key: None for key in current}
+        deferred = []
+        for key, value in target.items():
+            if value == current[key]:
+                continue
+            if (key == "MinimumMB" and value < current[key]) or (key == "MaximumMB" and value > current[key]):
+                apply[key] = value
+            else:
+                deferred.append(key[:-2].lower())
+        plans.append({
+            "Name": vm["Name"],
+            "Role": role_of(vm["Name"]),
+            "DemandMB": vm["DemandMB"],
+            "Pressure": vm["Pressure"],
+            "Current": current,
+            "Target": target,
+            "Apply": apply,
+            "Note": f"{', '.join(deferred)} need{'s' if len(deferred) == 1 else ''} the VM off" if deferred else "",
+        })
+    return plans
+
+
+def minimums_fit(sample, plans):
+    """Check that the planned minimums of all VMs fit in the host's memory minus HOST_RESERVE_MB."""
+    planned = {plan["Name"]: plan["Apply"]["MinimumMB"] or plan["Current"]["MinimumMB"] for plan in plans}
+    total = sum(planned.get(vm["Name"], vm["MinimumMB"]) for vm in sample["VMs"] if vm["State"] == "Running")
+    return total <= sample["TotalMB"] - HOST_RESERVE_MB
+
+
+def apply_memory(conn, plans):
+    """
+    Apply the applicable part of the plans in one Set-VMMemory batch.
+
+    Returns:
+        list[dict] | None: One {"VMName", "Success", "Error"} result per changed VM,
+        or None if the script could not be run.
+    """
+    changes = [dict(plan["Apply"], Name=plan["Name"]) for plan in plans if any(plan["Apply"].values())]
+    if not changes:
+        return []
+    return run_json_script(conn, MEMORY_APPLY_SCRIPT.format(changes=quote(json.dumps(changes))))
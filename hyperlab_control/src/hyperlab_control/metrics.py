@@ -0,0 +1,239 @@
+import contextlib
+import functools
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+
+# Upper bounds in seconds of the latency histogram buckets; the last bucket is +Inf
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Phases of a remote operation, in the order they happen
+PHASES = ("connect", "auth", "channel", "spawn", "execute", "parse")
+
+PROMETHEUS_METRIC = "hyperlab_remote_operation_seconds"
+
+_CMDLET_PATTERN = re.compile(r"\b[A-Z][a-z]+-[A-Z][A-Za-z]+\b")
+
+
+def cmdlet_of(script):
+    """Return the first Verb-Noun cmdlet in a script, or its first word."""
+    match = _CMDLET_PATTERN.search(script)
+    if match:
+        return match.group(0)
+    words = script.split()
+    return words[0] if words else ""
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed buckets."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def cumulative(self):
+        """Return (upper bound, observations at or below it) pairs, ending with +Inf."""
+        total = 0
+        result = []
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """
+    In-process latency histograms for remote operations.
+
+    Every observation is labelled with the phase, host, task and cmdlet. The task is
+    scoped to the task invocation (and the host threads it fans out to), while the cmdlet
+    can be overridden per thread for scripts whose first cmdlet does not describe them.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._task = ContextVar("hyperlab_metrics_task", default="")
+        self._recordings = ContextVar("hyperlab_metrics_recordings", default=())
+
+    @property
+    def task(self):
+        """The task the current context's observations are labelled with."""
+        return self._task.get()
+
+    def observe(self, phase, seconds, host="", cmdlet=""):
+        """Record the duration of one phase of a remote operation."""
+        cmdlet = getattr(self._local, "cmdlet", None) or cmdlet
+        key = (phase, host, self.task, cmdlet)
+        for target in (self, *self._recordings.get()):
+            target._add(key, seconds)
+
+    def _add(self, key, seconds):
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, phase, host="", cmdlet=""):
+        """Time the enclosed block as one phase, whether or not it raises."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.monotonic() - started, host=host, cmdlet=cmdlet)
+
+    @contextlib.contextmanager
+    def tagged(self, task=None, cmdlet=None):
+        """Label the observations made in the enclosed block with a task and/or cmdlet."""
+        previous_cmdlet = getattr(self._local, "cmdlet", None)
+        token = self._task.set(task) if task is not None else None
+        if cmdlet is not None:
+            self._local.cmdlet = cmdlet
+        try:
+            yield
+        finally:
+            if token is not None:
+                self._task.reset(token)
+            self._local.cmdlet = previous_cmdlet
+
+    @contextlib.contextmanager
+    def recording(self):
+        """
+        Also collect the observations made in the enclosed block into a fresh Metrics, which
+        is yielded. Only the block's own context and the host threads it fans out to count,
+        so concurrent or earlier tasks in the same process are left out.
+        """
+        recorded = Metrics(self.buckets)
+        token = self._recordings.set((*self._recordings.get(), recorded))
+        try:
+            yield recorded
+        finally:
+            self._recordings.reset(token)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self):
+        """
+        Return every histogram as a plain dict.
+
+        Returns:
+            list[dict]: One entry per label combination, with structure:
+            [
+                {"phase": "execute", "host": "atlas", "task": "list_vms", "cmdlet": "Get-VM",
+                 "count": 3, "sum": 0.62, "min": 0.18, "max": 0.25, "mean": 0.207,
+                 "buckets": {"0.005": 0, ..., "+Inf": 3}}
+            ]
+        """
+        with self._lock:
+            items = sorted(self._histograms.items(), key=_sort_key)
+            return [
+                {
+                    "phase": phase, "host": host, "task": task, "cmdlet": cmdlet,
+                    "count": histogram.count,
+                    "sum": round(histogram.sum, 6),
+                    "min": round(histogram.min, 6),
+                    "max": round(histogram.max, 6),
+                    "mean": round(histogram.sum / histogram.count, 6),
+                    "buckets": {_format_bound(bound): count for bound, count in histogram.cumulative()},
+                }
+                for (phase, host, task, cmdlet), histogram in items
+            ]
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Render the histograms in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {PROMETHEUS_METRIC} Duration of remote operations on Hyper-V hosts by phase.",
+            f"# TYPE {PROMETHEUS_METRIC} histogram",
+        ]
+        for entry in self.snapshot():
+            labels = ",".join(f'{name}="{_escape(entry[name])}"' for name in ("phase", "host", "task", "cmdlet"))
+            for bound, count in entry["buckets"].items():
+                lines.append(f'{PROMETHEUS_METRIC}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{PROMETHEUS_METRIC}_sum{{{labels}}} {entry['sum']}")
+            lines.append(f"{PROMETHEUS_METRIC}_count{{{labels}}} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, target):
+        """
+        Write the metrics out.
+
+        Args:
+            target (str): 'json' or 'prometheus' to print them, or a file path to write them to,
+                in the Prometheus textfile format for '.prom' files and as JSON otherwise.
+        """
+        if target in ("json", "prometheus"):
+            sys.stdout.write(self.to_json() + "\n" if target == "json" else self.to_prometheus())
+            return
+        content = self.to_prometheus() if target.endswith(".prom") else self.to_json() + "\n"
+        # Write to a temporary file first so textfile collectors never read a partial file
+        temporary = f"{target}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(content)
+        os.replace(temporary, target)
+
+
+def _sort_key(item):
+    (phase, host, task, cmdlet), _ = item
+    return host, task, PHASES.index(phase) if phase in PHASES else len(PHASES), cmdlet
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+
+def instrument_task(body):
+    """
+    Wrap a task body so its remote operations are tagged with the task name, and add a
+    `metrics` option that dumps the metrics of this invocation once the task has finished.
+    """
+
+    @functools.wraps(body)
+    def wrapper(c, *args, **kwargs):
+        target = kwargs.pop("metrics", "")
+        with metrics.recording() as recorded:
+            try:
+                with metrics.tagged(task=body.__name__):
+                    return body(c, *args, **kwargs)
+            finally:
+                if target:
+                    recorded.dump(target)
+
+    signature = inspect.signature(body)
+    wrapper.__signature__ = signature.replace(parameters=[
+        *signature.parameters.values(),
+        inspect.Parameter("metrics", inspect.Parameter.KEYWORD_ONLY, default=""),
+    ])
+    return wrapper
@@ -0,0 +1,198 @@
+import json
+import logging
+import socket
+import threading
+import time
+
+from hyperlab_control.metrics import metrics
+from hyperlab_control.powershell import FRAME_PREFIX, encode_command, quote
+
+# Seconds between samples; Get-Counter only supports whole seconds
+MONITOR_INTERVAL = 1
+
+# Samples without changes after which the sampler sends an empty record, so a quiet lab
+# is told apart from a sampler that hung
+MONITOR_HEARTBEAT = 5
+
+# Sampled values in display order: (record key, column header)
+MONITOR_FIELDS = [
+    ("st", "State"),
+    ("cpu", "CPU %"),
+    ("mem", "Assigned MB"),
+    ("dem", "Demand MB"),
+    ("rd", "Disk read KB/s"),
+    ("wr", "Disk write KB/s"),
+    ("rx", "Net in KB/s"),
+    ("tx", "Net out KB/s"),
+]
+
+# A single long-running powershell.exe samples every VM per interval and writes one framed
+# line holding only the values that changed since the previous sample:
+#   {"t": 1739950000.5, "d": {"hyperlab-1": {"cpu": 7, "rx": 12}}, "x": ["removed-vm"]}
+# or an empty heartbeat record after MONITOR_HEARTBEAT samples without changes.
+# Disk and network rates come from the Hyper-V performance counters, which Get-Counter
+# -Continuous also uses to pace the loop.
+SAMPLER_SCRIPT = """
+$ProgressPreference = 'SilentlyContinue'
+[Console]::OutputEncoding = [Text.Encoding]::UTF8
+$frame = '<<HYPERLAB>>'
+$last = @{{}}
+$quiet = 0
+$fields = @{{ 'read bytes/sec' = 'rd'; 'write bytes/sec' = 'wr'; 'bytes received/sec' = 'rx'; 'bytes sent/sec' = 'tx' }}
+
+function Send-Sample($counterSamples) {{
+    $vms = @(Get-VM -Name {pattern})
+    $names = @{{}}
+    foreach ($vm in $vms) {{ $names[$vm.Name] = $vm.Name }}
+    $disks = @{{}}
+    foreach ($disk in @($vms | Get-VMHardDiskDrive)) {{
+        if ($disk.Path) {{ $disks[$disk.Path.Replace('\\', '-')] = $disk.VMName }}
+    }}
+
+    $rates = @{{}}
+    foreach ($counter in @($counterSamples)) {{
+        $field = $fields[($counter.Path -split '\\\\')[-1]]
+        $vmName = $disks[$counter.InstanceName]
+        if (-not $vmName) {{ $vmName = $names[$counter.InstanceName.Split('_')[0]] }}
+        if (-not $field -or -not $vmName) {{ continue }}
+        if (-not $rates.ContainsKey($vmName)) {{ $rates[$vmName] = @{{ rd = 0.0; wr = 0.0; rx = 0.0; tx = 0.0 }} }}
+        $rates[$vmName][$field] += $counter.CookedValue
+    }}
+
+    $changes = [ordered]@{{}}
+    foreach ($vm in $vms) {{
+        $rate = $rates[$vm.Name]
+        $current = [ordered]@{{
+            st = "$($vm.State)"
+            cpu = $vm.CPUUsage
+            mem = [math]::Round($vm.MemoryAssigned / 1MB)
+            dem = [math]::Round($vm.MemoryDemand / 1MB)
+            rd = if ($rate) {{ [math]::Round($rate.rd / 1KB) }} else {{ 0 }}
+            wr = if ($rate) {{ [math]::Round($rate.wr / 1KB) }} else {{ 0 }}
+            rx = if ($rate) {{ [math]::Round($rate.rx / 1KB) }} else {{ 0 }}
+            tx = if ($rate) {{ [math]::Round($rate.tx / 1KB) }} else {{ 0 }}
+        }}
+        $previous = $last[$vm.Name]
+        $delta = [ordered]@{{}}
+        foreach ($key in $current.Keys) {{
+            if ($null -eq $previous -or $previous[$key] -ne $current[$key]) {{ $delta[$key] = $current[$key] }}
+        }}
+        if ($delta.Count) {{ $changes[$vm.Name] = $delta }}
+        $last[$vm.Name] = $current
+    }}
+    $removed = @($last.Keys | Where-Object {{ -not $names.ContainsKey($_) }})
+    foreach ($name in $removed) {{ $last.Remove($name) }}
+
+    $script:quiet += 1
+    if ($changes.Count -or $removed.Count -or $script:quiet -ge {heartbeat}) {{
+        $script:quiet = 0
+        $record = [ordered]@{{ t = [DateTimeOffset]::UtcNow.ToUnixTimeMilliseconds() / 1000; d = $changes; x = $removed }}
+        [Console]::Out.WriteLine($frame + (ConvertTo-Json -InputObject $record -Compress -Depth 4))
+        [Console]::Out.Flush()
+    }}
+}}
+
+$counters = @(
+    '\\Hyper-V Virtual Storage Device(*)\\Read Bytes/sec',
+    '\\Hyper-V Virtual Storage Device(*)\\Write Bytes/sec',
+    '\\Hyper-V Virtual Network Adapter(*)\\Bytes Received/sec',
+    '\\Hyper-V Virtual Network Adapter(*)\\Bytes Sent/sec'
+)
+try {{
+    Get-Counter -Counter $counters -SampleInterval {interval} -Continuous -ErrorAction Stop |
+        ForEach-Object {{ Send-Sample $_.CounterSamples }}
+}} catch {{
+    # Counters are unavailable (e.g. no VM is running yet), so sample CPU and memory only
+    while ($true) {{
+        Send-Sample @()
+        Start-Sleep -Seconds {interval}
+    }}
+}}
+"""
+
+
+class HostMonitor(threading.Thread):
+    """
+    Keep one remote sampler running on a host and apply its delta records to `vms`.
+
+    The sampler runs in its own powershell.exe on a separate channel of the pooled
+    connection, so it does not block the host's command session. Other threads read
+    the VMs through snapshot().
+    """
+
+    def __init__(self, host, conn, interval=MONITOR_INTERVAL, pattern="*", on_record=None):
+        super().__init__(name=f"monitor-{host}", daemon=True)
+        self.host = host
+        self.conn = conn
+        self.interval = max(1, int(interval))
+        self.pattern = pattern
+        self.on_record = on_record
+        self.vms = {}
+        self.updated = None
+        self.error = None
+        self._channel = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        try:
+            with metrics.timer("channel", host=self.host, cmdlet="monitor"):
+                self._channel = self.conn.transport.open_session()
+                self._channel.exec_command(
+                    "powershell -NoProfile -NonInteractive -NoLogo -ExecutionPolicy Bypass -EncodedCommand "
+                    + encode_command(SAMPLER_SCRIPT.format(interval=self.interval, pattern=quote(self.pattern),
+                                                           heartbeat=MONITOR_HEARTBEAT))
+                )
+            self._read()
+        except Exception as e:
+            if not self._stopping.is_set():
+                self.error = str(e)
+                logging.error(f"❌ Monitor on {self.host} failed: {e}")
+
+    def _read(self):
+        buffer = b""
+        # Even a quiet lab sends a heartbeat every MONITOR_HEARTBEAT samples
+        timeout = self.interval * MONITOR_HEARTBEAT * 2 + 30
+        while not self._stopping.is_set():
+            self._channel.settimeout(timeout)
+            try:
+                chunk = self._channel.recv(65536)
+            except socket.timeout:
+                raise RuntimeError(f"No sample received for {timeout}s")
+            if not chunk:
+                stderr = self._channel.recv_stderr(65536).decode(errors="replace").strip()
+                raise RuntimeError(f"Sampler exited{': ' + stderr if stderr else ''}")
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                line = line.rstrip(b"\r")
+                if line.startswith(FRAME_PREFIX):
+                    self.apply(json.loads(line[len(FRAME_PREFIX):].decode("utf-8")))
+
+    def apply(self, record):
+        """Merge one delta record into the current view of the host's VMs."""
+        changes = record.get("d") or {}
+        removed = record.get("x") or []
+        with self._lock:
+            for vm_name, values in changes.items():
+                self.vms.setdefault(vm_name, {}).update(values)
+            for vm_name in removed:
+                self.vms.pop(vm_name, None)
+            self.updated = record.get("t") or time.time()
+        # Heartbeats only show the sampler is alive
+        if self.on_record and (changes or removed):
+            self.on_record(self.host, record)
+
+    def snapshot(self):
+        """Return a copy of the current values per VM, safe to use while samples arrive."""
+        with self._lock:
+            return {vm_name: dict(values) for vm_name, values in self.vms.items()}
+
+    def stop(self):
+        """Stop the sampler by closing its channel."""
+        self._stopping.set()
+        if self._channel is not None:
+            try:
+                self._channel.close()
+            except Exception:
+                pass
@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from hyperlab_control.connections import pool
+from hyperlab_control.inventory import inventory
+from hyperlab_control.powershell import quote_list, run_json_script
+
+# SQLite file holding the VM/MAC/IP index across invocations
+NETWORK_INDEX_FILE = os.environ.get(
+    "HYPERLAB_NETWORK_INDEX", os.path.join(os.path.expanduser("~"), ".cache", "hyperlab", "network-index.sqlite3")
+)
+
+# Seconds after which every VM of a host is re-queried, to catch IP changes of running VMs
+NETWORK_INDEX_TTL = float(os.environ.get("HYPERLAB_NETWORK_INDEX_TTL", 600))
+
+# Cheap change detection: state and adapter MACs of every VM, without IP addresses
+FINGERPRINT_SCRIPT = """
+$vms = foreach ($vm in Get-VM) {
+    [pscustomobject]@{ Name = $vm.Name; State = "$($vm.State)"; Macs = @($vm.NetworkAdapters.MacAddress) }
+}
+ConvertTo-Json -InputObject @($vms) -Compress -Depth 3
+"""
+
+ADAPTERS_SCRIPT = """
+$adapters = foreach ($adapter in @(Get-VMNetworkAdapter -VMName {vm_names} -ErrorAction SilentlyContinue)) {{
+    [pscustomobject]@{{
+        VMName = $adapter.VMName; MacAddress = $adapter.MacAddress; SwitchName = $adapter.SwitchName
+        IPAddresses = @($adapter.IPAddresses)
+    }}
+}}
+ConvertTo-Json -InputObject @($adapters) -Compress -Depth 3
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, refreshed REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS vms (
+    host TEXT NOT NULL, vm TEXT NOT NULL, state TEXT, fingerprint TEXT, updated REAL,
+    PRIMARY KEY (host, vm)
+);
+CREATE TABLE IF NOT EXISTS adapters (
+    host TEXT NOT NULL, vm TEXT NOT NULL, mac TEXT NOT NULL, switch TEXT, ip TEXT, ips TEXT,
+    PRIMARY KEY (host, vm, mac)
+);
+CREATE INDEX IF NOT EXISTS adapters_vm ON adapters (vm COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS adapters_mac ON adapters (mac);
+CREATE TABLE IF NOT EXISTS addresses (ip TEXT NOT NULL, host TEXT NOT NULL, vm TEXT NOT NULL, mac TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS addresses_ip ON addresses (ip);
+"""
+
+
+def normalize_mac(mac):
+    """Return a MAC address as 12 upper-case hex digits, the way Hyper-V reports it."""
+    return "".join(ch for ch in str(mac) if ch.isalnum()).upper()
+
+
+def primary_ip(ip_addresses):
+    """Pick the address to connect to, preferring IPv4 since guests also report link-local IPv6."""
+    ipv4_addresses = [ip for ip in ip_addresses if ":" not in ip]
+    return (ipv4_addresses or ip_addresses or [None])[0]
+
+
+class NetworkIndex:
+    """
+    Local SQLite index of VM name, MAC address, IP address and host.
+
+    Lookups by any key are served from indexed tables without contacting a host.
+    Refreshing a host fetches only the state and MACs of its VMs and re-queries adapters
+    just for VMs whose fingerprint changed or whose running guest has no IP yet. A host
+    seen for the first time, or not fully refreshed within the TTL, is read from the
+    inventory in one round trip instead.
+    """
+
+    def __init__(self, path=NETWORK_INDEX_FILE, ttl=NETWORK_INDEX_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            import sqlite3
+
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def refresh(self, conn, full=False):
+        """
+        Bring the index up to date for the connection's host.
+
+        Args:
+            conn (fabric.Connection): Connection to the Hyper-V host.
+            full (bool): Re-query the adapters of every VM.
+
+        Returns:
+            dict | None: {"VMs": 12, "Requeried": 2, "Removed": 0}, or None if the host could not be queried.
+        """
+        host = pool.host_of(conn)
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT refreshed FROM hosts WHERE host = ?", (host,)).fetchone()
+            expired = full or row is None or time.time() - row["refreshed"] > self.ttl
+            rows = db.execute("SELECT vm, fingerprint FROM vms WHERE host = ?", (host,))
+            known = {r["vm"]: r["fingerprint"] for r in rows}
+            without_ip = {r["vm"] for r in db.execute("SELECT DISTINCT vm FROM adapters WHERE host = ? AND ip IS NULL",
+                                                      (host,))}
+
+        if expired:
+            # Everything is re-queried anyway, so take the full inventory in one round trip
+            inventory_vms = inventory.vms(conn, fresh=full, need_state=True)
+            if inventory_vms is None:
+                return None
+            vms = {vm["Name"]: {"Name": vm["Name"], "State": vm["State"],
+                                "Macs": [adapter["MacAddress"] for adapter in vm["Adapters"]]} for vm in inventory_vms}
+            adapters = [dict(adapter, VMName=vm["Name"]) for vm in inventory_vms for adapter in vm["Adapters"]]
+            changed = list(vms)
+        else:
+            vms = run_json_script(conn, FINGERPRINT_SCRIPT, retry_failures=True)
+            if vms is None:
+                return None
+            vms = {vm["Name"]: vm for vm in vms if vm}
+            changed = [
+                name for name, vm in vms.items()
+                if known.get(name) != self._fingerprint(vm) or (vm["State"] == "Running" and name in without_ip)
+            ]
+            adapters = []
+            if changed:
+                adapters = run_json_script(conn, ADAPTERS_SCRIPT.format(vm_names=quote_list(changed)),
+                                           retry_failures=True)
+                if adapters is None:
+                    return None
+        removed = [name for name in known if name not in vms]
+
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            with db:
+                for name in removed + changed:
+                    for table in ("vms", "adapters", "addresses"):
+                        db.execute(f"DELETE FROM {table} WHERE host = ? AND vm = ?", (host, name))
+                for name in changed:
+                    db.execute("INSERT INTO vms VALUES (?, ?, ?, ?, ?)",
+                               (host, name, vms[name]["State"], self._fingerprint(vms[name]), now))
+                for adapter in adapters:
+                    if not adapter or adapter["VMName"] not in vms:
+                        continue
+                    mac = normalize_mac(adapter["MacAddress"])
+                    ip_addresses = adapter.get("IPAddresses") or []
+                    db.execute("INSERT OR REPLACE INTO adapters VALUES (?, ?, ?, ?, ?, ?)",
+                               (host, adapter["VMName"], mac, adapter.get("SwitchName"), primary_ip(ip_addresses),
+                                json.dumps(ip_addresses)))
+                    db.executemany("INSERT INTO addresses VALUES (?, ?, ?, ?)",
+                                   [(ip, host, adapter["VMName"], mac) for ip in ip_addresses])
+                if expired:
+                    db.execute("INSERT OR REPLACE INTO hosts VALUES (?, ?)", (host, now))
+
+        logging.debug(f"Network index for {host}: {len(changed)} VMs re-queried, {len(removed)} removed")
+        return {"VMs": len(vms), "Requeried": len(changed), "Removed": len(removed)}
+
+    @staticmethod
+    def _fingerprint(vm):
+        return f"{vm['State']}|{','.join(sorted(normalize_mac(mac) for mac in vm.get('Macs') or [] if mac))}"
+
+    def lookup(self, key):
+        """
+        Find the adapters matching a VM name, MAC address (any notation) or IP address.
+
+        Returns:
+            list[dict]: The matching entries (see entries()).
+        """
+        with self._lock:
+            db = self._connect()
+            rows = db.execute(
+                "SELECT a.*, v.state FROM adapters a JOIN vms v USING (host, vm) WHERE a.vm = ? COLLATE NOCASE"
+                " OR a.mac = ?"
+                " OR (a.host, a.vm, a.mac) IN (SELECT host, vm, mac FROM addresses WHERE ip = ?)"
+                " ORDER BY a.host, a.vm, a.mac",
+                (key, normalize_mac(key), key),
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def entries(self, host=None):
+        """
+        Return every indexed adapter, optionally only for one host.
+
+        Returns:
+            list[dict]: Entries with structure:
+            [
+                {"Host": "atlas", "VMName": "hyperlab-1", "State": "Running", "MAC": "00155D234A12",
+                 "IP": "192.168.1.101", "IPAddresses": ["192.168.1.101", "fe80::1"], "SwitchName": "Default Switch"}
+            ]
+        """
+        query = "SELECT a.*, v.state FROM adapters a JOIN vms v USING (host, vm)"
+        parameters = ()
+        if host is not None:
+            query += " WHERE a.host = ?"
+            parameters = (host,)
+        with self._lock:
+            rows = self._connect().execute(query + " ORDER BY a.host, a.vm, a.mac", parameters).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def vm_ips(self, host):
+        """Return {vm_name: ip} for the VMs on a host that have an IP address in the index."""
+        return {entry["VMName"]: entry["IP"] for entry in self.entries(host) if entry["IP"]}
+
+    def clear(self):
+        """Forget every indexed host."""
+        with self._lock:
+            db = self._connect()
+            with db:
+                for table in ("hosts", "vms", "adapters", "addresses"):
+                    db.execute(f"DELETE FROM {table}")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _entry(row):
+        return {
+            "Host": row["host"], "VMName": row["vm"], "State": row["state"], "MAC": row["mac"], "IP": row["ip"],
+            "IPAddresses": json.loads(row["ips"] or "[]"), "SwitchName": row["switch"],
+        }
+
+
+network_index = NetworkIndex()
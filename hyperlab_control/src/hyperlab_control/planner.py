@@ -0,0 +1,130 @@
+import fnmatch
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hyperlab_control.timeouts import time_left
+from hyperlab_control.wake import port_open
+
+# Lab roles by VM name pattern, matched case-insensitively in order; the first match wins
+LAB_ROLES = [
+    ("hyperlab-control*", "control-plane"),
+    ("hyperlab-master*", "control-plane"),
+    ("hyperlab-cp*", "control-plane"),
+    ("hyperlab-storage*", "storage"),
+    ("hyperlab-worker*", "worker"),
+]
+DEFAULT_ROLE = "other"
+
+# Roles that must be up and ready before a role is started
+ROLE_DEPENDENCIES = {
+    "control-plane": [],
+    "storage": [],
+    "worker": ["control-plane", "storage"],
+}
+
+# TCP port on the VM that signals readiness for each role; roles without one are not gated
+ROLE_READINESS_PORTS = {
+    "control-plane": 6443,  # kube-apiserver
+    "storage": 22,
+    "worker": 10250,  # kubelet
+}
+
+# Seconds to wait for a wave to become ready before the remaining waves are abandoned
+READY_TIMEOUT = 600
+
+# Seconds between readiness probe rounds
+READY_POLL_INTERVAL = 2
+
+
+def role_of(vm_name):
+    """Return the lab role of a VM based on LAB_ROLES."""
+    for pattern, role in LAB_ROLES:
+        if fnmatch.fnmatch(vm_name.lower(), pattern.lower()):
+            return role
+    return DEFAULT_ROLE
+
+
+def _role_levels():
+    roles = set(ROLE_DEPENDENCIES) | {DEFAULT_ROLE} | {role for _, role in LAB_ROLES}
+    levels = {}
+
+    def level(role, seen=()):
+        if role not in levels:
+            if role in seen:
+                raise ValueError(f"Circular role dependency involving '{role}'")
+            dependencies = ROLE_DEPENDENCIES.get(role, [])
+            unknown = [dep for dep in dependencies if dep not in roles]
+            if unknown:
+                raise ValueError(f"Role '{role}' depends on unknown role(s): {', '.join(unknown)}")
+            levels[role] = 1 + max((level(dep, seen + (role,)) for dep in dependencies), default=-1)
+        return levels[role]
+
+    for role in roles:
+        level(role)
+    return levels
+
+
+def plan_waves(vms):
+    """
+    Group VMs into start waves following ROLE_DEPENDENCIES.
+
+    Args:
+        vms (list[tuple[str, str]]): (host, vm_name) pairs.
+
+    Returns:
+        list[list[tuple[str, str]]]: The waves in start order, each sorted by host and VM name.
+    """
+    levels = _role_levels()
+    waves = {}
+    for host, vm_name in vms:
+        waves.setdefault(levels[role_of(vm_name)], []).append((host, vm_name))
+    return [sorted(waves[level]) for level in sorted(waves)]
+
+
+def wait_until_ready(vms, lookup_ips, timeout=READY_TIMEOUT, poll_interval=READY_POLL_INTERVAL):
+    """
+    Wait until every VM answers on its role's readiness port.
+
+    VM IPs are looked up again on every round until known, since guests only report
+    their addresses once they have booted.
+
+    Args:
+        vms (list[tuple[str, str]]): (host, vm_name) pairs to wait for.
+        lookup_ips (callable): Called with a host, returns {vm_name: ip} for that host.
+        timeout (float): Seconds to wait in total, never past the task deadline.
+        poll_interval (float): Seconds between probe rounds.
+
+    Returns:
+        dict[tuple[str, str], float | None]: Seconds until each VM was ready, None if it never was.
+    """
+    start = time.monotonic()
+    left = time_left()
+    deadline = start + (timeout if left is None else min(timeout, max(left, 0)))
+    ports = {vm: ROLE_READINESS_PORTS.get(role_of(vm[1])) for vm in vms}
+    ready = {vm: 0.0 if ports[vm] is None else None for vm in vms}
+    ips = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(vms)))) as executor:
+        while True:
+            waiting = [vm for vm, seconds in ready.items() if seconds is None]
+            if not waiting:
+                break
+
+            for host in sorted({host for host, vm_name in waiting if (host, vm_name) not in ips}):
+                for vm_name, ip in (lookup_ips(host) or {}).items():
+                    if ip:
+                        ips[(host, vm_name)] = ip
+
+            probes = {vm: executor.submit(port_open, ips[vm], ports[vm]) for vm in waiting if vm in ips}
+            for vm, probe in probes.items():
+                if probe.result():
+                    ready[vm] = round(time.monotonic() - start, 2)
+                    logging.info(f"✅ {vm[1]} on {vm[0]} ready on {ips[vm]}:{ports[vm]} after {ready[vm]}s")
+
+            if time.monotonic() >= deadline:
+                break
+            if any(seconds is None for seconds in ready.values()):
+                time.sleep(min(poll_interval, max(0, deadline - time.monotonic())))
+
+    return ready
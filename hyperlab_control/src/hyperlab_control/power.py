@@ -0,0 +1,37 @@
+import os
+import time
+
+from hyperlab_control.powershell import run_script
+from hyperlab_control.wake import SSH_PORT, port_open, wait_until
+
+# Seconds the lab VMs get to be saved or stopped before a host power-down is abandoned
+QUIESCE_BUDGET = float(os.environ.get("HYPERLAB_QUIESCE_BUDGET", 300))
+
+# Seconds Windows waits before shutting down or restarting, so the command's reply gets back first
+POWER_DELAY = 5
+
+# Seconds to wait for a powered-down host to stop accepting SSH connections
+OFFLINE_TIMEOUT = 120
+
+# Host power actions, run directly in the host's PowerShell session. Hibernation has no
+# delay option, so it is started as a detached process and the script returns at once.
+POWER_ACTIONS = {
+    "shutdown": "shutdown.exe /s /f /t {delay}",
+    "restart": "shutdown.exe /r /f /t {delay}",
+    "hibernate": "Start-Process -FilePath shutdown.exe -ArgumentList '/h' -WindowStyle Hidden",
+}
+
+
+def power_action(conn, action, delay=POWER_DELAY):
+    """
+    Issue a host power action (see POWER_ACTIONS) without waiting for it to take effect.
+
+    Returns:
+        bool: Whether the host accepted the action.
+    """
+    return run_script(conn, POWER_ACTIONS[action].format(delay=int(delay)), timeout=30) is not None
+
+
+def wait_offline(host, timeout=OFFLINE_TIMEOUT, ssh_port=SSH_PORT):
+    """Wait until a host stops accepting SSH connections, returning whether it did within the timeout."""
+    return wait_until(lambda: not port_open(host, ssh_port), time.monotonic() + timeout)
@@ -0,0 +1,521 @@
+import atexit
+import base64
+import collections
+import itertools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from hyperlab_control.connections import pool
+from hyperlab_control.metrics import cmdlet_of, metrics
+from hyperlab_control.progress import show_progress
+from hyperlab_control.timeouts import COMMAND_TIMEOUT, capped, command_timeout, retry
+
+# Run commands in a long-lived powershell.exe per host instead of spawning one per command
+USE_SESSIONS = os.environ.get("HYPERLAB_PS_SESSIONS", "1") != "0"
+
+# Seconds to wait for a new worker to start and load the Hyper-V module
+SESSION_START_TIMEOUT = 60
+
+FRAME_PREFIX = b"<<HYPERLAB>>"
+
+# The worker reads one JSON request per line from stdin and answers each with one framed
+# JSON line on stdout. Anything else the scripts print is not framed and gets ignored.
+WORKER_SCRIPT = """
+$ProgressPreference = 'SilentlyContinue'
+[Console]::OutputEncoding = [Text.Encoding]::UTF8
+Import-Module Hyper-V -ErrorAction SilentlyContinue
+$frame = '<<HYPERLAB>>'
+[Console]::Out.WriteLine($frame + '{"id":0,"ok":true}')
+[Console]::Out.Flush()
+while ($null -ne ($line = [Console]::In.ReadLine())) {
+    if (-not $line.Trim()) { continue }
+    $request = ConvertFrom-Json $line
+    $script = [Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($request.script))
+    $text = ''
+    $errors = @()
+    try {
+        if ($request.stream) {
+            # Forward every output line as its own frame as soon as the script emits it
+            & ([scriptblock]::Create($script)) 2>&1 | ForEach-Object {
+                if ($_ -is [Management.Automation.ErrorRecord]) {
+                    $errors += $_.ToString()
+                    return
+                }
+                foreach ($line in @($_ | Out-String -Stream -Width 4096)) {
+                    $message = [ordered]@{ id = $request.id; line = "$line" }
+                    [Console]::Out.WriteLine($frame + (ConvertTo-Json -InputObject $message -Compress))
+                }
+                [Console]::Out.Flush()
+            }
+        } else {
+            $records = @(& ([scriptblock]::Create($script)) 2>&1)
+            $errors = @($records | Where-Object { $_ -is [Management.Automation.ErrorRecord] } | ForEach-Object { $_.ToString() })
+            $text = ($records | Where-Object { $_ -isnot [Management.Automation.ErrorRecord] } | Out-String -Width 4096)
+        }
+    } catch {
+        $errors += $_.ToString()
+    }
+    $response = [ordered]@{ id = $request.id; ok = ($errors.Count -eq 0); stdout = "$text".Trim(); stderr = ($errors -join "`n") }
+    [Console]::Out.WriteLine($frame + (ConvertTo-Json -InputObject $response -Compress))
+    [Console]::Out.Flush()
+}
+"""
+
+# Reports each VM as one JSON line as soon as its command finishes
+BATCH_SCRIPT = """
+$ProgressPreference = 'SilentlyContinue'
+$ErrorActionPreference = 'Stop'
+foreach ($name in {targets}) {{
+    $timer = [Diagnostics.Stopwatch]::StartNew()
+    try {{
+        $output = {command} | Select-Object -Last 1
+        $result = [pscustomobject]@{{ VMName = $name; Success = $true; Error = $null
+                                      Seconds = [math]::Round($timer.Elapsed.TotalSeconds, 3); Output = $output }}
+    }} catch {{
+        $result = [pscustomobject]@{{ VMName = $name; Success = $false; Error = $_.Exception.Message
+                                      Seconds = [math]::Round($timer.Elapsed.TotalSeconds, 3); Output = $null }}
+    }}
+    ConvertTo-Json -InputObject $result -Compress -Depth 5
+}}
+"""
+
+
+def quote(value):
+    """Quote a value as a single-quoted PowerShell string literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def quote_list(values):
+    """Render a Python list as a PowerShell array of string literals."""
+    return "@(" + ", ".join(quote(value) for value in values) + ")"
+
+
+def encode_command(script):
+    """Encode a script for powershell -EncodedCommand (base64 of UTF-16LE)."""
+    return base64.b64encode(script.encode("utf-16-le")).decode("ascii")
+
+
+class PowerShellError(Exception):
+    """A script reported errors, or the worker running it went away."""
+
+
+class PowerShellTimeout(PowerShellError):
+    """A script did not finish within its timeout."""
+
+
+class ScriptError(PowerShellError):
+    """The script ran and reported errors; running it again would not help."""
+
+
+class PowerShellSession:
+    """
+    A long-lived powershell.exe on a Hyper-V host, driven over a single SSH channel.
+
+    The Hyper-V module is loaded once when the worker starts, so each request only
+    costs a round trip plus the cmdlet itself. Requests are serialized per session, but
+    the lock is not held while a stream's consumer handles a line: a request arriving
+    meanwhile first reads the rest of the stream into the stream's queue.
+    """
+
+    def __init__(self, conn, timeout=COMMAND_TIMEOUT):
+        self.conn = conn
+        self.timeout = timeout
+        self.channel = None
+        self._buffer = b""
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Request id -> (frames read but not yet consumed, deadline, channel) of each open stream
+        self._streams = {}
+
+    @property
+    def alive(self):
+        channel = self.channel
+        return channel is not None and not channel.closed and not channel.exit_status_ready()
+
+    def start(self):
+        """Start (or restart) the remote worker and wait until it is ready."""
+        self.close()
+        host = pool.host_of(self.conn)
+        with metrics.timer("channel", host=host, cmdlet="powershell"):
+            channel = self.conn.transport.open_session()
+            channel.exec_command(
+                "powershell -NoProfile -NonInteractive -NoLogo -ExecutionPolicy Bypass "
+                f"-EncodedCommand {encode_command(WORKER_SCRIPT)}"
+            )
+        self.channel = channel
+        self._buffer = b""
+        with metrics.timer("spawn", host=host, cmdlet="powershell"):
+            self._read_frame(0, time.monotonic() + capped(SESSION_START_TIMEOUT))
+        logging.debug(f"PowerShell session ready on {self.conn.host}")
+
+    def close(self):
+        """Stop the remote worker by closing its channel."""
+        if self.channel is not None:
+            try:
+                self.channel.close()
+            except Exception:
+                pass
+            self.channel = None
+
+    def request(self, script, timeout=None):
+        """
+        Run a script in the worker and return its response frame.
+
+        A worker that has died since the last request is restarted transparently.
+        A worker that times out is killed so the next request starts a fresh one.
+        """
+        with self._lock:
+            self._ready()
+
+            request_id = next(self._ids)
+            payload = base64.b64encode(script.encode("utf-8")).decode("ascii")
+            deadline = time.monotonic() + (timeout or self.timeout)
+            try:
+                with metrics.timer("execute", host=pool.host_of(self.conn), cmdlet=cmdlet_of(script)):
+                    self.channel.sendall((json.dumps({"id": request_id, "script": payload}) + "\n").encode("ascii"))
+                    return self._read_frame(request_id, deadline)
+            except Exception:
+                self.close()
+                raise
+
+    def stream(self, script, timeout=None):
+        """
+        Run a script in the worker and yield its output lines as the script emits them.
+
+        Only the lines not yet consumed are buffered, and the session stays available to
+        other requests while the consumer handles a line. The "execute" timing covers only
+        the time spent waiting for the worker. A stream abandoned before its end kills the
+        worker, since it would otherwise keep writing into the next request.
+
+        Raises:
+            ScriptError: Once the output has ended, if the script reported errors.
+        """
+        host = pool.host_of(self.conn)
+        started = time.monotonic()
+        with self._lock:
+            self._ready()
+
+            request_id = next(self._ids)
+            payload = base64.b64encode(script.encode("utf-8")).decode("ascii")
+            deadline = time.monotonic() + (timeout or self.timeout)
+            frames = collections.deque()
+            channel = self.channel
+            try:
+                channel.sendall((json.dumps({"id": request_id, "script": payload, "stream": True}) + "\n").encode("ascii"))
+            except Exception:
+                self.close()
+                raise
+            self._streams[request_id] = (frames, deadline, channel)
+        elapsed = time.monotonic() - started
+
+        frame = None
+        try:
+            while True:
+                started = time.monotonic()
+                with self._lock:
+                    if not frames:
+                        if self.channel is not channel:
+                            raise PowerShellError(f"PowerShell session on {self.conn.host} was restarted during a stream")
+                        frames.append(self._read_frame(request_id, deadline))
+                    frame = frames.popleft()
+                elapsed += time.monotonic() - started
+                if "line" not in frame:
+                    break
+                yield frame["line"]
+        finally:
+            with self._lock:
+                del self._streams[request_id]
+                if (frame is None or "line" in frame) and self.channel is channel:
+                    self.close()
+            metrics.observe("execute", elapsed, host=host, cmdlet=cmdlet_of(script))
+        if not frame.get("ok"):
+            raise ScriptError(frame.get("stderr") or "Command failed")
+
+    def run(self, script, timeout=None):
+        """Run a script and return its stripped output, raising PowerShellError if it reported errors."""
+        response = self.request(script, timeout=timeout)
+        if not response.get("ok"):
+            raise ScriptError(response.get("stderr") or "Command failed")
+        return response.get("stdout") or ""
+
+    def _ready(self):
+        """Start the worker if needed and wait for any unfinished stream, queueing its frames for its consumer."""
+        if not self.alive:
+            self.start()
+        try:
+            for request_id, (frames, deadline, channel) in self._streams.items():
+                while channel is self.channel and (not frames or "line" in frames[-1]):
+                    frames.append(self._read_frame(request_id, deadline))
+        except PowerShellError:
+            # The stream overran its timeout or the worker died; its consumer finds the worker replaced
+            self.start()
+
+    def _read_frame(self, request_id, deadline):
+        while True:
+            while b"\n" in self._buffer:
+                line, self._buffer = self._buffer.split(b"\n", 1)
+                line = line.rstrip(b"\r")
+                if not line.startswith(FRAME_PREFIX):
+                    continue
+                frame = json.loads(line[len(FRAME_PREFIX):].decode("utf-8"))
+                if frame.get("id") == request_id:
+                    return frame
+                if frame.get("id") in self._streams:
+                    self._streams[frame["id"]][0].append(frame)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PowerShellTimeout(f"Timed out waiting for PowerShell on {self.conn.host}")
+            self.channel.settimeout(remaining)
+            try:
+                chunk = self.channel.recv(65536)
+            except socket.timeout:
+                raise PowerShellTimeout(f"Timed out waiting for PowerShell on {self.conn.host}")
+            if not chunk:
+                raise PowerShellError(f"PowerShell session on {self.conn.host} exited unexpectedly")
+            self._buffer += chunk
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(conn):
+    """Return the persistent PowerShell session for a connection, creating it if needed."""
+    key = (pool.host_of(conn), conn.user)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None or session.conn is not conn:
+            # The pool replaced the connection, so the old worker is gone with it
+            if session is not None:
+                session.close()
+            session = _sessions[key] = PowerShellSession(conn)
+        return session
+
+
+def close_sessions():
+    """Stop every persistent PowerShell worker."""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_sessions)
+
+
+def _attempt(conn, func, retry_failures, quiet=False):
+    """
+    Call func(conn), optionally retrying with backoff, and return None after logging any failure.
+
+    A retry goes through the pool, which replaces the connection if it died. Errors the
+    script itself reported, and output that could not be parsed, are never retried.
+    Failures are logged at debug level if `quiet` is set.
+    """
+    host = pool.host_of(conn)
+    attempts = itertools.count()
+
+    def attempt():
+        return func(pool.get(host, conn.user) if next(attempts) else conn)
+
+    try:
+        if retry_failures:
+            return retry(attempt, f"Query on {host}",
+                         should_retry=lambda e: not isinstance(e, (ScriptError, ValueError)))
+        return attempt()
+    except Exception as e:
+        if quiet:
+            logging.debug(f"Script execution failed on {conn.host}: {e}")
+        else:
+            logging.error(f"⚠️ Script execution failed on {conn.host}:\n{e}")
+        return None
+
+
+def run_script(conn, script, timeout=None, retry_failures=False, quiet=False):
+    """
+    Run a multi-line PowerShell script on the host.
+
+    The script runs in the host's persistent session, or in a fresh powershell.exe
+    started with -EncodedCommand when sessions are disabled.
+
+    Args:
+        conn (fabric.Connection): Connection to the Hyper-V host.
+        script (str): The PowerShell script.
+        timeout (float, optional): Seconds to wait, defaults to the script's cmdlet entry in
+            COMMAND_TIMEOUTS. Never runs past the task deadline.
+        retry_failures (bool): Retry lost connections, dead workers and timeouts with backoff,
+            reconnecting first. Only for idempotent, read-only scripts; errors the script
+            itself reports are never retried.
+        quiet (bool): Log failures at debug level, for probes that are expected to fail.
+
+    Returns:
+        str | None: The stripped stdout, or None if the script failed.
+    """
+
+    def run_once(conn):
+        seconds = command_timeout(cmdlet_of(script), timeout)
+        if USE_SESSIONS:
+            return get_session(conn).run(script, timeout=seconds)
+        from invoke.exceptions import CommandTimedOut, UnexpectedExit
+
+        command = f"powershell -NoProfile -NonInteractive -EncodedCommand {encode_command(script)}"
+        # Channel setup and powershell.exe start-up cannot be told apart here, so they count as execution
+        try:
+            with metrics.timer("execute", host=pool.host_of(conn), cmdlet=cmdlet_of(script)):
+                return conn.run(command, hide=True, timeout=seconds).stdout.strip()
+        except UnexpectedExit as e:
+            raise ScriptError(e.result.stderr.strip() or f"Exited with code {e.result.exited}") from e
+        except CommandTimedOut as e:
+            raise PowerShellTimeout(f"Timed out after {seconds:.0f}s on {conn.host}") from e
+
+    return _attempt(conn, run_once, retry_failures, quiet)
+
+
+def stream_script(conn, script, timeout=None):
+    """
+    Run a script on the host and yield its stdout line by line as it arrives.
+
+    Nothing is retried and failures are raised rather than logged, since the caller may
+    already have acted on part of the output.
+
+    Raises:
+        ScriptError: After the last line, if the script reported errors.
+        PowerShellTimeout: If the script did not finish in time (between two lines
+            when sessions are disabled).
+        PowerShellError: If the script could not be run.
+    """
+    seconds = command_timeout(cmdlet_of(script), timeout)
+    if USE_SESSIONS:
+        yield from get_session(conn).stream(script, timeout=seconds)
+        return
+
+    command = f"powershell -NoProfile -NonInteractive -EncodedCommand {encode_command(script)}"
+    # Timed without the consumer's handling of each line, which runs while the generator is suspended
+    started = time.monotonic()
+    elapsed = 0.0
+    try:
+        _, stdout, stderr = conn.client.exec_command(command, timeout=seconds)
+        try:
+            for line in stdout:
+                elapsed += time.monotonic() - started
+                started = None
+                yield line.rstrip("\r\n")
+                started = time.monotonic()
+            if stdout.channel.recv_exit_status() != 0:
+                raise ScriptError(stderr.read().decode("utf-8", errors="replace").strip() or "Command failed")
+        except socket.timeout:
+            raise PowerShellTimeout(f"Timed out after {seconds:.0f}s on {conn.host}")
+        finally:
+            stdout.channel.close()
+    finally:
+        if started is not None:
+            elapsed += time.monotonic() - started
+        metrics.observe("execute", elapsed, host=pool.host_of(conn), cmdlet=cmdlet_of(script))
+
+
+def stream_json(conn, script, timeout=None):
+    """
+    Run a script printing one compressed JSON document per line, e.g. with
+    `ConvertTo-Json -InputObject $record -Compress` per object, and yield each record as it arrives.
+
+    Raises:
+        ScriptError: If a line is not valid JSON, or the script reported errors.
+    """
+    for line in stream_script(conn, script, timeout=timeout):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ScriptError(f"Invalid JSON line from {conn.host}: {e}\nRaw Line:\n{line[:500]}")
+
+
+def run_json_lines(conn, script, timeout=None, retry_failures=False, on_record=None):
+    """
+    Run a script printing one compressed JSON document per line and collect the records.
+
+    Unlike run_json_script, the output is parsed while it arrives, so only the records
+    are held in memory rather than the whole output text as well.
+
+    Args:
+        on_record (callable, optional): Called with each record as it arrives, e.g. to show
+            progress. Not combined with retry_failures, since a retry reports records again.
+
+    Returns:
+        list | None: The records, or None if the script failed.
+    """
+
+    def collect(conn):
+        records = []
+        for record in stream_json(conn, script, timeout=timeout):
+            records.append(record)
+            if on_record is not None:
+                on_record(record)
+        return records
+
+    return _attempt(conn, collect, retry_failures)
+
+
+def run_json_script(conn, script, timeout=None, retry_failures=False):
+    """Run a script that prints a JSON document and return the parsed result, or None on failure."""
+    output = run_script(conn, script, timeout=timeout, retry_failures=retry_failures)
+    if output is None:
+        return None
+    if not output:
+        return []
+    try:
+        with metrics.timer("parse", host=pool.host_of(conn), cmdlet=cmdlet_of(script)):
+            return json.loads(output)
+    except json.JSONDecodeError as e:
+        logging.error(f"⚠️ Failed to parse JSON from {conn.host}: {e}\nRaw Output:\n{output}")
+        return None
+
+
+def batch_vm_action(conn, command, vm_names=None, pattern=None):
+    """
+    Run a per-VM command for many VMs in one PowerShell invocation.
+
+    Each VM's result streams back as soon as its command finishes, which keeps the
+    progress line on an interactive terminal live during long batches.
+
+    Args:
+        conn (fabric.Connection): Connection to the Hyper-V host.
+        command (str): PowerShell command run once per VM, with the VM name in `$name`,
+            e.g. 'Stop-VM -Name $name'.
+        vm_names (list[str], optional): The VMs to target.
+        pattern (str, optional): A Get-VM wildcard to select the VMs on the host instead,
+            which saves the separate listing round trip.
+
+    Returns:
+        list[dict] | None: One result per VM with structure:
+        [
+            {"VMName": "hyperlab-1", "Success": true, "Error": null, "Seconds": 1.52, "Output": null}
+        ]
+        where Output is the last object the command emitted.
+        or None if the script could not be run.
+    """
+    if vm_names is not None:
+        if not vm_names:
+            return []
+        targets = quote_list(vm_names)
+    else:
+        targets = f"(Get-VM -Name {quote(pattern or '*')} | Select-Object -ExpandProperty Name)"
+
+    operation = cmdlet_of(command)
+    progress_key = (pool.host_of(conn), operation)
+    done = []
+
+    def on_result(result):
+        done.append(result["VMName"])
+        show_progress(progress_key, f"{operation}: {len(done)}{f'/{len(vm_names)}' if vm_names else ''} done")
+
+    try:
+        with metrics.tagged(cmdlet=operation):
+            return run_json_lines(conn, BATCH_SCRIPT.format(targets=targets, command=command), on_record=on_result)
+    finally:
+        show_progress(progress_key, None)
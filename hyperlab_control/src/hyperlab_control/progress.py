@@ -0,0 +1,25 @@
+import sys
+import threading
+
+_progress = {}
+_progress_lock = threading.Lock()
+
+
+def show_progress(key, text):
+    """
+    Render one status line for all running operations on an interactive terminal.
+
+    Args:
+        key (tuple[str, str]): (host, operation) the text belongs to.
+        text (str | None): The operation's status, or None once it has finished.
+    """
+    if not sys.stderr.isatty():
+        return
+    with _progress_lock:
+        if text is None:
+            _progress.pop(key, None)
+        else:
+            _progress[key] = text
+        line = " | ".join(f"{host} {label}" for (host, _), label in sorted(_progress.items()))
+        sys.stderr.write("\r\033[K" + (f"⏳ {line}" if line else ""))
+        sys.stderr.flush()
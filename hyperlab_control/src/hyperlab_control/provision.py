@@ -0,0 +1,159 @@
+import os
+import random
+import re
+
+from hyperlab_control.memory import HOST_RESERVE_MB
+from hyperlab_control.netindex import normalize_mac
+from hyperlab_control.powershell import quote, run_json_script
+
+# Sysprepped or cloud-init enabled worker image, present at this path on every host that gets
+# workers. It becomes the read-only parent of every worker's differencing disk, so it must
+# never be attached to a VM or modified once workers use it.
+GOLDEN_VHDX = os.environ.get("HYPERLAB_GOLDEN_VHDX", r"C:\HyperLab\Golden\hyperlab-worker.vhdx")
+
+# Host directory holding the workers' differencing disks
+WORKER_DISK_DIR = os.environ.get("HYPERLAB_WORKER_DISK_DIR", r"C:\HyperLab\Disks")
+
+WORKER_PREFIX = "hyperlab-worker-"
+WORKER_MEMORY_MB = 4096
+WORKER_CPUS = 2
+WORKER_SWITCH = os.environ.get("HYPERLAB_WORKER_SWITCH", "Default Switch")
+
+# Free space wanted on the disk directory per new worker; differencing disks start at a few MB
+# and grow with what the guest writes
+WORKER_DISK_BUDGET_GB = 4
+
+# Hyper-V's own MAC prefix, so static worker MACs look like the dynamic ones it assigns
+MAC_PREFIX = "00155D"
+
+# Everything placement needs from a host, in one round trip
+CAPACITY_SCRIPT = """
+$os = Get-CimInstance Win32_OperatingSystem
+$vms = @(Get-VM)
+$drive = Get-PSDrive -Name ({disk_dir}.Substring(0, 1)) -ErrorAction SilentlyContinue
+ConvertTo-Json -Compress -Depth 3 -InputObject ([pscustomobject]@{{
+    VMs = @($vms | Select-Object -ExpandProperty Name)
+    Macs = @($vms | Get-VMNetworkAdapter | Select-Object -ExpandProperty MacAddress)
+    Golden = (Test-Path -LiteralPath {golden})
+    TotalMB = [math]::Round($os.TotalVisibleMemorySize / 1KB)
+    CommittedMB = [math]::Round(($vms | Measure-Object -Property MemoryStartup -Sum).Sum / 1MB)
+    FreeDiskGB = if ($drive) {{ [math]::Round($drive.Free / 1GB, 1) }} else {{ $null }}
+}})
+"""
+
+# Runs as one background job per worker, with the worker's name in `$name`. A worker that
+# fails half way is removed again, so a retry starts from a clean slate.
+CREATE_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$mac = @{{ {macs} }}[$name]
+New-Item -ItemType Directory -Force -Path {disk_dir} | Out-Null
+$disk = Join-Path {disk_dir} "$name.vhdx"
+try {{
+    New-VHD -Path $disk -ParentPath {golden} -Differencing | Out-Null
+    New-VM -Name $name -Generation 2 -MemoryStartupBytes {memory_mb}MB -VHDPath $disk -SwitchName {switch} | Out-Null
+    Set-VMProcessor -VMName $name -Count {cpus} -ExposeVirtualizationExtensions ${nested}
+    Set-VMMemory -VMName $name -DynamicMemoryEnabled ${dynamic}
+    Set-VMNetworkAdapter -VMName $name -StaticMacAddress $mac -MacAddressSpoofing {spoofing}
+    Set-VMFirmware -VMName $name -SecureBootTemplate MicrosoftUEFICertificateAuthority
+    Set-VM -Name $name -AutomaticCheckpointsEnabled $false
+    if (${start}) {{ Start-VM -Name $name }}
+}} catch {{
+    Remove-VM -Name $name -Force -ErrorAction SilentlyContinue
+    Remove-Item -LiteralPath $disk -Force -ErrorAction SilentlyContinue
+    throw
+}}
+$mac
+"""
+
+
+def read_capacity(conn, golden=GOLDEN_VHDX, disk_dir=WORKER_DISK_DIR):
+    """
+    Read what worker placement needs to know about a host.
+
+    Returns:
+        dict | None: The host's capacity with structure:
+        {
+            "VMs": ["hyperlab-control-1", "hyperlab-worker-1"], "Macs": ["00155D010203"],
+            "Golden": true, "TotalMB": 131072, "CommittedMB": 24576, "FreeDiskGB": 512.3
+        }
+        or None if the host could not be queried.
+    """
+    capacity = run_json_script(conn, CAPACITY_SCRIPT.format(golden=quote(golden), disk_dir=quote(disk_dir)),
+                               retry_failures=True)
+    if not isinstance(capacity, dict):
+        return None
+    capacity["VMs"] = [name for name in capacity.get("VMs") or [] if name]
+    capacity["Macs"] = [normalize_mac(mac) for mac in capacity.get("Macs") or [] if mac]
+    return capacity
+
+
+def next_worker_names(existing, count):
+    """Return `count` new worker names, filling gaps in the numbering of the existing workers first."""
+    matches = (re.fullmatch(rf"{WORKER_PREFIX}(\d+)", name.lower()) for name in existing)
+    taken = {int(match.group(1)) for match in matches if match}
+    names, number = [], 1
+    while len(names) < count:
+        if number not in taken:
+            names.append(f"{WORKER_PREFIX}{number}")
+        number += 1
+    return names
+
+
+def new_macs(count, taken):
+    """Return `count` random static MAC addresses under MAC_PREFIX that are not in `taken`."""
+    taken = {normalize_mac(mac) for mac in taken}
+    macs = []
+    while len(macs) < count:
+        mac = MAC_PREFIX + "".join(f"{random.randrange(256):02X}" for _ in range(3))
+        if mac not in taken:
+            taken.add(mac)
+            macs.append(mac)
+    return macs
+
+
+def plan_placement(capacities, names, memory_mb):
+    """
+    Assign new workers to the hosts with the most uncommitted memory.
+
+    A host's uncommitted memory is its total minus HOST_RESERVE_MB and the startup memory
+    of every VM on it, running or not, so the whole lab can still run at once.
+
+    Args:
+        capacities (dict[str, dict]): Host name to read_capacity result; hosts without the
+            golden image are skipped.
+        names (list[str]): The workers to place.
+        memory_mb (int): Startup memory of each worker.
+
+    Returns:
+        tuple[dict[str, list[str]], list[str]]: Workers per host, and the workers that fit nowhere.
+    """
+    free = {host: capacity["TotalMB"] - HOST_RESERVE_MB - capacity["CommittedMB"]
+            for host, capacity in capacities.items() if capacity and capacity["Golden"]}
+    placement, unplaced = {}, []
+    for name in names:
+        host = max(free, key=free.get, default=None)
+        if host is None or free[host] < memory_mb:
+            unplaced.append(name)
+            continue
+        placement.setdefault(host, []).append(name)
+        free[host] -= memory_mb
+    return placement, unplaced
+
+
+def create_script(macs, golden=GOLDEN_VHDX, disk_dir=WORKER_DISK_DIR, memory_mb=WORKER_MEMORY_MB, cpus=WORKER_CPUS,
+                  nested=True, switch=WORKER_SWITCH, start=False):
+    """
+    Return the per-worker job script creating a worker from the golden image.
+
+    Nested virtualization needs static memory and MAC address spoofing for the guests'
+    own containers, so both follow `nested`. The job outputs the worker's MAC address.
+
+    Args:
+        macs (dict[str, str]): Static MAC address per worker name.
+    """
+    return CREATE_SCRIPT.format(
+        macs="; ".join(f"{quote(name)} = {quote(mac)}" for name, mac in macs.items()),
+        golden=quote(golden), disk_dir=quote(disk_dir), memory_mb=int(memory_mb), cpus=int(cpus),
+        nested="true" if nested else "false", dynamic="false" if nested else "true",
+        spoofing="On" if nested else "Off", switch=quote(switch), start="true" if start else "false",
+    )
@@ -0,0 +1,116 @@
+import fnmatch
+import time
+from datetime import datetime
+
+from hyperlab_control.powershell import quote, quote_list, run_json_lines
+
+# Default retention: the newest checkpoints kept per VM
+RETENTION_KEEP_LAST = 3
+
+# Default retention: checkpoints younger than this many days are kept (0 disables the rule)
+RETENTION_MAX_AGE_DAYS = 0
+
+# Checkpoints whose names match one of these patterns are baselines and never pruned
+RETENTION_KEEP_PATTERNS = ["baseline*"]
+
+# One JSON line per checkpoint, parsed as it arrives
+CHECKPOINTS_SCRIPT = """
+Get-VMSnapshot -VMName {pattern} -ErrorAction SilentlyContinue | ForEach-Object {{
+    ConvertTo-Json -Compress -Depth 3 -InputObject ([pscustomobject]@{{
+        VMName = $_.VMName
+        Name = $_.Name
+        Id = "$($_.Id)"
+        CreationTime = $_.CreationTime.ToString('o')
+    }})
+}}
+"""
+
+# Runs as one background job per VM: removes the VM's pruned checkpoints, waits for Hyper-V to
+# finish merging the differencing disks and reports how much the VM's disk chains shrank
+PRUNE_JOB_SCRIPT = """
+function Get-ChainBytes($vmName) {{
+    $total = 0
+    foreach ($drive in @(Get-VMHardDiskDrive -VMName $vmName)) {{
+        $path = $drive.Path
+        while ($path) {{
+            $total += (Get-Item -LiteralPath $path).Length
+            $path = (Get-VHD -Path $path).ParentPath
+        }}
+    }}
+    $total
+}}
+$ids = @{{ {ids} }}[$name]
+$before = Get-ChainBytes $name
+$timer = [Diagnostics.Stopwatch]::StartNew()
+Get-VMSnapshot -VMName $name | Where-Object {{ "$($_.Id)" -in $ids }} | Remove-VMSnapshot -ErrorAction Stop
+$removeSeconds = $timer.Elapsed.TotalSeconds
+do {{ Start-Sleep -Seconds 2 }} while ("$((Get-VM -Name $name).Status)" -match 'merg')
+[pscustomobject]@{{
+    Removed = @($ids).Count
+    ReclaimedBytes = $before - (Get-ChainBytes $name)
+    MergeSeconds = [math]::Round($timer.Elapsed.TotalSeconds - $removeSeconds, 1)
+}}
+"""
+
+
+def list_checkpoints(conn, pattern):
+    """
+    List the checkpoints of the VMs matching a Get-VM wildcard.
+
+    Returns:
+        list[dict] | None: Checkpoints with structure:
+        [
+            {"VMName": "hyperlab-1", "Name": "Checkpoint-hyperlab-1", "Id": "5b3c...",
+             "CreationTime": "2025-02-20T07:12:44.1234567+01:00"}
+        ]
+        or None if the host could not be queried.
+    """
+    return run_json_lines(conn, CHECKPOINTS_SCRIPT.format(pattern=quote(pattern)), retry_failures=True)
+
+
+def plan_retention(checkpoints, keep_last=RETENTION_KEEP_LAST, max_age_days=RETENTION_MAX_AGE_DAYS,
+                   keep_patterns=None, now=None):
+    """
+    Decide which checkpoints to keep and which to prune.
+
+    A checkpoint is kept if it is one of the `keep_last` newest of its VM, younger than
+    `max_age_days`, or its name matches one of `keep_patterns`. Everything else is pruned.
+
+    Returns:
+        list[dict]: The checkpoints, newest first per VM, each with "Action" ("keep" or
+        "prune") and "Reason" added.
+    """
+    keep_patterns = RETENTION_KEEP_PATTERNS if keep_patterns is None else keep_patterns
+    now = now or time.time()
+    by_vm = {}
+    for checkpoint in checkpoints:
+        by_vm.setdefault(checkpoint["VMName"], []).append(checkpoint)
+
+    plan = []
+    for vm_name in sorted(by_vm):
+        created = {checkpoint["Id"]: datetime.fromisoformat(checkpoint["CreationTime"]).timestamp()
+                   for checkpoint in by_vm[vm_name]}
+        newest_first = sorted(by_vm[vm_name], key=lambda checkpoint: created[checkpoint["Id"]], reverse=True)
+        for index, checkpoint in enumerate(newest_first):
+            age_days = (now - created[checkpoint["Id"]]) / 86400
+            if any(fnmatch.fnmatch(checkpoint["Name"].lower(), pattern.lower()) for pattern in keep_patterns):
+                reason = "baseline"
+            elif index < keep_last:
+                reason = f"newest {keep_last}"
+            elif max_age_days and age_days < max_age_days:
+                reason = f"younger than {max_age_days}d"
+            else:
+                reason = None
+            plan.append(dict(checkpoint, AgeDays=round(age_days, 1), Action="keep" if reason else "prune",
+                             Reason=reason or ""))
+    return plan
+
+
+def prune_job_script(plan):
+    """Return the per-VM job script removing the checkpoints the plan prunes."""
+    ids = {}
+    for checkpoint in plan:
+        if checkpoint["Action"] == "prune":
+            ids.setdefault(checkpoint["VMName"], []).append(checkpoint["Id"])
+    entries = [f"{quote(vm_name)} = {quote_list(vm_ids)}" for vm_name, vm_ids in ids.items()]
+    return PRUNE_JOB_SCRIPT.format(ids="; ".join(entries))
@@ -0,0 +1,75 @@
+from hyperlab_control.connections import pool
+from hyperlab_control.powershell import run_json_script
+
+# One script collecting everything the individual check_*/list_* tasks report
+STATUS_SCRIPT = """
+$os = Get-CimInstance Win32_OperatingSystem
+$drive = Get-PSDrive C
+$snapshots = @{}
+foreach ($snapshot in @(Get-VMSnapshot -VMName * -ErrorAction SilentlyContinue)) {
+    if (-not $snapshots.ContainsKey($snapshot.VMName)) { $snapshots[$snapshot.VMName] = @() }
+    $snapshots[$snapshot.VMName] += [pscustomobject]@{
+        Name = $snapshot.Name
+        CreationTime = $snapshot.CreationTime.ToString('o')
+        ParentSnapshotName = $snapshot.ParentSnapshotName
+    }
+}
+$vms = foreach ($vm in Get-VM) {
+    [pscustomobject]@{
+        Name = $vm.Name
+        State = "$($vm.State)"
+        Status = $vm.Status
+        CPUUsage = $vm.CPUUsage
+        ProcessorCount = $vm.ProcessorCount
+        MemoryAssigned = $vm.MemoryAssigned
+        MemoryDemand = $vm.MemoryDemand
+        MemoryStartup = $vm.MemoryStartup
+        DynamicMemoryEnabled = $vm.DynamicMemoryEnabled
+        UptimeSeconds = [int]$vm.Uptime.TotalSeconds
+        Checkpoints = @($snapshots[$vm.Name] | Where-Object { $_ })
+        Adapters = @($vm.NetworkAdapters | ForEach-Object {
+            [pscustomobject]@{ MacAddress = $_.MacAddress; SwitchName = $_.SwitchName; IPAddresses = @($_.IPAddresses) }
+        })
+    }
+}
+ConvertTo-Json -Compress -Depth 6 -InputObject ([pscustomobject]@{
+    User = "$env:USERDOMAIN\\$env:USERNAME"
+    Disk = [pscustomobject]@{
+        UsedGB = [math]::Round($drive.Used / 1GB, 2)
+        FreeGB = [math]::Round($drive.Free / 1GB, 2)
+    }
+    LastBootUpTime = $os.LastBootUpTime.ToString('o')
+    UptimeSeconds = [int]((Get-Date) - $os.LastBootUpTime).TotalSeconds
+    VMs = @($vms)
+})
+"""
+
+
+def collect_host_status(conn):
+    """
+    Collect a full status snapshot of a Hyper-V host in a single remote script.
+
+    Args:
+        conn (fabric.Connection): Connection to the Hyper-V host.
+
+    Returns:
+        dict | None: The snapshot with structure:
+        {
+            "Host": "atlas",
+            "User": "ATLAS\\\\hypercubian",
+            "Disk": {"UsedGB": 412.5, "FreeGB": 518.1},
+            "LastBootUpTime": "2025-02-20T07:12:44.0000000+01:00",
+            "UptimeSeconds": 86400,
+            "VMs": [
+                {"Name": "hyperlab-1", "State": "Running", "CPUUsage": 3, "MemoryAssigned": 4294967296,
+                 "MemoryDemand": 2147483648, "Checkpoints": [...], "Adapters": [...], ...}
+            ]
+        }
+        or None if the script failed.
+    """
+    status = run_json_script(conn, STATUS_SCRIPT, retry_failures=True)
+    if not isinstance(status, dict):
+        return None
+    status["Host"] = pool.host_of(conn)
+    status["VMs"] = [vm for vm in status.get("VMs") or [] if vm]
+    return status
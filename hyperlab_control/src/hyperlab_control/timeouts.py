@@ -0,0 +1,141 @@
+import functools
+import inspect
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds a single remote command may run before it is abandoned
+COMMAND_TIMEOUT = float(os.environ.get("HYPERLAB_COMMAND_TIMEOUT", 300))
+
+# Per-cmdlet overrides of COMMAND_TIMEOUT, extended by HYPERLAB_COMMAND_TIMEOUTS="Get-VM=30,Save-VM=900"
+COMMAND_TIMEOUTS = {
+    "whoami": 30,
+    "Get-VM": 60,
+    "Get-VMSnapshot": 60,
+    "Restore-VMSnapshot": 900,
+    "Remove-VMSnapshot": 900,
+}
+for _override in filter(None, os.environ.get("HYPERLAB_COMMAND_TIMEOUTS", "").split(",")):
+    _cmdlet, _, _seconds = _override.partition("=")
+    COMMAND_TIMEOUTS[_cmdlet.strip()] = float(_seconds)
+
+# Seconds to wait for the TCP connection to a host before giving up on it
+CONNECT_TIMEOUT = float(os.environ.get("HYPERLAB_CONNECT_TIMEOUT", 10))
+
+# Seconds a whole task may take across all hosts, 0 for no deadline; overridden by --deadline
+TASK_DEADLINE = float(os.environ.get("HYPERLAB_TASK_DEADLINE", 0))
+
+# Attempts for idempotent read-only queries, and the base of their exponential backoff in seconds
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5
+
+# Monotonic time the current task must finish by; each task invocation (e.g. each daemon
+# request) has its own, and fan-out host threads run in a copy of the caller's context
+_deadline = ContextVar("hyperlab_task_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The task deadline passed before the operation could finish."""
+
+
+def command_timeout(cmdlet, timeout=None):
+    """Return the explicit timeout, or the configured one for the cmdlet, capped by the task deadline."""
+    return capped(timeout or COMMAND_TIMEOUTS.get(cmdlet, COMMAND_TIMEOUT))
+
+
+@contextmanager
+def task_deadline(seconds):
+    """
+    Give the enclosed block, and every host thread it fans out to, `seconds` to finish.
+
+    A deadline set while another is active never extends it. A falsy `seconds` leaves
+    the current deadline (if any) in place.
+    """
+    previous = _deadline.get()
+    ends = previous
+    if seconds:
+        ends = time.monotonic() + float(seconds)
+        ends = ends if previous is None else min(previous, ends)
+    token = _deadline.set(ends)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_deadline(body):
+    """Wrap a task body so it accepts a `deadline` option in seconds, defaulting to TASK_DEADLINE."""
+
+    @functools.wraps(body)
+    def wrapper(c, *args, **kwargs):
+        with task_deadline(float(kwargs.pop("deadline", 0.0) or TASK_DEADLINE)):
+            return body(c, *args, **kwargs)
+
+    signature = inspect.signature(body)
+    wrapper.__signature__ = signature.replace(parameters=[
+        *signature.parameters.values(),
+        # A float default, so invoke parses --deadline 2.5 as a float rather than an int
+        inspect.Parameter("deadline", inspect.Parameter.KEYWORD_ONLY, default=0.0),
+    ])
+    return wrapper
+
+
+def time_left():
+    """Return the seconds left before the task deadline, or None if there is no deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def deadline_passed():
+    """Check whether the task deadline has passed."""
+    left = time_left()
+    return left is not None and left <= 0
+
+
+def capped(timeout):
+    """
+    Cap a timeout in seconds by the time left before the task deadline.
+
+    Raises:
+        DeadlineExceeded: If the deadline has already passed.
+    """
+    left = time_left()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Task deadline reached")
+    return left if timeout is None else min(timeout, left)
+
+
+def retry(func, description, should_retry=lambda e: True, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF):
+    """
+    Call func() until it succeeds, sleeping with full-jitter exponential backoff between attempts.
+
+    Only use this for idempotent operations. Nothing is retried once the task deadline
+    would pass during the backoff.
+
+    Args:
+        func (callable): The operation, called with no arguments.
+        description (str): What is being attempted, for the log.
+        should_retry (callable): Called with the exception; False re-raises it immediately.
+        attempts (int): Maximum number of calls.
+        backoff (float): Upper bound of the first sleep in seconds, doubled after every attempt.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts or isinstance(e, DeadlineExceeded) or not should_retry(e):
+                raise
+            delay = random.uniform(0, backoff * 2 ** (attempt - 1))
+            left = time_left()
+            if left is not None and left <= delay:
+                raise
+            logging.warning(f"🔁 {description} failed ({e}), retrying in {delay:.1f}s "
+                            f"(attempt {attempt + 1}/{attempts})")
+            time.sleep(delay)
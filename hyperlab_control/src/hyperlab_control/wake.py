@@ -0,0 +1,148 @@
+import logging
+import platform
+import socket
+import subprocess
+import time
+
+from hyperlab_control.connections import pool
+from hyperlab_control.powershell import run_script
+from hyperlab_control.timeouts import task_deadline
+
+WOL_BROADCAST = "255.255.255.255"
+WOL_PORT = 9
+
+# Seconds between repeated magic packets while the host is not answering yet
+WOL_RESEND_INTERVAL = 10
+
+SSH_PORT = 22
+
+# Exponential backoff bounds (seconds) for readiness probes
+PROBE_INITIAL_DELAY = 0.5
+PROBE_MAX_DELAY = 8
+
+# Seconds a single Hyper-V readiness check may take, connecting and starting the session included
+HYPERV_PROBE_TIMEOUT = 20
+
+
+def send_magic_packet(mac_address, broadcast=WOL_BROADCAST, port=WOL_PORT):
+    """Send a Wake-on-LAN magic packet for the given MAC address."""
+    mac_bytes = bytes.fromhex(mac_address.replace(':', '').replace('-', ''))
+    magic_packet = b'\xff' * 6 + mac_bytes * 16
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.sendto(magic_packet, (broadcast, port))
+
+
+def ping(host, timeout=1):
+    """Send a single ICMP echo request using the system ping command."""
+    if platform.system() == "Windows":
+        command = ["ping", "-n", "1", "-w", str(int(timeout * 1000)), host]
+    else:
+        command = ["ping", "-c", "1", "-W", str(max(1, int(timeout))), host]
+    try:
+        return subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              timeout=timeout + 2).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def port_open(host, port, timeout=1):
+    """Check whether a TCP port accepts connections."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def hyperv_ready(host, timeout=HYPERV_PROBE_TIMEOUT):
+    """
+    Check over SSH that the Hyper-V management service (vmms) is running.
+
+    The whole check, connecting included, takes at most `timeout` seconds. Failures are
+    expected while the host boots, so they are only logged at debug level.
+    """
+    with task_deadline(timeout):
+        try:
+            conn = pool.get(host)
+        except Exception as e:
+            logging.debug(f"Hyper-V not ready on {host}: {e}")
+            return False
+        return run_script(conn, "(Get-Service vmms).Status", quiet=True) == "Running"
+
+
+def wait_until(probe, deadline, on_retry=None):
+    """
+    Call probe() with exponential backoff until it returns True or the deadline passes.
+
+    Args:
+        probe (callable): The readiness check.
+        deadline (float): time.monotonic() value after which to give up.
+        on_retry (callable, optional): Called before each wait, e.g. to resend a packet.
+
+    Returns:
+        bool: Whether the probe succeeded before the deadline.
+    """
+    delay = PROBE_INITIAL_DELAY
+    while True:
+        if probe():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if on_retry:
+            on_retry()
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, PROBE_MAX_DELAY)
+
+
+def wake_host(host, mac_address, timeout=300, ssh_port=SSH_PORT):
+    """
+    Wake a host and wait until it is reachable, accepts SSH and has Hyper-V running.
+
+    Magic packets are resent every WOL_RESEND_INTERVAL seconds until the host answers.
+
+    Args:
+        host (str): The host name or IP.
+        mac_address (str): The host's MAC address.
+        timeout (float): Overall time budget in seconds.
+        ssh_port (int): The SSH port to probe.
+
+    Returns:
+        dict: Seconds spent in each phase, with structure:
+        {"ping": 41.2, "ssh": 12.8, "hyperv": 3.1, "total": 57.1, "ready": true, "failed_phase": null}
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    last_packet = [start]
+
+    def resend():
+        if time.monotonic() - last_packet[0] >= WOL_RESEND_INTERVAL:
+            send_magic_packet(mac_address)
+            last_packet[0] = time.monotonic()
+
+    send_magic_packet(mac_address)
+    logging.info(f"📡 Sent Wake-on-LAN packet to {host} ({mac_address})")
+
+    # A host that blocks ICMP counts as reachable once its SSH port opens
+    phases = [
+        ("ping", lambda: ping(host) or port_open(host, ssh_port), resend),
+        ("ssh", lambda: port_open(host, ssh_port), None),
+        ("hyperv", lambda: hyperv_ready(host, timeout=max(0.1, min(HYPERV_PROBE_TIMEOUT, deadline - time.monotonic()))),
+         None),
+    ]
+    timings = {"ready": False, "failed_phase": None}
+    phase_start = start
+    for phase, probe, on_retry in phases:
+        if not wait_until(probe, deadline, on_retry):
+            timings["failed_phase"] = phase
+            break
+        now = time.monotonic()
+        timings[phase] = round(now - phase_start, 2)
+        phase_start = now
+    else:
+        timings["ready"] = True
+
+    timings["total"] = round(time.monotonic() - start, 2)
+    return timings
@@ -15,8 +15,8 @@ if not exist "%PYTHON_EXE%" (
 :: Change to the project directory
 pushd "%PROJECT_DIR%"
 
-:: Run Fabric explicitly with the fabfile
-"%PYTHON_EXE%" -m fabric --collection=fabfile %*
+:: Forward the task to a running HyperLab daemon, or run it with the fabfile directly
+"%PYTHON_EXE%" -m hyperlab_control.client %*
 
 :: Restore the original directory
 popd
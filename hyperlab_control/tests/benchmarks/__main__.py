@@ -0,0 +1,38 @@
+import argparse
+import sys
+
+from tabulate import tabulate
+
+from tests.benchmarks.harness import FULL_GRID, QUICK_GRID, SCENARIOS, load_baseline, regressions, run_grid, \
+    save_baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fabfile tasks against fake Hyper-V hosts.")
+    parser.add_argument("--quick", action="store_true", help="Run the smaller grid used by the test suite")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Only run these scenarios")
+    parser.add_argument("--update-baseline", action="store_true", help="Record the results as the new baseline")
+    args = parser.parse_args()
+
+    measurements = run_grid(QUICK_GRID if args.quick else FULL_GRID, args.scenario)
+    baseline = load_baseline()
+    rows = []
+    failed = False
+    for measurement in measurements:
+        problems = regressions(measurement, baseline)
+        failed = failed or bool(problems)
+        rows.append([measurement["scenario"], measurement["hosts"], measurement["vms"], measurement["wall_time"],
+                     measurement["connections"], measurement["round_trips"], measurement["spawns"],
+                     "; ".join(problems) or "ok"])
+    print(tabulate(rows, headers=["Scenario", "Hosts", "VMs/host", "Wall (s)", "Connections", "Round trips",
+                                  "Spawns", "vs baseline"]))
+
+    if args.update_baseline:
+        save_baseline(measurements)
+        print("📌 Baseline updated")
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,533 @@
+import base64
+import contextlib
+import json
+import logging
+import re
+import socket
+import threading
+import time
+from datetime import datetime
+
+import paramiko
+
+FRAME_PREFIX = b"<<HYPERLAB>>"
+
+# Simulated latencies in seconds, before the harness scale factor is applied
+DEFAULT_LATENCY = {
+    "spawn": 1.0,  # powershell.exe start-up including the Hyper-V module
+    "request": 0.005,  # one request through an already running session
+    "query": 0.05,  # fixed cost of a Get-VM style query
+    "per_vm": 0.002,  # additional query cost per VM listed
+    "Start-VM": 2.0,
+    "Stop-VM": 3.0,
+    "Save-VM": 3.0,
+    "Checkpoint-VM": 4.0,
+    "Remove-VMSnapshot": 4.0,
+    "Restore-VMSnapshot": 3.0,
+    "Set-VMProcessor": 0.2,
+    "Set-VMMemory": 0.2,
+    "New-VM": 3.0,  # differencing disk, VM and its settings
+}
+
+# Bytes a checkpoint's differencing disk holds, reclaimed when it is merged away
+CHECKPOINT_BYTES = 2 * 2 ** 30
+
+# Server-side transports log client disconnects as errors, which is noise for benchmarks
+TRANSPORT_LOG_CHANNEL = "tests.benchmarks.fakehost.transport"
+logging.getLogger(TRANSPORT_LOG_CHANNEL).setLevel(logging.CRITICAL)
+
+_host_key = None
+_host_key_lock = threading.Lock()
+
+
+def host_key():
+    """Return the RSA host key shared by all fake hosts (generated once per process)."""
+    global _host_key
+    with _host_key_lock:
+        if _host_key is None:
+            _host_key = paramiko.RSAKey.generate(2048)
+        return _host_key
+
+
+class FakeHyperV:
+    """
+    Scriptable stand-in for PowerShell with the Hyper-V module on a Windows host.
+
+    It recognises the scripts and commands the fabfile sends, keeps VM state in memory
+    and sleeps for the configured latency of each operation.
+    """
+
+    def __init__(self, vm_count, latency=None, host_index=0):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.vms = {}
+        self.jobs = {}
+        self.host_index = host_index
+        self.power_actions = []
+        self.applied = []
+        self._next_job_id = 1
+        self._next_snapshot_id = 1
+        self._lock = threading.Lock()
+        for index in range(vm_count):
+            name = "hyperlab-control-1" if index == 0 else f"hyperlab-worker-{index}"
+            self.vms[name] = {
+                "State": "Off",
+                "Snapshots": [],
+                "MacAddress": f"00155D{host_index:02X}{index // 256:02X}{index % 256:02X}",
+                "IP": f"10.{host_index}.{index // 250}.{index % 250 + 1}",
+                "MemoryStartup": 2 ** 31,
+                "ProcessorCount": 2,
+                "Nested": False,
+            }
+
+    def sleep(self, key, count=1):
+        time.sleep(self.latency.get(key, 0) * count)
+
+    def execute(self, script):
+        """Run a script and return (stdout, errors)."""
+        script = script.strip()
+        for marker, handler in (
+            ("Get-Job -Id", self._job_tick),
+            ("UptimeSeconds", self._host_status),
+            ("Golden = (Test-Path", self._capacity),
+            ("MemoryStartupMB = ", self._desired_state),
+            ("$result = [pscustomobject]@{ VMName = $name", self._batch),
+            ("Adapters = @($vm.NetworkAdapters", self._inventory),
+            ("Macs = @($vm.NetworkAdapters.MacAddress)", self._fingerprints),
+            ("Get-VMNetworkAdapter", self._network_adapters),
+            ("Get-VMSnapshot -VMName", self._snapshots),
+            ("Get-PSDrive C", self._disk_space),
+            ("LastBootUpTime", self._uptime),
+            ("Get-Service vmms", lambda _: ("Running", [])),
+            ("shutdown.exe", self._power),
+        ):
+            if marker in script:
+                return handler(script)
+        if script == "whoami":
+            return "atlas\\bench", []
+
+        match = re.fullmatch(r"(\w+-\w+) -V?M?Name \"?([\w-]+)\"?(.*)", script)
+        if match:
+            cmdlet, name, arguments = match.groups()
+            error = self._apply(cmdlet, name, arguments)
+            return "", [error] if error else []
+        return "", [f"FakeHyperV does not support: {script[:120]}"]
+
+    def _apply(self, cmdlet, name, arguments=""):
+        """Apply a cmdlet to one VM, returning an error message or None, and log it to `applied`."""
+        error = self._change(cmdlet, name, arguments)
+        self.applied.append((cmdlet, name, error is None))
+        return error
+
+    def _change(self, cmdlet, name, arguments):
+        with self._lock:
+            if cmdlet == "New-VM":
+                return self._new_vm(name, arguments)
+            vm = self.vms.get(name)
+            if vm is None:
+                return f"Hyper-V was unable to find a virtual machine with name \"{name}\"."
+            state = vm["State"]
+            if cmdlet == "Start-VM":
+                if state == "Running":
+                    return "The operation cannot be performed while the object is in its current state."
+                vm["State"] = "Running"
+            elif cmdlet == "Stop-VM":
+                if state == "Off":
+                    return "The operation cannot be performed while the object is in its current state."
+                vm["State"] = "Off"
+            elif cmdlet == "Save-VM":
+                if state != "Running":
+                    return "The operation cannot be performed while the object is in its current state."
+                vm["State"] = "Saved"
+            elif cmdlet == "Checkpoint-VM":
+                snapshot_name = self._snapshot_name(arguments, "-SnapshotName", name) or f"{name} - checkpoint"
+                vm["Snapshots"].append({"Name": snapshot_name, "CreationTime": time.time(),
+                                        "Id": f"{name}-{self._next_snapshot_id}"})
+                self._next_snapshot_id += 1
+            elif cmdlet == "Restore-VMSnapshot":
+                snapshot_name = self._snapshot_name(arguments, "-Name", name)
+                if not any(snapshot["Name"] == snapshot_name for snapshot in vm["Snapshots"]):
+                    return f"Hyper-V was unable to find a checkpoint named \"{snapshot_name}\" for \"{name}\"."
+                vm["State"] = "Off"
+            elif cmdlet == "Remove-VMSavedState":
+                if state != "Saved":
+                    return "The operation cannot be performed while the object is in its current state."
+                vm["State"] = "Off"
+            elif cmdlet == "Resume-VM":
+                if state != "Paused":
+                    return "The operation cannot be performed while the object is in its current state."
+                vm["State"] = "Running"
+            elif cmdlet in ("Set-VMProcessor", "Set-VMMemory") and state != "Off":
+                return "The operation cannot be performed while the object is in its current state."
+            elif cmdlet == "Set-VMProcessor":
+                vm["Nested"] = "$true" in arguments
+            elif cmdlet == "Set-VMMemory":
+                vm["MemoryStartup"] = int(re.search(r"-StartupBytes (\d+)MB", arguments).group(1)) * 2 ** 20
+            elif cmdlet not in self.latency:
+                return f"FakeHyperV does not support {cmdlet}"
+        return None
+
+    def _run_job(self, cmdlet, name, arguments):
+        """Apply a background job's work to one VM, returning (error, output) as the job reports them."""
+        if cmdlet == "Remove-VMSnapshot" and "$ids = " in arguments:
+            return self._prune(name, arguments)
+        error = self._apply(cmdlet, name, arguments)
+        if cmdlet == "New-VM" and error is None:
+            return None, self.vms[name]["MacAddress"]
+        return error, None
+
+    def _prune(self, name, script):
+        """Remove the checkpoints a retention job lists for a VM and report what merging reclaimed."""
+        listed = re.search(rf"'{re.escape(name)}' = @\(([^)]*)\)", script)
+        ids = set(re.findall(r"'((?:[^']|'')*)'", listed.group(1))) if listed else set()
+        with self._lock:
+            vm = self.vms.get(name)
+            if vm is None:
+                return f"Hyper-V was unable to find a virtual machine with name \"{name}\".", None
+            kept = [snapshot for snapshot in vm["Snapshots"] if snapshot["Id"] not in ids]
+            removed = len(vm["Snapshots"]) - len(kept)
+            vm["Snapshots"] = kept
+        return None, {"Removed": removed, "ReclaimedBytes": removed * CHECKPOINT_BYTES,
+                      "MergeSeconds": round(self.latency["Remove-VMSnapshot"] * removed, 1)}
+
+    def _new_vm(self, name, script):
+        """Create a worker the way the provisioning job script does."""
+        if name in self.vms:
+            return f"Failed to create a new virtual machine: '{name}' already exists."
+        index = len(self.vms)
+        self.vms[name] = {
+            "State": "Running" if "if ($true) { Start-VM" in script else "Off",
+            "Snapshots": [],
+            "MacAddress": re.search(rf"'{re.escape(name)}' = '([0-9A-F]{{12}})'", script).group(1),
+            "IP": f"10.{self.host_index}.{index // 250}.{index % 250 + 1}",
+            "MemoryStartup": int(re.search(r"-MemoryStartupBytes (\d+)MB", script).group(1)) * 2 ** 20,
+            "ProcessorCount": int(re.search(r"-Count (\d+)", script).group(1)),
+            "Nested": "-ExposeVirtualizationExtensions $true" in script,
+        }
+        return None
+
+    @staticmethod
+    def _snapshot_name(arguments, parameter, name):
+        """Read a checkpoint name given as a string or as a ('...$name...'.Replace(...)) expression."""
+        expression = re.search(rf"{parameter} \('((?:[^']|'')*)'\.Replace", arguments)
+        if expression:
+            return expression.group(1).replace("''", "'").replace("$name", name)
+        literal = re.search(rf"{parameter} \"?([^\"]+)\"?", arguments)
+        return literal.group(1).replace("$name", name) if literal else None
+
+    def _targets(self, script):
+        names = re.search(r"foreach \(\$name in @\(([^)]*)\)\)", script)
+        if names:
+            return re.findall(r"'((?:[^']|'')*)'", names.group(1))
+        pattern = re.search(r"Get-VM -Name '([^']*)'", script)
+        regex = re.escape(pattern.group(1) if pattern else "*").replace(r"\*", ".*")
+        return [name for name in self.vms if re.fullmatch(regex, name, re.IGNORECASE)]
+
+    def _batch(self, script):
+        command = re.search(r"\$output = (.+?) \| Select-Object -Last 1", script).group(1)
+        cmdlet = command.split()[0]
+        # Per-VM script blocks, as in "& (@{ 'vm' = { Set-VMProcessor ...; Set-VMMemory ... } }[$name])"
+        blocks = {name: [step.strip() for step in block.split(";")]
+                  for name, block in re.findall(r"'((?:[^']|'')*)' = \{ (.*?) \}", command)}
+        results = []
+        self.sleep("query")
+        for name in self._targets(script):
+            started = time.monotonic()
+            if cmdlet == "&":
+                error = None
+                for step in blocks.get(name, []):
+                    self.sleep(step.split()[0])
+                    error = error or self._apply(step.split()[0], name, step)
+            else:
+                self.sleep(cmdlet)
+                error = self._apply(cmdlet, name, command)
+            results.append({"VMName": name, "Success": error is None, "Error": error,
+                            "Seconds": round(time.monotonic() - started, 3), "Output": None})
+        return "\n".join(json.dumps(result) for result in results), []
+
+    def _job_tick(self, script):
+        cancel = [int(job_id) for job_id in re.findall(r"\d+", re.search(r"foreach \(\$id in @\(([^)]*)\)\) \{\s*Stop-Job",
+                                                                         script).group(1))]
+        poll = [int(job_id) for job_id in re.findall(r"\d+", re.search(r"\$jobs = foreach \(\$id in @\(([^)]*)\)",
+                                                                       script).group(1))]
+        queue = re.findall(r"'((?:[^']|'')*)'", re.search(r"\$queue = @\(([^)]*)\)", script).group(1))
+        limit = int(re.search(r"Max\(0, (\d+) - \$running\)", script).group(1))
+        submit = re.search(r"\$job = (.+?) -AsJob", script)
+        if submit:
+            command = arguments = submit.group(1)
+        else:
+            # Start-Job script blocks are modelled by the first state-changing cmdlet they run
+            block = re.search(r"-ScriptBlock \{(.*)\}", script, re.DOTALL).group(1)
+            command = next(cmdlet for cmdlet in re.findall(r"\b[A-Z]\w+-VM\w*", block)
+                           if cmdlet in self.latency and not cmdlet.startswith("Get-"))
+            arguments = block
+        cmdlet = command.split()[0]
+        now = time.monotonic()
+
+        with self._lock:
+            for job_id in cancel:
+                self.jobs.pop(job_id, None)
+            jobs, running = [], 0
+            for job_id in poll:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    jobs.append({"Id": job_id, "State": "Missing", "Error": "Job no longer exists", "Seconds": None})
+                elif now < job["ends"]:
+                    running += 1
+                    jobs.append({"Id": job_id, "State": "Running", "Error": None, "Seconds": None})
+                else:
+                    del self.jobs[job_id]
+                    jobs.append({"Id": job_id, "State": "Failed" if job["error"] else "Completed",
+                                 "Error": job["error"] or "", "Seconds": round(job["ends"] - job["started"], 3),
+                                 "Output": job.get("output")})
+            submitted = []
+            for name in queue[:max(0, limit - running)]:
+                job_id = self._next_job_id
+                self._next_job_id += 1
+                duration = self.latency.get(cmdlet, 0)
+                self.jobs[job_id] = {"started": now, "ends": now + duration, "error": None}
+                submitted.append({"VMName": name, "Id": job_id, "Error": None})
+
+        # State changes are applied at submission; the job only models the duration
+        for submission in submitted:
+            error, output = self._run_job(cmdlet, submission["VMName"], arguments)
+            self.jobs.get(submission["Id"], {}).update(error=error, output=output)
+        self.sleep("query")
+        return json.dumps({"Jobs": jobs, "Submitted": submitted}), []
+
+    def _desired_state(self, script):
+        self.sleep("query")
+        self.sleep("per_vm", len(self.vms) * 2)
+        return json.dumps([{"Name": name, "State": vm["State"], "MemoryStartupMB": vm["MemoryStartup"] // 2 ** 20,
+                            "Nested": vm["Nested"]} for name, vm in self.vms.items()
+                           if name in self._targets(script)]), []
+
+    def _vm_records(self):
+        return [
+            {
+                "Name": name,
+                "State": vm["State"],
+                "Status": "Operating normally",
+                "CPUUsage": 3 if vm["State"] == "Running" else 0,
+                "MemoryAssigned": vm["MemoryStartup"] if vm["State"] == "Running" else 0,
+                "Uptime": "01:00:00" if vm["State"] == "Running" else "00:00:00",
+                "Adapters": [{"MacAddress": vm["MacAddress"], "SwitchName": "Default Switch",
+                              "IPAddresses": [vm["IP"]] if vm["State"] == "Running" else []}],
+            }
+            for name, vm in self.vms.items()
+        ]
+
+    def _inventory(self, script):
+        self.sleep("query")
+        self.sleep("per_vm", len(self.vms))
+        return "\n".join(json.dumps(vm) for vm in self._vm_records()), []
+
+    def _host_status(self, script):
+        self.sleep("query", 3)
+        self.sleep("per_vm", len(self.vms) * 2)
+        vms = self._vm_records()
+        for vm in vms:
+            record = self.vms[vm["Name"]]
+            vm.update({
+                "ProcessorCount": record["ProcessorCount"],
+                "MemoryDemand": vm["MemoryAssigned"] // 2,
+                "MemoryStartup": record["MemoryStartup"],
+                "DynamicMemoryEnabled": True,
+                "UptimeSeconds": 3600 if vm["State"] == "Running" else 0,
+                "Checkpoints": [{"Name": snapshot["Name"], "CreationTime": "2025-01-01T00:00:00",
+                                 "ParentSnapshotName": None} for snapshot in record["Snapshots"]],
+            })
+        return json.dumps({"User": "ATLAS\\bench", "Disk": {"UsedGB": 400.0, "FreeGB": 500.0},
+                           "LastBootUpTime": "2025-01-01T00:00:00", "UptimeSeconds": 86400, "VMs": vms}), []
+
+    def _power(self, script):
+        """Record a host power action; the fake host stays up so the VMs' state can be checked."""
+        self.power_actions.append(script)
+        return "", []
+
+    def _capacity(self, script):
+        self.sleep("query")
+        self.sleep("per_vm", len(self.vms))
+        return json.dumps({"VMs": list(self.vms), "Macs": [vm["MacAddress"] for vm in self.vms.values()],
+                           "Golden": True, "TotalMB": 131072, "FreeDiskGB": 500.0,
+                           "CommittedMB": sum(vm["MemoryStartup"] for vm in self.vms.values()) // 2 ** 20}), []
+
+    def _network_adapters(self, script):
+        with_ips = "IPAddresses" in script
+        selected = re.search(r"Get-VMNetworkAdapter -VMName @\(([^)]*)\)", script)
+        names = re.findall(r"'((?:[^']|'')*)'", selected.group(1)) if selected else list(self.vms)
+        self.sleep("query")
+        self.sleep("per_vm", len(names))
+        adapters = []
+        for vm in self._vm_records():
+            if vm["Name"] not in names:
+                continue
+            adapter = vm["Adapters"][0]
+            record = {"VMName": vm["Name"], "MacAddress": adapter["MacAddress"], "SwitchName": adapter["SwitchName"]}
+            if with_ips:
+                record["IPAddresses"] = adapter["IPAddresses"]
+            adapters.append(record)
+        return json.dumps(adapters), []
+
+    def _fingerprints(self, script):
+        self.sleep("query")
+        self.sleep("per_vm", len(self.vms))
+        return json.dumps([{"Name": name, "State": vm["State"], "Macs": [vm["MacAddress"]]}
+                           for name, vm in self.vms.items()]), []
+
+    def _snapshots(self, script):
+        self.sleep("query")
+        if "CreationTime" in script:
+            names = self._targets(script.replace("Get-VMSnapshot -VMName", "Get-VM -Name"))
+            return "\n".join(json.dumps({"VMName": name, "Name": snapshot["Name"], "Id": snapshot["Id"],
+                                         "CreationTime": datetime.fromtimestamp(snapshot["CreationTime"]).isoformat()})
+                             for name in names for snapshot in self.vms[name]["Snapshots"]), []
+        name = re.search(r"Get-VMSnapshot -VMName \"?([\w-]+)", script).group(1)
+        vm = self.vms.get(name)
+        if vm is None:
+            return "", [f"Hyper-V was unable to find a virtual machine with name \"{name}\"."]
+        lines = [f"{name} {snapshot['Name']} Standard" for snapshot in vm["Snapshots"]]
+        return "\n".join(lines), []
+
+    def _disk_space(self, script):
+        self.sleep("query")
+        return "Used (GB) Free (GB)\n--------- ---------\n   400.00    500.00", []
+
+    def _uptime(self, script):
+        self.sleep("query")
+        return "Days : 1\nHours : 0", []
+
+
+class FakeHost(paramiko.ServerInterface):
+    """
+    A local SSH server that runs every exec request against a FakeHyperV.
+
+    It counts the SSH connections, round trips (exec channels plus requests sent through a
+    running session) and powershell.exe processes that the client causes.
+    """
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.counters = {"connections": 0, "round_trips": 0, "spawns": 0}
+        self._counter_lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._transports = []
+        self._closed = False
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self._sock.getsockname()[1]}"
+
+    def count(self, counter, amount=1):
+        with self._counter_lock:
+            self.counters[counter] += amount
+
+    def start(self):
+        self._sock.listen(64)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed = True
+        self._sock.close()
+        for transport in self._transports:
+            transport.close()
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            self.count("connections")
+            transport = paramiko.Transport(client)
+            transport.set_log_channel(TRANSPORT_LOG_CHANNEL)
+            transport.add_server_key(host_key())
+            self._transports.append(transport)
+            threading.Thread(target=self._negotiate, args=(transport,), daemon=True).start()
+
+    def _negotiate(self, transport):
+        try:
+            transport.start_server(server=self)
+        except Exception:
+            transport.close()
+
+    # paramiko.ServerInterface
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        self.count("round_trips")
+        threading.Thread(target=self._handle_exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    # Exec handling
+
+    def _handle_exec(self, channel, command):
+        try:
+            script = self._decode(command)
+            self.count("spawns")
+            self.emulator.sleep("spawn")
+            if "[Console]::In.ReadLine()" in script:
+                self._serve_session(channel)
+                return
+            stdout, errors = self.emulator.execute(script)
+            if stdout:
+                channel.sendall(stdout.encode() + b"\r\n")
+            if errors:
+                channel.sendall_stderr("\n".join(errors).encode() + b"\r\n")
+            channel.send_exit_status(1 if errors else 0)
+        except Exception as e:
+            # The client may already have closed the channel, e.g. when a session is shut down
+            with contextlib.suppress(Exception):
+                channel.sendall_stderr(f"FakeHost error: {e}\r\n".encode())
+                channel.send_exit_status(255)
+        finally:
+            # Closing raises once the client has gone away
+            with contextlib.suppress(EOFError, OSError):
+                channel.close()
+
+    @staticmethod
+    def _decode(command):
+        encoded = re.search(r"-EncodedCommand (\S+)", command)
+        if encoded:
+            return base64.b64decode(encoded.group(1)).decode("utf-16-le")
+        inline = re.search(r'-Command "(.*)"\s*$', command, re.S)
+        if inline:
+            return inline.group(1)
+        return command
+
+    def _serve_session(self, channel):
+        channel.sendall(FRAME_PREFIX + b'{"id":0,"ok":true}\r\n')
+        buffer = b""
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                break
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                self.count("round_trips")
+                self.emulator.sleep("request")
+                stdout, errors = self.emulator.execute(base64.b64decode(request["script"]).decode("utf-8"))
+                if request.get("stream"):
+                    for output_line in stdout.splitlines():
+                        frame = {"id": request["id"], "line": output_line}
+                        channel.sendall(FRAME_PREFIX + json.dumps(frame).encode() + b"\r\n")
+                    stdout = ""
+                response = {"id": request["id"], "ok": not errors, "stdout": stdout, "stderr": "\n".join(errors)}
+                channel.sendall(FRAME_PREFIX + json.dumps(response).encode() + b"\r\n")
+        channel.send_exit_status(0)
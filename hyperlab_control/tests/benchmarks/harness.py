@@ -0,0 +1,177 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import time
+
+from invoke import Context
+
+import fabfile
+from hyperlab_control import jobs
+from hyperlab_control.connections import pool
+from hyperlab_control.inventory import inventory
+from hyperlab_control.netindex import network_index
+from hyperlab_control.powershell import close_sessions
+from tests.benchmarks.fakehost import DEFAULT_LATENCY, FakeHost, FakeHyperV
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Task invocations measured by the suite, each run against a freshly started process state
+SCENARIOS = {
+    "list_hyperlab_vms": lambda c: fabfile.list_hyperlab_vms(c),
+    "list_vms": lambda c: fabfile.list_vms(c),
+    "list_hyperlab_checkpoints": lambda c: fabfile.list_hyperlab_checkpoints(c),
+    "start_lab": lambda c: fabfile.start_lab(c, wait=False),
+    "stop_lab": lambda c: fabfile.stop_lab(c),
+    "create_hyperlab_checkpoints": lambda c: fabfile.create_hyperlab_checkpoints(c),
+    "host_status": lambda c: fabfile.host_status(c),
+    "get_vm_net_info": lambda c: fabfile.get_vm_net_info(c),
+    "ensure": lambda c: fabfile.ensure(c, state="off"),
+    "provision_workers": lambda c: fabfile.provision_workers(c, count=2),
+}
+
+# Scenarios that need the lab's VMs to be running beforehand
+NEEDS_RUNNING = {"stop_lab", "get_vm_net_info"}
+
+# (hosts, VMs per host) combinations
+FULL_GRID = [(1, 1), (1, 10), (1, 50), (1, 100), (5, 20), (20, 1), (20, 10)]
+QUICK_GRID = [(1, 1), (1, 40), (20, 5)]
+
+# Latencies are scaled down so the whole grid runs in seconds rather than minutes
+LATENCY_SCALE = 0.05
+
+# Allowed growth over the baseline before a measurement counts as a regression
+WALL_TIME_TOLERANCE = 2.0
+WALL_TIME_SLACK = 0.5
+ROUND_TRIP_TOLERANCE = 1.5
+
+
+class FakeLab:
+    """Start fake Hyper-V hosts and point the fabfile and connection pool at them."""
+
+    def __init__(self, hosts, vms_per_host, latency_scale=LATENCY_SCALE):
+        latency = {key: value * latency_scale for key, value in DEFAULT_LATENCY.items()}
+        self.hosts = [FakeHost(FakeHyperV(vms_per_host, latency, host_index=index)) for index in range(hosts)]
+        self._saved = None
+
+    def __enter__(self):
+        for host in self.hosts:
+            host.start()
+        self._saved = (fabfile.VM_HOSTS, pool.connect_kwargs, jobs.POLL_INTERVAL, network_index.path)
+        fabfile.VM_HOSTS = [host.address for host in self.hosts]
+        network_index.close()
+        network_index.path = ":memory:"
+        pool.connect_kwargs = {"password": "bench", "look_for_keys": False, "allow_agent": False}
+        jobs.POLL_INTERVAL = 0.02
+        reset_client()
+        return self
+
+    def __exit__(self, *exc_info):
+        reset_client()
+        network_index.close()
+        fabfile.VM_HOSTS, pool.connect_kwargs, jobs.POLL_INTERVAL, network_index.path = self._saved
+        for host in self.hosts:
+            host.stop()
+
+    def set_state(self, state):
+        for host in self.hosts:
+            for vm in host.emulator.vms.values():
+                vm["State"] = state
+
+    def counters(self):
+        totals = {}
+        for host in self.hosts:
+            for name, value in host.counters.items():
+                totals[name] = totals.get(name, 0) + value
+            for name in host.counters:
+                host.counters[name] = 0
+        return totals
+
+
+def reset_client():
+    """Drop pooled connections, sessions and cached inventory, like a new fab process."""
+    close_sessions()
+    pool.close_all()
+    inventory.clear()
+    network_index.clear()
+
+
+def run_scenario(name, hosts, vms_per_host, latency_scale=LATENCY_SCALE):
+    """
+    Run one task against a fresh fake lab.
+
+    Returns:
+        dict: The measurement with structure:
+        {"scenario": "stop_lab", "hosts": 1, "vms": 10, "wall_time": 0.41,
+         "connections": 1, "round_trips": 7, "spawns": 1}
+    """
+    with FakeLab(hosts, vms_per_host, latency_scale) as lab:
+        lab.set_state("Running" if name in NEEDS_RUNNING else "Off")
+        lab.counters()
+        root = logging.getLogger()
+        level = root.level
+        root.setLevel(logging.WARNING)
+        try:
+            started = time.monotonic()
+            with contextlib.redirect_stdout(io.StringIO()):
+                SCENARIOS[name](Context())
+            wall_time = time.monotonic() - started
+        finally:
+            root.setLevel(level)
+        reset_client()
+        counters = lab.counters()
+
+    return {
+        "scenario": name,
+        "hosts": hosts,
+        "vms": vms_per_host,
+        "wall_time": round(wall_time, 3),
+        "connections": counters["connections"],
+        "round_trips": counters["round_trips"],
+        "spawns": counters["spawns"],
+    }
+
+
+def run_grid(grid=FULL_GRID, scenarios=None):
+    """Run every scenario for every (hosts, VMs per host) combination."""
+    return [
+        run_scenario(name, hosts, vms)
+        for name in (scenarios or SCENARIOS)
+        for hosts, vms in grid
+    ]
+
+
+def measurement_key(measurement):
+    return f"{measurement['scenario']}/{measurement['hosts']}x{measurement['vms']}"
+
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(measurements, path=BASELINE_FILE):
+    baseline = load_baseline(path)
+    baseline.update({measurement_key(m): m for m in measurements})
+    with open(path, "w") as f:
+        json.dump(dict(sorted(baseline.items())), f, indent=2)
+        f.write("\n")
+
+
+def regressions(measurement, baseline):
+    """Return a description of every way a measurement is worse than its baseline entry."""
+    reference = baseline.get(measurement_key(measurement))
+    if reference is None:
+        return []
+    problems = []
+    for counter in ("connections", "spawns"):
+        if measurement[counter] > reference[counter]:
+            problems.append(f"{counter} {reference[counter]} -> {measurement[counter]}")
+    if measurement["round_trips"] > reference["round_trips"] * ROUND_TRIP_TOLERANCE + 2:
+        problems.append(f"round_trips {reference['round_trips']} -> {measurement['round_trips']}")
+    if measurement["wall_time"] > reference["wall_time"] * WALL_TIME_TOLERANCE + WALL_TIME_SLACK:
+        problems.append(f"wall_time {reference['wall_time']}s -> {measurement['wall_time']}s")
+    return problems
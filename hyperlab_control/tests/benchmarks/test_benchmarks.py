@@ -0,0 +1,16 @@
+import pytest
+
+from tests.benchmarks.harness import QUICK_GRID, SCENARIOS, load_baseline, regressions, run_scenario
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    return load_baseline()
+
+
+@pytest.mark.parametrize("hosts,vms", QUICK_GRID, ids=[f"{hosts}x{vms}" for hosts, vms in QUICK_GRID])
+@pytest.mark.parametrize("scenario", sorted(SCENARIOS))
+def test_no_regression(scenario, hosts, vms, baseline):
+    measurement = run_scenario(scenario, hosts, vms)
+    assert measurement["connections"] == hosts
+    assert not regressions(measurement, baseline)
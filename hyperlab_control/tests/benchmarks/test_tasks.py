@@ -0,0 +1,199 @@
+import logging
+import time
+
+from invoke import Context
+
+import fabfile
+from hyperlab_control.netindex import network_index
+from tests.benchmarks.harness import FakeLab, reset_client
+
+DAY = 86400
+
+
+def seed_checkpoints(emulator, vm_name, ages_days):
+    vm = emulator.vms[vm_name]
+    for index, age in enumerate(ages_days):
+        vm["Snapshots"].append({"Name": f"nightly-{age}", "CreationTime": time.time() - age * DAY,
+                                "Id": f"{vm_name}-seeded-{index}"})
+
+
+def test_prune_removes_planned_checkpoints(caplog):
+    with FakeLab(1, 3) as lab:
+        emulator = lab.hosts[0].emulator
+        seed_checkpoints(emulator, "hyperlab-worker-1", [1, 2, 3, 4, 5])
+        seed_checkpoints(emulator, "hyperlab-worker-2", [1, 2])
+        emulator.vms["hyperlab-worker-1"]["Snapshots"][4]["Name"] = "baseline-install"
+
+        with caplog.at_level(logging.INFO):
+            fabfile.prune_checkpoints(Context(), keep_last=2, max_age_days=0, apply=True)
+
+        remaining = {name: [snapshot["Name"] for snapshot in vm["Snapshots"]] for name, vm in emulator.vms.items()}
+
+    assert remaining == {
+        "hyperlab-control-1": [],
+        "hyperlab-worker-1": ["nightly-1", "nightly-2", "baseline-install"],
+        "hyperlab-worker-2": ["nightly-1", "nightly-2"],
+    }
+    assert "Pruned 2 checkpoints of hyperlab-worker-1" in caplog.text
+    assert "Reclaimed 4.00 GB" in caplog.text
+
+
+def test_prune_without_apply_only_plans():
+    with FakeLab(1, 2) as lab:
+        emulator = lab.hosts[0].emulator
+        seed_checkpoints(emulator, "hyperlab-worker-1", [1, 2, 3, 4])
+
+        fabfile.prune_checkpoints(Context(), keep_last=1, max_age_days=0)
+
+        assert len(emulator.vms["hyperlab-worker-1"]["Snapshots"]) == 4
+
+
+def test_reset_restores_then_starts_in_waves(caplog):
+    with FakeLab(1, 4) as lab:
+        emulator = lab.hosts[0].emulator
+        lab.set_state("Running")
+        for name, vm in emulator.vms.items():
+            if name != "hyperlab-worker-2":
+                vm["Snapshots"].append({"Name": f"Checkpoint-{name}", "CreationTime": time.time(), "Id": name})
+
+        with caplog.at_level(logging.INFO):
+            fabfile.reset_lab(Context(), wait=False)
+
+        states = {name: vm["State"] for name, vm in emulator.vms.items()}
+
+    applied = emulator.applied
+    commands = [cmdlet for cmdlet, _, _ in applied]
+    last_restore = max(index for index, cmdlet in enumerate(commands) if cmdlet == "Restore-VMSnapshot")
+    first_start = commands.index("Start-VM")
+    assert commands[:4] == ["Stop-VM"] * 4
+    assert last_restore < first_start
+    # The control plane wave starts before the workers
+    starts = [name for cmdlet, name, _ in applied if cmdlet == "Start-VM"]
+    assert starts[0] == "hyperlab-control-1"
+    assert sorted(starts[1:]) == ["hyperlab-worker-1", "hyperlab-worker-3"]
+    # The VM without the checkpoint fails its restore and is not started
+    assert ("Restore-VMSnapshot", "hyperlab-worker-2", False) in applied
+    assert states == {"hyperlab-control-1": "Running", "hyperlab-worker-1": "Running",
+                      "hyperlab-worker-2": "Off", "hyperlab-worker-3": "Running"}
+    assert "Failed to restore hyperlab-worker-2" in caplog.text
+
+
+def test_converged_ensure_costs_one_read_and_no_writes():
+    with FakeLab(1, 5) as lab:
+        emulator = lab.hosts[0].emulator
+        lab.counters()
+
+        fabfile.ensure(Context(), state="off")
+        reset_client()
+
+        # The session start and the single state query
+        assert lab.counters() == {"connections": 1, "round_trips": 2, "spawns": 1}
+        assert emulator.applied == []
+
+
+def test_ensure_discards_saved_state_before_configuring():
+    with FakeLab(1, 3) as lab:
+        emulator = lab.hosts[0].emulator
+        lab.set_state("Saved")
+
+        fabfile.ensure(Context(), state="off", pattern="hyperlab-worker*", memory_mb=4096)
+
+        assert [(cmdlet, name) for cmdlet, name, ok in emulator.applied if ok] == [
+            ("Remove-VMSavedState", "hyperlab-worker-1"), ("Remove-VMSavedState", "hyperlab-worker-2"),
+            ("Set-VMMemory", "hyperlab-worker-1"), ("Set-VMMemory", "hyperlab-worker-2")]
+        assert {name: (vm["State"], vm["MemoryStartup"] // 2 ** 20) for name, vm in emulator.vms.items()} == {
+            "hyperlab-control-1": ("Saved", 2048), "hyperlab-worker-1": ("Off", 4096),
+            "hyperlab-worker-2": ("Off", 4096)}
+
+
+def test_provisioned_workers_appear_on_host_and_in_network_index(caplog):
+    with FakeLab(2, 3) as lab:
+        # The first host's memory is nearly all committed
+        for vm in lab.hosts[0].emulator.vms.values():
+            vm["MemoryStartup"] = 40 * 2 ** 30
+        emulator = lab.hosts[1].emulator
+
+        with caplog.at_level(logging.INFO):
+            fabfile.provision_workers(Context(), count=2, start=True)
+
+        created = {name: emulator.vms[name] for name in ("hyperlab-worker-3", "hyperlab-worker-4")}
+        indexed = {entry["VMName"]: entry for entry in network_index.entries(lab.hosts[1].address)}
+        assert sorted(lab.hosts[0].emulator.vms) == ["hyperlab-control-1", "hyperlab-worker-1", "hyperlab-worker-2"]
+
+    assert all(vm["State"] == "Running" and vm["MemoryStartup"] == 4096 * 2 ** 20 and vm["Nested"]
+               for vm in created.values())
+    for name, vm in created.items():
+        assert vm["MacAddress"].startswith("00155D")
+        assert indexed[name]["MAC"] == vm["MacAddress"]
+        assert indexed[name]["IP"] == vm["IP"]
+    assert "Provisioned 2/2 workers, registered in the network index" in caplog.text
+
+
+def record_power_actions(emulator):
+    """Record each power action the emulator receives with the VM states at that moment."""
+    actions = []
+    power = emulator._power
+
+    def recording_power(script):
+        actions.append((script, {name: vm["State"] for name, vm in emulator.vms.items()}))
+        return power(script)
+
+    emulator._power = recording_power
+    return actions
+
+
+def test_shutdown_waits_for_every_vm_to_settle(caplog):
+    with FakeLab(2, 3) as lab:
+        lab.set_state("Running")
+        settled, unsettled = lab.hosts[0].emulator, lab.hosts[1].emulator
+        # Still starting, so it can neither be saved nor counts as safe
+        unsettled.vms["hyperlab-worker-2"]["State"] = "Starting"
+        actions = record_power_actions(settled)
+
+        with caplog.at_level(logging.INFO):
+            fabfile.shutdown_host(Context(), wait=False)
+
+        # One shutdown, sent once every VM had been saved
+        assert len(actions) == 1
+        script, states = actions[0]
+        assert script.startswith("shutdown.exe /s /f /t")
+        assert set(states.values()) == {"Saved"}
+        assert unsettled.power_actions == []
+        assert unsettled.vms["hyperlab-worker-1"]["State"] == "Saved"
+
+    assert "hyperlab-worker-2 (Starting)" in caplog.text
+    assert "left powered on" in caplog.text
+
+
+def test_shutdown_forced_past_unsettled_vms():
+    with FakeLab(1, 2) as lab:
+        emulator = lab.hosts[0].emulator
+        emulator.vms["hyperlab-worker-1"]["State"] = "Stopping"
+
+        fabfile.shutdown_host(Context(), force=True, wait=False)
+
+        assert len(emulator.power_actions) == 1
+
+
+def test_shutdown_skipped_when_vm_state_cannot_be_confirmed(caplog):
+    with FakeLab(1, 2) as lab:
+        emulator = lab.hosts[0].emulator
+        lab.set_state("Running")
+        desired_state = emulator._desired_state
+        reads = []
+
+        def failing_after_first_read(script):
+            reads.append(script)
+            if len(reads) > 1:
+                return "", ["Get-VM : You do not have the required permission to complete this task."]
+            return desired_state(script)
+
+        emulator._desired_state = failing_after_first_read
+
+        with caplog.at_level(logging.INFO):
+            fabfile.hibernate_host(Context(), wait=False)
+
+        assert {vm["State"] for vm in emulator.vms.values()} == {"Saved"}
+        assert emulator.power_actions == []
+
+    assert "Failed to read the VM state" in caplog.text
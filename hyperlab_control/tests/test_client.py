@@ -0,0 +1,56 @@
+import pytest
+
+from hyperlab_control import client
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record whether main() forwarded a command line or ran it in-process, with the daemon answering `exit`."""
+    calls = {"forwarded": [], "in_process": [], "exit": 0}
+
+    def forward(argv):
+        calls["forwarded"].append(argv)
+        return calls["exit"]
+
+    monkeypatch.setattr(client, "forward", forward)
+    monkeypatch.setattr(client, "run_in_process", calls["in_process"].append)
+    return calls
+
+
+def test_tasks_are_forwarded_to_a_running_daemon(calls):
+    calls["exit"] = 3
+
+    with pytest.raises(SystemExit) as exit_info:
+        client.main(["list-hyperlab-vms", "--fresh"])
+
+    assert exit_info.value.code == 3
+    assert calls["forwarded"] == [["list-hyperlab-vms", "--fresh"]]
+    assert calls["in_process"] == []
+
+
+def test_tasks_run_in_process_without_a_daemon(calls):
+    calls["exit"] = None
+
+    client.main(["list-hyperlab-vms"])
+
+    assert calls["forwarded"] == [["list-hyperlab-vms"]]
+    assert calls["in_process"] == [["list-hyperlab-vms"]]
+
+
+@pytest.mark.parametrize("argv", [["monitor"], ["setup-ssh"], ["--deadline=5", "daemon", "--port=7000"]])
+def test_local_tasks_never_reach_the_daemon(calls, argv):
+    client.main(argv)
+
+    assert calls["forwarded"] == []
+    assert calls["in_process"] == [argv]
+
+
+def test_list_is_read_from_the_fabfile(calls, tmp_path, monkeypatch, capsys):
+    (tmp_path / "fabfile.py").write_text(
+        "@task\ndef check_uptime(c):\n    \"\"\"Check system uptime.\"\"\"\n\n\ndef helper():\n    pass\n")
+    monkeypatch.chdir(tmp_path)
+
+    client.main(["--list"])
+
+    assert "check-uptime   Check system uptime." in capsys.readouterr().out
+    assert calls["forwarded"] == calls["in_process"] == []
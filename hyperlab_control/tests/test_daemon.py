@@ -0,0 +1,113 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from hyperlab_control import daemon
+from hyperlab_control.client import forward
+
+# A daemon serving two tasks, run in its own process since tasks capture the process-wide stdout
+SERVER = """
+import logging
+import sys
+
+from invoke import Collection, Exit, task
+
+from hyperlab_control.daemon import serve
+
+
+@task
+def greet(c, name="lab"):
+    print(f"hello {name}")
+    logging.warning("greeted")
+
+
+@task
+def fail(c):
+    raise Exit(code=3)
+
+
+logging.basicConfig(level=logging.INFO)
+serve(Collection(greet, fail), port=0, state_file=sys.argv[1])
+"""
+
+
+@pytest.fixture
+def daemon_state(tmp_path):
+    """Start a daemon on a free loopback port, yielding the path of its state file."""
+    state_file = tmp_path / "daemon.json"
+    src = os.path.dirname(os.path.dirname(daemon.__file__))
+    server = subprocess.Popen([sys.executable, "-c", SERVER, str(state_file)], env=dict(os.environ, PYTHONPATH=src),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while not state_file.exists() or not state_file.read_text():
+        assert server.poll() is None and time.monotonic() < deadline, "daemon did not start"
+        time.sleep(0.05)
+    yield str(state_file)
+    server.send_signal(signal.SIGINT)
+    server.wait(timeout=10)
+
+
+def request(state_file, token=None, argv=()):
+    """Send one raw request and return every message the daemon answers with."""
+    with open(state_file) as f:
+        state = json.load(f)
+    with socket.create_connection(("127.0.0.1", state["port"]), timeout=10) as sock:
+        message = {"token": state["token"] if token is None else token, "argv": list(argv)}
+        sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        return [json.loads(line) for line in sock.makefile("rb")]
+
+
+def test_state_file_is_private_and_names_a_loopback_port(daemon_state):
+    with open(daemon_state) as f:
+        state = json.load(f)
+
+    assert state["port"] > 0 and len(state["token"]) == 32
+    assert os.stat(daemon_state).st_mode & 0o077 == 0
+
+
+def test_bad_token_is_rejected(daemon_state):
+    assert request(daemon_state, token="0" * 32, argv=["greet"]) == []
+
+
+def test_task_output_and_exit_code_stream_back(daemon_state):
+    messages = request(daemon_state, argv=["greet", "--name", "atlas"])
+
+    assert {"out": "hello atlas"} in messages
+    assert any("[WARNING] - greeted" in message.get("err", "") for message in messages)
+    assert messages[-1] == {"exit": 0}
+
+
+def test_client_forwards_to_the_daemon(daemon_state, capsys):
+    assert forward(["greet", "--name", "zeus"], state_file=daemon_state) == 0
+    assert forward(["fail"], state_file=daemon_state) == 3
+
+    captured = capsys.readouterr()
+    assert captured.out == "hello zeus\n"
+    assert "greeted" in captured.err
+
+
+def test_client_reports_no_daemon(tmp_path, closed_port):
+    assert forward(["greet"], state_file=str(tmp_path / "missing.json")) is None
+
+    stale = tmp_path / "stale.json"
+    stale.write_text(json.dumps({"port": closed_port, "token": "0" * 32, "pid": 1}))
+    assert forward(["greet"], state_file=str(stale)) is None
+
+
+def test_state_file_is_removed_on_shutdown(tmp_path):
+    state_file = tmp_path / "daemon.json"
+    server = daemon.DaemonServer(None, port=0)
+    try:
+        server.write_state(str(state_file))
+        assert json.loads(state_file.read_text())["pid"] == os.getpid()
+    finally:
+        server.server_close()
+
+    server.remove_state(str(state_file))
+    assert not state_file.exists()
@@ -0,0 +1,61 @@
+from hyperlab_control.desired import desired_for, plan_ensure
+
+
+def vm(name="hyperlab-worker-1", state="Off", memory_mb=2048, nested=False):
+    return {"Name": name, "State": state, "MemoryStartupMB": memory_mb, "Nested": nested}
+
+
+def test_desired_for_merges_matching_specs():
+    specs = [{"pattern": "hyperlab*", "state": "running", "memory_mb": 2048},
+             {"pattern": "hyperlab-worker*", "memory_mb": 4096, "nested": None}]
+
+    assert desired_for("hyperlab-worker-1", specs) == {"state": "running", "memory_mb": 4096}
+    assert desired_for("hyperlab-control-1", specs) == {"state": "running", "memory_mb": 2048}
+    assert desired_for("other-vm", specs) is None
+
+
+def test_converged_vms_need_no_plan():
+    vms = [vm(state="Running", memory_mb=4096, nested=True), vm("hyperlab-worker-2", state="Saved")]
+    specs = [{"pattern": "hyperlab-worker-1", "state": "running", "memory_mb": 4096, "nested": True},
+             {"pattern": "hyperlab-worker-2", "state": "stopped"}]
+
+    assert plan_ensure(vms, specs) == []
+
+
+def test_state_only_changes():
+    [plan] = plan_ensure([vm(state="Paused")], [{"state": "running"}])
+
+    assert (plan["First"], plan["Configure"], plan["Then"]) == (None, [], "Resume-VM -Name $name")
+    assert plan["Changes"] == ["Paused -> running"]
+
+
+def test_running_vm_stopped_for_settings_and_restarted():
+    [plan] = plan_ensure([vm(state="Running")], [{"nested": True}])
+
+    assert plan["First"] == "Stop-VM -Name $name"
+    assert plan["Configure"] == ["Set-VMProcessor -VMName 'hyperlab-worker-1' -ExposeVirtualizationExtensions $true"]
+    assert plan["Then"] == "Start-VM -Name $name"
+
+
+def test_saved_vm_turned_off_discards_state_before_configuring():
+    [plan] = plan_ensure([vm(state="Saved")], [{"state": "off", "memory_mb": 4096}])
+
+    assert plan["First"] == "Remove-VMSavedState -VMName $name"
+    assert plan["Configure"] == ["Set-VMMemory -VMName 'hyperlab-worker-1' -StartupBytes 4096MB"]
+    assert plan["Then"] is None
+    assert plan["Changes"] == ["Saved -> off", "memory 2048 -> 4096 MB"]
+    assert plan["Note"] == ""
+
+
+def test_settings_deferred_when_state_must_be_kept():
+    [plan] = plan_ensure([vm(state="Saved")], [{"state": "saved", "memory_mb": 4096}])
+
+    assert (plan["First"], plan["Configure"], plan["Then"]) == (None, [], None)
+    assert plan["Note"] == "memory 2048 -> 4096 MB deferred: needs the VM off"
+
+
+def test_impossible_transition_noted():
+    [plan] = plan_ensure([vm(state="Off")], [{"state": "saved"}])
+
+    assert plan["Then"] is None
+    assert plan["Note"] == "cannot go from Off to saved"
@@ -0,0 +1,40 @@
+import logging
+import time
+
+from hyperlab_control.fanout import for_each_host
+
+HOSTS = ["atlas", "boreas", "castor", "deimos"]
+
+
+def test_output_replayed_in_host_order(caplog):
+    child = logging.getLogger("paramiko.transport")
+
+    def body(host):
+        # Later hosts finish first, and each host logs through the root and a child logger
+        time.sleep(0.05 * (len(HOSTS) - HOSTS.index(host)))
+        logging.info(f"{host} first")
+        child.info(f"{host} transport")
+        logging.info(f"{host} last")
+        return host.upper()
+
+    with caplog.at_level(logging.INFO):
+        results = for_each_host(body, HOSTS)
+
+    assert [result.value for result in results.values()] == [host.upper() for host in HOSTS]
+    assert [record.getMessage() for record in caplog.records] == [
+        f"{host} {suffix}" for host in HOSTS for suffix in ("first", "transport", "last")
+    ]
+
+
+def test_errors_reported_per_host(caplog):
+    def body(host):
+        if host == "boreas":
+            raise RuntimeError("unreachable")
+        return host
+
+    with caplog.at_level(logging.INFO):
+        results = for_each_host(body, HOSTS)
+
+    assert isinstance(results["boreas"].error, RuntimeError)
+    assert [host for host, result in results.items() if result.error is None] == ["atlas", "castor", "deimos"]
+    assert "Failed on 1/4 hosts: boreas" in caplog.text
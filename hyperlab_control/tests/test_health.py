@@ -0,0 +1,149 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from hyperlab_control import health
+from hyperlab_control.health import health_targets, metallb_addresses, primary_vms, sweep
+from hyperlab_control.timeouts import task_deadline
+
+MANIFEST = """\
+apiVersion: metallb.io/v1beta1
+kind: IPAddressPool
+metadata:
+  name: services
+spec:
+  addresses:
+  - 192.168.8.240-192.168.8.243
+  - 10.0.0.0/30
+  - 10.0.1.7/32
+---
+apiVersion: metallb.io/v1beta1
+kind: L2Advertisement
+spec:
+  ipAddressPools:
+  - services
+---
+apiVersion: metallb.io/v1beta1
+kind: IPAddressPool
+spec:
+  addresses:
+  - 172.16.0.0/25
+"""
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    path = tmp_path / "metallb-config.yaml"
+    path.write_text(MANIFEST)
+    return str(path)
+
+
+@pytest.fixture
+def silent_port():
+    """A local port that accepts connections but never sends anything."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def ssh_stub():
+    """A local listener greeting every connection with an SSH banner."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    def accept():
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+            client.sendall(b"SSH-2.0-OpenSSH_for_Windows_9.5\r\n")
+            client.close()
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+
+def test_metallb_ranges_and_cidrs(manifest):
+    addresses = metallb_addresses(manifest)
+
+    assert addresses[:7] == ["192.168.8.240", "192.168.8.241", "192.168.8.242", "192.168.8.243",
+                             # Network and broadcast addresses of a CIDR are left out
+                             "10.0.0.1", "10.0.0.2", "10.0.1.7"]
+    assert addresses[7:] == [f"172.16.0.{host}" for host in range(1, 127)]
+
+
+def test_metallb_addresses_limited(manifest):
+    assert metallb_addresses(manifest, limit=5) == ["192.168.8.240", "192.168.8.241", "192.168.8.242",
+                                                    "192.168.8.243", "10.0.0.1"]
+
+
+def test_metallb_unreadable_manifest(tmp_path):
+    assert metallb_addresses(str(tmp_path / "missing.yaml")) == []
+    (tmp_path / "broken.yaml").write_text("spec: [unclosed")
+    assert metallb_addresses(str(tmp_path / "broken.yaml")) == []
+
+
+def test_targets_follow_roles():
+    vms = [{"Host": "atlas", "VMName": "hyperlab-control-1", "IP": "10.0.0.10"},
+           {"Host": "atlas", "VMName": "hyperlab-worker-1", "IP": "Unknown"}]
+
+    targets = health_targets(vms, ["10.0.1.7"], pool_ports=[443])
+
+    assert [(t["Target"], t["Check"], t["Port"], t["Address"]) for t in targets] == [
+        ("hyperlab-control-1", "ssh", 22, "10.0.0.10"), ("hyperlab-control-1", "kube-apiserver", 6443, "10.0.0.10"),
+        ("hyperlab-control-1", "kubelet", 10250, "10.0.0.10"),
+        ("hyperlab-worker-1", "ssh", 22, None), ("hyperlab-worker-1", "kubelet", 10250, None),
+        ("metallb", "tcp", 443, "10.0.1.7")]
+
+
+def test_vms_with_several_adapters_are_probed_once():
+    vms = [{"Host": "atlas", "VMName": "hyperlab-worker-1", "IP": "Unknown"},
+           {"Host": "atlas", "VMName": "hyperlab-worker-1", "IP": "fe80::1"},
+           {"Host": "atlas", "VMName": "hyperlab-worker-1", "IP": "10.0.0.21"},
+           {"Host": "zeus", "VMName": "hyperlab-worker-1", "IP": "Unknown"}]
+
+    assert primary_vms(vms) == [{"Host": "atlas", "VMName": "hyperlab-worker-1", "IP": "10.0.0.21"},
+                                {"Host": "zeus", "VMName": "hyperlab-worker-1", "IP": "Unknown"}]
+    assert len(health_targets(primary_vms(vms))) == 4
+
+
+def probe(check, port, address="127.0.0.1"):
+    return {"Host": "atlas", "Target": "hyperlab-worker-1", "Address": address, "Check": check, "Port": port}
+
+
+def test_sweep_statuses(ssh_stub, tcp_stub, closed_port):
+    results = sweep([probe("ssh", ssh_stub), probe("ssh", tcp_stub), probe("tcp", closed_port),
+                     probe("tcp", tcp_stub), probe("ssh", 22, address=None)], timeout=2)
+
+    assert [result["Status"] for result in results] == ["up", "unhealthy", "refused", "up", "no-ip"]
+    assert results[0]["Detail"] == "SSH-2.0-OpenSSH_for_Windows_9.5"
+    assert results[0]["LatencyMs"] is not None and results[4]["LatencyMs"] is None
+
+
+def test_sweep_times_out_probes_concurrently(silent_port, ssh_stub):
+    start = time.monotonic()
+    results = sweep([probe("ssh", silent_port)] * 20 + [probe("ssh", ssh_stub)], timeout=0.5)
+    elapsed = time.monotonic() - start
+
+    # Every silent probe waits out the same 0.5s at once, and the healthy one is not held up
+    assert elapsed < 1.5
+    assert [result["Status"] for result in results] == ["timeout"] * 20 + ["up"]
+    assert all(result["LatencyMs"] is None for result in results[:20])
+
+
+def test_sweep_timeout_capped_by_deadline(silent_port, monkeypatch):
+    monkeypatch.setattr(health, "HEALTH_TIMEOUT", 30)
+    start = time.monotonic()
+    with task_deadline(0.3):
+        [result] = sweep([probe("ssh", silent_port)], timeout=30)
+
+    assert result["Status"] == "timeout"
+    assert time.monotonic() - start < 1
@@ -0,0 +1,135 @@
+import pytest
+
+from hyperlab_control.history import DAY, HOUR, MetricsHistory, decode_block, encode_block
+
+# Midnight UTC, so each test's samples start a new day
+T0 = 1_740_787_200
+
+
+def status(used_gb=400.0, demands=None, host="atlas"):
+    return {
+        "Host": host, "Disk": {"UsedGB": used_gb, "FreeGB": 900 - used_gb}, "UptimeSeconds": 3600,
+        "VMs": [{"Name": name, "CPUUsage": 5, "MemoryAssigned": 2 ** 31, "MemoryDemand": demand * 2 ** 20,
+                 "Checkpoints": []} for name, demand in (demands or {}).items()],
+    }
+
+
+@pytest.fixture
+def store():
+    history = MetricsHistory(":memory:", raw_days=2, retention_days=10, downsample_step=900)
+    yield history
+    history.close()
+
+
+def disk_used(store, since=T0 - DAY, until=T0 + 30 * DAY, step=0):
+    [series] = store.series("disk_used_gb", host="atlas")
+    return store.points(series, since, until, step)
+
+
+def test_block_round_trip():
+    times = [T0, T0 + 60, T0 + 120, T0 + 185, T0 + 185, T0 + 4000]
+    values = [0, 5, -3, 2 ** 40, -(2 ** 40), 7]
+
+    assert decode_block(T0, encode_block(times, values)) == (times, values)
+    # A steady interval and slow changes compress to well under a byte per sample
+    regular = [T0 + 60 * i for i in range(1440)]
+    assert len(encode_block(regular, [1000 + i // 100 for i in range(1440)])) < 200
+
+
+def test_compact_packs_samples_from_before_the_current_hour(store):
+    for minute in range(90):
+        store.record(status(used_gb=400 + minute / 100), t=T0 + 60 * minute)
+    before = disk_used(store)
+
+    counts = store.compact(now=T0 + 90 * 60)
+
+    assert counts == {"Packed": 60 * 3, "Downsampled": 0, "Expired": 0}
+    assert disk_used(store) == before
+    assert store.stats()["Recent"] == 30 * 3
+    # Nothing more to do within the same hour
+    assert store.compact(now=T0 + 100 * 60)["Packed"] == 0
+
+
+def test_late_samples_merge_into_their_days_block(store):
+    for minute in range(0, 60, 2):
+        store.record(status(used_gb=400), t=T0 + HOUR + 60 * minute)
+    store.compact(now=T0 + 3 * HOUR)
+    # Samples for the same day arrive after it was packed, some before its first sample
+    store.record(status(used_gb=401), t=T0 + 60)
+    store.record(status(used_gb=402), t=T0 + HOUR + 60)
+    store.compact(now=T0 + 4 * HOUR)
+
+    points = disk_used(store)
+    assert len(points) == 32
+    assert points[0] == (T0 + 60, 401.0)
+    assert (T0 + HOUR + 60, 402.0) in points
+    assert store.stats()["Blocks"] == 3
+
+
+def test_late_samples_keep_downsampled_blocks(store):
+    for minute in range(60):
+        store.record(status(used_gb=400 + minute // 15 + minute % 3 - 1), t=T0 + 60 * minute)
+    store.compact(now=T0 + 3 * DAY)
+    # 15-minute averages of one sample a minute
+    assert disk_used(store) == [(T0, 400.0), (T0 + 900, 401.0), (T0 + 1800, 402.0), (T0 + 2700, 403.0)]
+
+    # A sample for the downsampled day lands in a new bucket rather than replacing the block
+    store.record(status(used_gb=410), t=T0 + 7200)
+    store.compact(now=T0 + 3 * DAY + HOUR)
+
+    assert disk_used(store) == [(T0, 400.0), (T0 + 900, 401.0), (T0 + 1800, 402.0), (T0 + 2700, 403.0),
+                                (T0 + 7200, 410.0)]
+
+
+def test_downsampling_and_expiry_run_without_new_samples(store):
+    for minute in range(60):
+        store.record(status(used_gb=400), t=T0 + 60 * minute)
+    assert store.compact(now=T0 + 2 * HOUR)["Packed"] == 180
+
+    assert store.compact(now=T0 + 3 * DAY) == {"Packed": 0, "Downsampled": 3, "Expired": 0}
+    assert len(disk_used(store)) == 4
+    assert store.compact(now=T0 + 11 * DAY) == {"Packed": 0, "Downsampled": 0, "Expired": 3}
+    assert store.series("disk_used_gb") == []
+
+
+def test_series_filters(store):
+    store.record(status(demands={"hyperlab-worker-1": 1000, "hyperlab-control-1": 2000}), t=T0)
+    store.record(status(host="boreas", demands={"hyperlab-worker-1": 1000}), t=T0)
+
+    assert [(s["Host"], s["VMName"]) for s in store.series("mem_demand_mb")] == [
+        ("atlas", "hyperlab-control-1"), ("atlas", "hyperlab-worker-1"), ("boreas", "hyperlab-worker-1")]
+    assert [(s["Host"], s["VMName"]) for s in store.series("mem_demand_mb", host="boreas")] == [
+        ("boreas", "hyperlab-worker-1")]
+    assert [s["VMName"] for s in store.series("mem_demand_mb", vm="*control*")] == ["hyperlab-control-1"]
+    assert [s["VMName"] for s in store.series("disk_used_gb")] == ["", ""]
+    with pytest.raises(ValueError):
+        store.series("bogus")
+
+
+def test_points_range_and_step(store):
+    for minute in range(120):
+        store.record(status(used_gb=400 + minute), t=T0 + 60 * minute)
+    store.compact(now=T0 + HOUR)
+
+    # Half packed, half still recent
+    assert disk_used(store, since=T0 + 58 * 60, until=T0 + 61 * 60) == [
+        (T0 + 58 * 60, 458.0), (T0 + 59 * 60, 459.0), (T0 + 60 * 60, 460.0), (T0 + 61 * 60, 461.0)]
+    assert disk_used(store, step=HOUR) == [(T0, 429.5), (T0 + HOUR, 489.5)]
+
+
+def test_top_ranks_series(store):
+    for minute in range(120):
+        store.record(status(demands={"hyperlab-worker-1": 1000 + minute, "hyperlab-worker-2": 3000 - minute,
+                                     "hyperlab-control-1": 2000}), t=T0 + 60 * minute)
+    store.compact(now=T0 + HOUR)
+
+    growth = store.top("mem_demand_mb", T0, T0 + DAY)
+    assert [(entry["VMName"], entry["Value"]) for entry in growth] == [
+        ("hyperlab-worker-1", 119.0), ("hyperlab-control-1", 0.0), ("hyperlab-worker-2", -119.0)]
+    assert growth[0]["Samples"] == 120 and growth[0]["First"] == 1000.0 and growth[0]["Last"] == 1119.0
+
+    # A range cutting the packed block only counts the samples inside it
+    [entry] = store.top("mem_demand_mb", T0 + 30 * 60, T0 + 89 * 60, count=1, by="max")
+    assert (entry["VMName"], entry["Value"], entry["Samples"]) == ("hyperlab-worker-2", 2970.0, 60)
+    with pytest.raises(ValueError):
+        store.top("mem_demand_mb", T0, T0 + DAY, by="bogus")
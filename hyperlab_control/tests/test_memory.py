@@ -0,0 +1,63 @@
+from hyperlab_control.memory import HOST_RESERVE_MB, memory_targets, minimums_fit, plan_memory
+
+
+def vm(name="hyperlab-worker-1", demand=2000, pressure=50, minimum=1024, startup=2432, maximum=4096,
+       state="Running", dynamic=True):
+    return {"Name": name, "State": state, "DynamicMemoryEnabled": dynamic, "MinimumMB": minimum,
+            "StartupMB": startup, "MaximumMB": maximum, "DemandMB": demand, "AssignedMB": startup,
+            "Pressure": pressure}
+
+
+def test_targets_follow_demand():
+    # 2000 MB demand: startup +20% headroom, maximum at twice the demand, both rounded up to 128 MB
+    assert memory_targets(vm(demand=2000)) == {"MinimumMB": 1024, "StartupMB": 2432, "MaximumMB": 4096}
+    assert memory_targets(vm(demand=3000)) == {"MinimumMB": 1024, "StartupMB": 3712, "MaximumMB": 6016}
+
+
+def test_targets_clamped_to_role_bounds():
+    # An idle control plane still gets its role's floor
+    assert memory_targets(vm("hyperlab-control-1", demand=100)) == {
+        "MinimumMB": 2048, "StartupMB": 2048, "MaximumMB": 2048}
+    # A busy worker never goes past its role's ceiling
+    assert memory_targets(vm(demand=20000)) == {"MinimumMB": 1024, "StartupMB": 8192, "MaximumMB": 8192}
+    # Unknown roles use the "other" bounds
+    assert memory_targets(vm("scratch-vm", demand=100)) == {"MinimumMB": 512, "StartupMB": 512, "MaximumMB": 512}
+
+
+def test_pressure_keeps_current_maximum_within_bounds():
+    assert memory_targets(vm(demand=2000, pressure=150, maximum=6144))["MaximumMB"] == 6144
+    assert memory_targets(vm(demand=2000, pressure=150, maximum=16384))["MaximumMB"] == 8192
+    # Without pressure the maximum shrinks back to twice the demand
+    assert memory_targets(vm(demand=2000, pressure=80, maximum=6144))["MaximumMB"] == 4096
+
+
+def test_balanced_vm_is_a_no_op():
+    [plan] = plan_memory({"TotalMB": 65536, "VMs": [vm()]})
+
+    assert plan["Current"] == plan["Target"]
+    assert plan["Apply"] == {"MinimumMB": None, "StartupMB": None, "MaximumMB": None}
+    assert plan["Note"] == ""
+
+
+def test_running_vm_changes_limited_to_what_hyper_v_allows():
+    [plan] = plan_memory({"TotalMB": 65536, "VMs": [vm(demand=3000, minimum=2048, startup=2432, maximum=4096)]})
+
+    # Minimum may go down and maximum up while running; startup has to wait
+    assert plan["Apply"] == {"MinimumMB": 1024, "StartupMB": None, "MaximumMB": 6016}
+    assert plan["Note"] == "startup needs the VM off"
+
+
+def test_only_running_dynamic_vms_are_planned():
+    sample = {"TotalMB": 65536, "VMs": [vm("hyperlab-worker-1", state="Off"),
+                                        vm("hyperlab-worker-2", dynamic=False),
+                                        vm("hyperlab-worker-3")]}
+    assert [plan["Name"] for plan in plan_memory(sample)] == ["hyperlab-worker-3"]
+
+
+def test_minimums_fit_host_memory():
+    vms = [vm(f"hyperlab-worker-{index}", minimum=4096) for index in range(4)]
+    plans = plan_memory({"TotalMB": 0, "VMs": vms})
+
+    # Planned minimums of 1024 MB each fit where the current 4096 MB ones would not
+    assert minimums_fit({"TotalMB": HOST_RESERVE_MB + 4096, "VMs": vms}, plans)
+    assert not minimums_fit({"TotalMB": HOST_RESERVE_MB + 4096, "VMs": vms}, [])
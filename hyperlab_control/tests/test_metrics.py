@@ -0,0 +1,107 @@
+import json
+import threading
+
+import pytest
+
+import fabfile
+from hyperlab_control.fanout import for_each_host
+from hyperlab_control.metrics import PROMETHEUS_METRIC, Metrics, cmdlet_of, instrument_task, metrics
+
+
+@pytest.fixture
+def recorded():
+    metrics = Metrics(buckets=(0.1, 1))
+    with metrics.tagged(task="list_vms"):
+        metrics.observe("execute", 0.05, host="atlas", cmdlet="Get-VM")
+        metrics.observe("execute", 0.5, host="atlas", cmdlet="Get-VM")
+        metrics.observe("execute", 3.0, host="atlas", cmdlet="Get-VM")
+        metrics.observe("connect", 0.2, host='at"las')
+    return metrics
+
+
+def test_cmdlet_of():
+    assert cmdlet_of("$vms = @(Get-VM -Name 'hyperlab*')") == "Get-VM"
+    assert cmdlet_of("whoami") == "whoami"
+    assert cmdlet_of("") == ""
+
+
+def test_json_export(recorded):
+    entries = json.loads(recorded.to_json())
+
+    # Sorted by host, then phase in the order phases happen
+    assert [(entry["host"], entry["phase"]) for entry in entries] == [("at\"las", "connect"), ("atlas", "execute")]
+    execute = entries[1]
+    assert execute["task"] == "list_vms" and execute["cmdlet"] == "Get-VM"
+    assert (execute["count"], execute["sum"], execute["min"], execute["max"]) == (3, 3.55, 0.05, 3.0)
+    assert execute["buckets"] == {"0.1": 1, "1.0": 2, "+Inf": 3}
+
+
+def test_prometheus_export(recorded):
+    lines = recorded.to_prometheus().splitlines()
+
+    assert lines[:2] == [
+        f"# HELP {PROMETHEUS_METRIC} Duration of remote operations on Hyper-V hosts by phase.",
+        f"# TYPE {PROMETHEUS_METRIC} histogram",
+    ]
+    labels = 'phase="execute",host="atlas",task="list_vms",cmdlet="Get-VM"'
+    assert f'{PROMETHEUS_METRIC}_bucket{{{labels},le="0.1"}} 1' in lines
+    assert f'{PROMETHEUS_METRIC}_bucket{{{labels},le="1.0"}} 2' in lines
+    assert f'{PROMETHEUS_METRIC}_bucket{{{labels},le="+Inf"}} 3' in lines
+    assert f"{PROMETHEUS_METRIC}_sum{{{labels}}} 3.55" in lines
+    assert f"{PROMETHEUS_METRIC}_count{{{labels}}} 3" in lines
+    # Label values are escaped
+    assert any('host="at\\"las"' in line for line in lines)
+
+
+def test_dump_targets(recorded, tmp_path, capsys):
+    recorded.dump("json")
+    assert json.loads(capsys.readouterr().out) == recorded.snapshot()
+
+    recorded.dump(str(tmp_path / "metrics.prom"))
+    recorded.dump(str(tmp_path / "metrics.json"))
+    assert (tmp_path / "metrics.prom").read_text() == recorded.to_prometheus()
+    assert json.loads((tmp_path / "metrics.json").read_text()) == recorded.snapshot()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["metrics.json", "metrics.prom"]
+
+
+def test_task_options_have_no_short_flags():
+    arguments = {argument.name: argument for argument in fabfile.ensure.get_arguments()}
+
+    assert arguments["metrics"].names == ("metrics",)
+    assert arguments["deadline"].names == ("deadline",)
+    # The task's own parameters keep theirs
+    assert "m" in arguments["memory_mb"].names and "d" in arguments["dry_run"].names
+
+
+def test_task_label_scoped_to_its_invocation():
+    recorded = Metrics()
+    other_started, tagged_done = threading.Event(), threading.Event()
+
+    def other_task():
+        other_started.set()
+        tagged_done.wait(2)
+        recorded.observe("execute", 0.2, host="boreas")
+
+    other = threading.Thread(target=other_task)
+    other.start()
+    other_started.wait(2)
+    with recorded.tagged(task="list_vms"):
+        for_each_host(lambda host: recorded.observe("execute", 0.1, host=host), ["atlas"])
+        tagged_done.set()
+        other.join()
+
+    assert {(entry["host"], entry["task"]) for entry in recorded.snapshot()} == {("atlas", "list_vms"), ("boreas", "")}
+
+
+def test_dump_holds_only_this_invocations_samples(tmp_path):
+    def list_vms(c, hosts):
+        for_each_host(lambda host: metrics.observe("execute", 0.1, host=host, cmdlet="Get-VM"), hosts)
+
+    task = instrument_task(list_vms)
+    task(None, ["atlas", "boreas"])
+    task(None, ["atlas"], metrics=str(tmp_path / "metrics.json"))
+
+    entries = json.loads((tmp_path / "metrics.json").read_text())
+    assert [(entry["host"], entry["task"], entry["count"]) for entry in entries] == [("atlas", "list_vms", 1)]
+    # The process-wide histograms keep everything
+    assert any(entry["host"] == "boreas" for entry in metrics.snapshot())
@@ -0,0 +1,125 @@
+import json
+import socket
+import threading
+
+import pytest
+
+from hyperlab_control import monitor
+from hyperlab_control.monitor import HostMonitor
+from hyperlab_control.powershell import FRAME_PREFIX
+
+
+class StubChannel:
+    """Stands in for the sampler's SSH channel, returning prepared chunks from recv()."""
+
+    def __init__(self, chunks, stderr=b""):
+        self.chunks = list(chunks)
+        self.stderr = stderr
+        self.timeouts = []
+
+    def settimeout(self, seconds):
+        self.timeouts.append(seconds)
+
+    def recv(self, size):
+        if not self.chunks:
+            return b""
+        chunk = self.chunks.pop(0)
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    def recv_stderr(self, size):
+        return self.stderr
+
+
+def frame(record):
+    return FRAME_PREFIX + json.dumps(record).encode() + b"\r\n"
+
+
+def test_deltas_merge_into_vms():
+    records = []
+    host_monitor = HostMonitor("atlas", None, on_record=lambda host, record: records.append((host, record)))
+
+    host_monitor.apply({"t": 1.0, "d": {"hyperlab-1": {"st": "Running", "cpu": 5, "mem": 2048},
+                                        "hyperlab-2": {"st": "Off", "cpu": 0}}, "x": []})
+    host_monitor.apply({"t": 2.0, "d": {"hyperlab-1": {"cpu": 40}}, "x": []})
+
+    assert host_monitor.snapshot() == {"hyperlab-1": {"st": "Running", "cpu": 40, "mem": 2048},
+                                       "hyperlab-2": {"st": "Off", "cpu": 0}}
+    assert host_monitor.updated == 2.0
+    assert [record["t"] for _, record in records] == [1.0, 2.0]
+
+
+def test_removed_vms_are_dropped():
+    host_monitor = HostMonitor("atlas", None)
+    host_monitor.apply({"t": 1.0, "d": {"hyperlab-1": {"cpu": 5}, "hyperlab-2": {"cpu": 6}}, "x": []})
+
+    host_monitor.apply({"t": 2.0, "d": {}, "x": ["hyperlab-2", "never-seen"]})
+
+    assert host_monitor.snapshot() == {"hyperlab-1": {"cpu": 5}}
+
+
+def test_heartbeats_keep_the_monitor_alive_without_records():
+    records = []
+    host_monitor = HostMonitor("atlas", None, on_record=lambda host, record: records.append(record))
+    host_monitor.apply({"t": 1.0, "d": {"hyperlab-1": {"cpu": 5}}, "x": []})
+
+    host_monitor.apply({"t": 6.0, "d": {}, "x": []})
+
+    assert host_monitor.updated == 6.0
+    assert len(records) == 1
+
+
+def test_snapshot_is_a_copy():
+    host_monitor = HostMonitor("atlas", None)
+    host_monitor.apply({"t": 1.0, "d": {"hyperlab-1": {"cpu": 5}}})
+
+    snapshot = host_monitor.snapshot()
+    host_monitor.apply({"t": 2.0, "d": {"hyperlab-1": {"cpu": 9}, "hyperlab-2": {"cpu": 1}}})
+
+    assert snapshot == {"hyperlab-1": {"cpu": 5}}
+
+
+def test_snapshot_while_samples_arrive():
+    host_monitor = HostMonitor("atlas", None)
+    done = threading.Event()
+
+    def sample():
+        for index in range(20000):
+            host_monitor.apply({"t": index, "d": {f"vm-{index % 500}": {"cpu": index}}, "x": [f"vm-{(index + 250) % 500}"]})
+        done.set()
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    while not done.is_set():
+        sorted(host_monitor.snapshot().items())
+    sampler.join()
+
+
+def test_read_reassembles_frames_split_across_chunks():
+    host_monitor = HostMonitor("atlas", None)
+    data = frame({"t": 1.0, "d": {"hyperlab-1": {"cpu": 5}}, "x": []}) + b"noise\r\n" \
+        + frame({"t": 2.0, "d": {}, "x": []})
+    host_monitor._channel = StubChannel([data[:7], data[7:40], data[40:]])
+
+    with pytest.raises(RuntimeError, match="Sampler exited"):
+        host_monitor._read()
+
+    assert host_monitor.snapshot() == {"hyperlab-1": {"cpu": 5}}
+    assert host_monitor.updated == 2.0
+    # The silence allowed is well past the heartbeat interval
+    assert host_monitor._channel.timeouts[0] > monitor.MONITOR_HEARTBEAT * host_monitor.interval
+
+
+def test_read_fails_when_even_heartbeats_stop():
+    host_monitor = HostMonitor("atlas", None)
+    host_monitor._channel = StubChannel([frame({"t": 1.0, "d": {}, "x": []}), socket.timeout()])
+
+    with pytest.raises(RuntimeError, match="No sample received"):
+        host_monitor._read()
+
+
+def test_sampler_script_sends_heartbeats():
+    script = monitor.SAMPLER_SCRIPT.format(interval=1, pattern="'*'", heartbeat=monitor.MONITOR_HEARTBEAT)
+
+    assert f"$script:quiet -ge {monitor.MONITOR_HEARTBEAT}" in script
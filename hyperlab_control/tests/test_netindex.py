@@ -0,0 +1,146 @@
+import pytest
+
+from hyperlab_control import netindex
+from hyperlab_control.netindex import FINGERPRINT_SCRIPT, NetworkIndex, normalize_mac
+
+
+class StubHost:
+    """A Hyper-V host answering the index's scripts from a dict of VMs, counting the adapters it reports."""
+
+    def __init__(self, host="atlas"):
+        self.host = host
+        self.vms = {}
+        self.requeried = []
+
+    def add(self, name, state="Running", adapters=()):
+        self.vms[name] = {"State": state, "Adapters": [
+            {"MacAddress": mac, "SwitchName": "Default Switch", "IPAddresses": list(ips)} for mac, ips in adapters]}
+
+    def inventory(self):
+        return [{"Name": name, "State": vm["State"], "Adapters": vm["Adapters"]} for name, vm in self.vms.items()]
+
+    def run_json_script(self, conn, script, timeout=None, retry_failures=False):
+        if script == FINGERPRINT_SCRIPT:
+            return [{"Name": name, "State": vm["State"], "Macs": [a["MacAddress"] for a in vm["Adapters"]]}
+                    for name, vm in self.vms.items()]
+        names = [name for name in self.vms if f"'{name}'" in script]
+        self.requeried.extend(names)
+        return [dict(adapter, VMName=name) for name in names for adapter in self.vms[name]["Adapters"]]
+
+
+class StubInventory:
+    def __init__(self, host):
+        self.host = host
+        self.calls = 0
+
+    def vms(self, conn, fresh=False, need_state=False):
+        self.calls += 1
+        return self.host.inventory()
+
+
+@pytest.fixture
+def host(monkeypatch):
+    stub = StubHost()
+    stub.add("hyperlab-control-1", adapters=[("00155D000001", ["10.0.0.10", "fe80::1"])])
+    stub.add("hyperlab-worker-1", adapters=[("00155D000002", ["10.0.0.21"]), ("00155D000003", [])])
+    stub.add("hyperlab-worker-2", state="Off", adapters=[("00155D000004", [])])
+    monkeypatch.setattr(netindex, "run_json_script", stub.run_json_script)
+    monkeypatch.setattr(netindex, "inventory", StubInventory(stub))
+    return stub
+
+
+@pytest.fixture
+def index():
+    network_index = NetworkIndex(":memory:", ttl=600)
+    yield network_index
+    network_index.close()
+
+
+def test_first_refresh_reads_the_inventory(host, index):
+    assert index.refresh(host) == {"VMs": 3, "Requeried": 3, "Removed": 0}
+
+    assert netindex.inventory.calls == 1
+    assert host.requeried == []
+    assert index.vm_ips("atlas") == {"hyperlab-control-1": "10.0.0.10", "hyperlab-worker-1": "10.0.0.21"}
+
+
+def test_refresh_requeries_only_changed_vms_and_running_ones_without_ip(host, index):
+    index.refresh(host)
+    # worker-1 still has an adapter without IP, so it is re-queried until the guest reports one
+    host.add("hyperlab-worker-1", adapters=[("00155D000002", ["10.0.0.21"]), ("00155D000003", ["10.0.1.21"])])
+    host.add("hyperlab-worker-2", state="Running", adapters=[("00155D000004", [])])
+
+    assert index.refresh(host) == {"VMs": 3, "Requeried": 2, "Removed": 0}
+    assert sorted(host.requeried) == ["hyperlab-worker-1", "hyperlab-worker-2"]
+    assert netindex.inventory.calls == 1
+
+    # Both have settled: worker-1 has all its IPs and worker-2 is unchanged, though still without one
+    host.requeried.clear()
+    host.add("hyperlab-worker-2", state="Running", adapters=[("00155D000004", ["10.0.0.22"])])
+    assert index.refresh(host)["Requeried"] == 1
+    assert host.requeried == ["hyperlab-worker-2"]
+
+    host.requeried.clear()
+    assert index.refresh(host)["Requeried"] == 0
+    assert host.requeried == []
+    assert index.vm_ips("atlas")["hyperlab-worker-2"] == "10.0.0.22"
+
+
+def test_expired_or_full_refresh_reads_the_inventory_again(host, index):
+    index.refresh(host)
+    index.refresh(host, full=True)
+    assert netindex.inventory.calls == 2
+
+    index.ttl = -1
+    index.refresh(host)
+    assert netindex.inventory.calls == 3
+    assert host.requeried == []
+
+
+def test_vms_that_are_gone_are_removed(host, index):
+    index.refresh(host)
+    del host.vms["hyperlab-worker-1"]
+
+    assert index.refresh(host) == {"VMs": 2, "Requeried": 0, "Removed": 1}
+    assert index.lookup("hyperlab-worker-1") == []
+    assert index.lookup("10.0.0.21") == []
+    assert [entry["VMName"] for entry in index.entries("atlas")] == ["hyperlab-control-1", "hyperlab-worker-2"]
+
+
+def test_failed_refresh_keeps_the_index(host, index, monkeypatch):
+    index.refresh(host)
+    monkeypatch.setattr(netindex, "run_json_script", lambda *args, **kwargs: None)
+
+    assert index.refresh(host) is None
+    assert len(index.entries("atlas")) == 4
+
+
+@pytest.mark.parametrize("key", ["hyperlab-worker-1", "HYPERLAB-WORKER-1"])
+def test_lookup_by_name(host, index, key):
+    index.refresh(host)
+
+    entries = index.lookup(key)
+
+    assert [entry["MAC"] for entry in entries] == ["00155D000002", "00155D000003"]
+    assert entries[0] == {"Host": "atlas", "VMName": "hyperlab-worker-1", "State": "Running", "MAC": "00155D000002",
+                          "IP": "10.0.0.21", "IPAddresses": ["10.0.0.21"], "SwitchName": "Default Switch"}
+
+
+@pytest.mark.parametrize("key", ["00155D000001", "00:15:5d:00:00:01", "00-15-5D-00-00-01", "0015.5d00.0001"])
+def test_lookup_by_mac_in_any_notation(host, index, key):
+    index.refresh(host)
+
+    assert [entry["VMName"] for entry in index.lookup(key)] == ["hyperlab-control-1"]
+
+
+def test_lookup_by_ip(host, index):
+    index.refresh(host)
+
+    assert [entry["VMName"] for entry in index.lookup("10.0.0.10")] == ["hyperlab-control-1"]
+    # Secondary addresses resolve too, to the adapter that has them
+    assert [entry["MAC"] for entry in index.lookup("fe80::1")] == ["00155D000001"]
+    assert index.lookup("10.9.9.9") == []
+
+
+def test_normalize_mac():
+    assert normalize_mac("00:15:5d:0a:0b:0c") == normalize_mac("00-15-5D-0A-0B-0C") == "00155D0A0B0C"
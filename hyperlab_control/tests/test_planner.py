@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from hyperlab_control import planner
+from hyperlab_control.planner import plan_waves, role_of, wait_until_ready
+
+LAB = [
+    ("atlas", "hyperlab-worker-2"),
+    ("boreas", "hyperlab-control-1"),
+    ("atlas", "hyperlab-worker-1"),
+    ("atlas", "hyperlab-storage-1"),
+    ("boreas", "scratch-vm"),
+]
+
+
+def test_roles_by_name():
+    assert role_of("HyperLab-Control-1") == "control-plane"
+    assert role_of("hyperlab-worker-7") == "worker"
+    assert role_of("scratch-vm") == planner.DEFAULT_ROLE
+
+
+def test_waves_follow_dependencies():
+    assert plan_waves(LAB) == [
+        [("atlas", "hyperlab-storage-1"), ("boreas", "hyperlab-control-1"), ("boreas", "scratch-vm")],
+        [("atlas", "hyperlab-worker-1"), ("atlas", "hyperlab-worker-2")],
+    ]
+
+
+def test_deeper_dependencies_add_waves(monkeypatch):
+    monkeypatch.setitem(planner.ROLE_DEPENDENCIES, "storage", ["control-plane"])
+    assert [[vm for _, vm in wave] for wave in plan_waves(LAB)] == [
+        ["hyperlab-control-1", "scratch-vm"],
+        ["hyperlab-storage-1"],
+        ["hyperlab-worker-1", "hyperlab-worker-2"],
+    ]
+
+
+def test_circular_dependencies_are_rejected(monkeypatch):
+    monkeypatch.setitem(planner.ROLE_DEPENDENCIES, "control-plane", ["worker"])
+    with pytest.raises(ValueError, match="Circular role dependency"):
+        plan_waves(LAB)
+
+
+def test_unknown_dependencies_are_rejected(monkeypatch):
+    monkeypatch.setitem(planner.ROLE_DEPENDENCIES, "worker", ["control-plane", "database"])
+    with pytest.raises(ValueError, match="unknown role.*database"):
+        plan_waves(LAB)
+
+
+def test_wait_until_ready(monkeypatch, tcp_stub, closed_port):
+    monkeypatch.setitem(planner.ROLE_READINESS_PORTS, "control-plane", tcp_stub)
+    monkeypatch.setitem(planner.ROLE_READINESS_PORTS, "worker", closed_port)
+    lookups = []
+
+    def lookup_ips(host):
+        lookups.append(host)
+        # The worker only reports its address from the second round on
+        ips = {"hyperlab-control-1": "127.0.0.1"}
+        if len(lookups) > 1:
+            ips["hyperlab-worker-1"] = "127.0.0.1"
+        return ips
+
+    vms = [("atlas", "hyperlab-control-1"), ("atlas", "hyperlab-worker-1"), ("atlas", "scratch-vm")]
+    start = time.monotonic()
+    ready = wait_until_ready(vms, lookup_ips, timeout=0.5, poll_interval=0.1)
+    elapsed = time.monotonic() - start
+
+    assert ready[("atlas", "hyperlab-control-1")] is not None
+    assert ready[("atlas", "hyperlab-worker-1")] is None
+    # Roles without a readiness port count as ready at once
+    assert ready[("atlas", "scratch-vm")] == 0.0
+    assert 0.5 <= elapsed < 1.5
+    assert len(lookups) >= 2
@@ -0,0 +1,147 @@
+import base64
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from hyperlab_control import powershell
+from hyperlab_control.metrics import metrics
+from hyperlab_control.powershell import (
+    FRAME_PREFIX, PowerShellError, PowerShellSession, ScriptError, run_json_lines, stream_json, stream_script,
+)
+
+CONN = SimpleNamespace(host="atlas", user="lab")
+
+
+def frame(message):
+    return FRAME_PREFIX + json.dumps(message).encode() + b"\r\n"
+
+
+class StubWorker:
+    """Stands in for a session's SSH channel, answering requests like the worker script in small recv() chunks."""
+
+    def __init__(self, outputs, chunk_size=7):
+        self.outputs = outputs
+        self.chunk_size = chunk_size
+        self.pending = b""
+        self.closed = False
+
+    def exit_status_ready(self):
+        return False
+
+    def settimeout(self, seconds):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def sendall(self, data):
+        request = json.loads(data)
+        lines = self.outputs[base64.b64decode(request["script"]).decode()]
+        if request.get("stream"):
+            self.pending += b"".join(frame({"id": request["id"], "line": line}) for line in lines)
+            self.pending += frame({"id": request["id"], "ok": True, "stderr": ""})
+        else:
+            self.pending += frame({"id": request["id"], "ok": True, "stdout": "\n".join(lines), "stderr": ""})
+
+    def recv(self, size):
+        chunk, self.pending = self.pending[:self.chunk_size], self.pending[self.chunk_size:]
+        return chunk
+
+
+RECORDS = [{"Name": "hyperlab-control-1", "State": "Running"}, {"Name": "hyperlab-worker-1", "State": "Off"}]
+SCRIPT = "Get-VM | ForEach-Object { ConvertTo-Json -InputObject $_ -Compress }"
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    """A stub worker behind the session every helper gets for CONN."""
+    stub = StubWorker({SCRIPT: [json.dumps(record) for record in RECORDS] + [""], "hostname": ["atlas"]})
+    session = PowerShellSession(CONN)
+    session.channel = stub
+    monkeypatch.setattr(powershell, "USE_SESSIONS", True)
+    monkeypatch.setattr(powershell, "get_session", lambda conn: session)
+    return stub
+
+
+def test_records_split_across_chunks_are_reassembled(worker):
+    seen = []
+
+    assert run_json_lines(CONN, SCRIPT, on_record=seen.append) == RECORDS
+    assert seen == RECORDS
+    assert list(stream_json(CONN, SCRIPT)) == RECORDS
+    assert not worker.closed
+
+
+def test_partial_final_frame_is_an_error(worker):
+    worker.pending = frame({"id": 1, "line": json.dumps(RECORDS[0])}) + frame({"id": 1, "line": "{}"})[:-9]
+    worker.sendall = lambda data: None
+    lines = stream_script(CONN, SCRIPT)
+
+    assert next(lines) == json.dumps(RECORDS[0])
+    with pytest.raises(PowerShellError, match="exited unexpectedly"):
+        next(lines)
+    assert worker.closed
+
+
+def test_partial_final_json_line_is_an_error(worker):
+    worker.outputs[SCRIPT] = [json.dumps(RECORDS[0]), json.dumps(RECORDS[1])[:-3]]
+    records = stream_json(CONN, SCRIPT)
+
+    assert next(records) == RECORDS[0]
+    with pytest.raises(ScriptError, match="Invalid JSON line"):
+        next(records)
+    assert run_json_lines(CONN, SCRIPT) is None
+
+
+def test_requests_run_while_a_stream_is_being_consumed(worker):
+    lines = stream_script(CONN, SCRIPT)
+    assert json.loads(next(lines)) == RECORDS[0]
+
+    # Another thread's command is not held up by the consumer, and the stream's rest is kept for it
+    result = []
+    runner = threading.Thread(target=lambda: result.append(powershell.run_script(CONN, "hostname")))
+    runner.start()
+    runner.join(timeout=5)
+
+    assert result == ["atlas"]
+    assert [json.loads(line) for line in lines if line] == RECORDS[1:]
+    assert not worker.closed
+
+
+def test_abandoned_stream_kills_the_worker(worker):
+    lines = stream_script(CONN, SCRIPT)
+    next(lines)
+
+    lines.close()
+
+    assert worker.closed
+
+
+def test_execute_timing_leaves_out_the_consumer(worker):
+    with metrics.recording() as recorded:
+        for _ in stream_json(CONN, SCRIPT):
+            time.sleep(0.2)
+
+    [execute] = [entry for entry in recorded.snapshot() if entry["phase"] == "execute"]
+    assert execute["count"] == 1
+    assert execute["sum"] < 0.2
+
+
+def test_lines_stream_without_sessions(monkeypatch):
+    class Stdout(list):
+        channel = SimpleNamespace(recv_exit_status=lambda: 1, close=lambda: None)
+
+    # The last line has no newline, as when a script's output does not end with one
+    stdout = Stdout(["first\r\n", "second\n", "last"])
+    stderr = SimpleNamespace(read=lambda: b"Get-VM : access denied")
+    conn = SimpleNamespace(host="atlas", user="lab",
+                           client=SimpleNamespace(exec_command=lambda command, timeout: (None, stdout, stderr)))
+    monkeypatch.setattr(powershell, "USE_SESSIONS", False)
+    lines = stream_script(conn, "Get-VM")
+
+    assert [next(lines) for _ in range(3)] == ["first", "second", "last"]
+    with pytest.raises(ScriptError, match="access denied"):
+        next(lines)
@@ -0,0 +1,60 @@
+import re
+
+from hyperlab_control.memory import HOST_RESERVE_MB
+from hyperlab_control.provision import MAC_PREFIX, create_script, new_macs, next_worker_names, plan_placement
+
+
+def capacity(committed_mb, total_mb=65536, golden=True):
+    return {"VMs": [], "Macs": [], "Golden": golden, "TotalMB": total_mb, "CommittedMB": committed_mb,
+            "FreeDiskGB": 500.0}
+
+
+def test_next_worker_names_fill_gaps():
+    existing = ["hyperlab-control-1", "hyperlab-worker-1", "Hyperlab-Worker-3", "hyperlab-worker-5", "other-vm"]
+
+    assert next_worker_names(existing, 4) == ["hyperlab-worker-2", "hyperlab-worker-4", "hyperlab-worker-6",
+                                              "hyperlab-worker-7"]
+    assert next_worker_names([], 2) == ["hyperlab-worker-1", "hyperlab-worker-2"]
+    assert next_worker_names(existing, 0) == []
+
+
+def test_new_macs_are_unique_and_under_the_hyper_v_prefix():
+    taken = [f"00-15-5D-00-00-{index:02X}" for index in range(200)]
+
+    macs = new_macs(500, taken)
+
+    assert len(set(macs)) == 500
+    assert all(re.fullmatch(rf"{MAC_PREFIX}[0-9A-F]{{6}}", mac) for mac in macs)
+    assert not set(macs) & {mac.replace("-", "") for mac in taken}
+
+
+def test_placement_prefers_uncommitted_memory():
+    capacities = {"atlas": capacity(committed_mb=40960), "boreas": capacity(committed_mb=8192)}
+    names = [f"hyperlab-worker-{index}" for index in range(1, 6)]
+
+    placement, unplaced = plan_placement(capacities, names, 8192)
+
+    # boreas starts 32 GB freer, so it takes workers until both are level
+    assert placement == {"boreas": names[:4] + names[5:], "atlas": names[4:5]}
+    assert unplaced == []
+
+
+def test_placement_leaves_out_what_does_not_fit():
+    free_mb = 65536 - HOST_RESERVE_MB - 49152
+    capacities = {"atlas": capacity(committed_mb=49152), "boreas": capacity(committed_mb=0, golden=False),
+                  "castor": None}
+
+    placement, unplaced = plan_placement(capacities, ["hyperlab-worker-1", "hyperlab-worker-2"], free_mb)
+
+    assert placement == {"atlas": ["hyperlab-worker-1"]}
+    assert unplaced == ["hyperlab-worker-2"]
+
+
+def test_create_script_follows_nested():
+    nested = create_script({"hyperlab-worker-1": "00155D000001"}, nested=True)
+    plain = create_script({"hyperlab-worker-1": "00155D000001"}, nested=False)
+
+    assert "@{ 'hyperlab-worker-1' = '00155D000001' }[$name]" in nested
+    assert "-ExposeVirtualizationExtensions $true" in nested and "-DynamicMemoryEnabled $false" in nested
+    assert "-MacAddressSpoofing On" in nested
+    assert "-ExposeVirtualizationExtensions $false" in plain and "-DynamicMemoryEnabled $true" in plain
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from hyperlab_control.retention import plan_retention, prune_job_script
+
+NOW = datetime(2025, 3, 1, 12).timestamp()
+
+
+def checkpoint(vm_name, name, age_days):
+    created = datetime.fromtimestamp(NOW - age_days * 86400).isoformat()
+    return {"VMName": vm_name, "Name": name, "Id": f"{vm_name}/{name}", "CreationTime": created}
+
+
+CHECKPOINTS = [
+    checkpoint("hyperlab-worker-1", "nightly-1", 1),
+    checkpoint("hyperlab-worker-1", "nightly-5", 5),
+    checkpoint("hyperlab-worker-1", "Baseline-install", 90),
+    checkpoint("hyperlab-worker-1", "nightly-3", 3),
+    checkpoint("hyperlab-worker-1", "nightly-2", 2),
+    checkpoint("hyperlab-worker-1", "nightly-9", 9),
+    checkpoint("hyperlab-control-1", "nightly-1", 1),
+]
+
+
+def actions(plan):
+    return {(entry["VMName"], entry["Name"]): (entry["Action"], entry["Reason"]) for entry in plan}
+
+
+def test_keep_last_per_vm():
+    plan = plan_retention(CHECKPOINTS, keep_last=2, max_age_days=0, now=NOW)
+
+    # Newest first within each VM, VMs in name order
+    assert [(entry["VMName"], entry["Name"]) for entry in plan][:3] == [
+        ("hyperlab-control-1", "nightly-1"), ("hyperlab-worker-1", "nightly-1"), ("hyperlab-worker-1", "nightly-2")]
+    assert actions(plan) == {
+        ("hyperlab-control-1", "nightly-1"): ("keep", "newest 2"),
+        ("hyperlab-worker-1", "nightly-1"): ("keep", "newest 2"),
+        ("hyperlab-worker-1", "nightly-2"): ("keep", "newest 2"),
+        ("hyperlab-worker-1", "nightly-3"): ("prune", ""),
+        ("hyperlab-worker-1", "nightly-5"): ("prune", ""),
+        ("hyperlab-worker-1", "nightly-9"): ("prune", ""),
+        ("hyperlab-worker-1", "Baseline-install"): ("keep", "baseline"),
+    }
+
+
+def test_max_age_keeps_recent_checkpoints():
+    plan = actions(plan_retention(CHECKPOINTS, keep_last=1, max_age_days=4, now=NOW))
+
+    assert plan[("hyperlab-worker-1", "nightly-1")] == ("keep", "newest 1")
+    assert plan[("hyperlab-worker-1", "nightly-2")] == ("keep", "younger than 4d")
+    assert plan[("hyperlab-worker-1", "nightly-3")] == ("keep", "younger than 4d")
+    assert plan[("hyperlab-worker-1", "nightly-5")] == ("prune", "")
+
+
+def test_baselines_are_never_pruned():
+    plan = actions(plan_retention(CHECKPOINTS, keep_last=0, max_age_days=0, keep_patterns=["baseline*", "*-9"],
+                                  now=NOW))
+
+    assert plan[("hyperlab-worker-1", "Baseline-install")] == ("keep", "baseline")
+    assert plan[("hyperlab-worker-1", "nightly-9")] == ("keep", "baseline")
+    assert [key for key, (action, _) in plan.items() if action == "keep"] == [
+        ("hyperlab-worker-1", "nightly-9"), ("hyperlab-worker-1", "Baseline-install")]
+
+
+def test_prune_script_lists_only_pruned_ids():
+    script = prune_job_script(plan_retention(CHECKPOINTS, keep_last=4, now=NOW))
+
+    assert "'hyperlab-worker-1' = @('hyperlab-worker-1/nightly-9')" in script
+    assert "hyperlab-control-1" not in script
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Wall-clock budgets in seconds from process start to exit, before any remote work;
+# HYPERLAB_STARTUP_BUDGET_SCALE stretches them on slow machines
+STARTUP_BUDGETS = {
+    "fab --list": (["-m", "fabric", "--list"], 1.0),
+    "fab lst": (["-m", "fabric", "lst"], 1.0),
+    "fab --help list-vms": (["-m", "fabric", "--help", "list-vms"], 1.0),
+    "client --list": (["-m", "hyperlab_control.client", "--list"], 0.4),
+}
+BUDGET_SCALE = float(os.environ.get("HYPERLAB_STARTUP_BUDGET_SCALE", 1))
+
+# Modules only some tasks need, which must not be imported just to load the fabfile
+DEFERRED_MODULES = ["tabulate", "sqlite3"]
+
+
+def run_python(arguments):
+    env = dict(os.environ, PYTHONPATH=os.path.join(PROJECT_DIR, "src"),
+               HYPERLAB_DAEMON_STATE=os.path.join(PROJECT_DIR, ".no-daemon.json"))
+    return subprocess.run([sys.executable, *arguments], cwd=PROJECT_DIR, env=env, capture_output=True, text=True)
+
+
+@pytest.mark.parametrize("command", sorted(STARTUP_BUDGETS))
+def test_startup_within_budget(command):
+    arguments, budget = STARTUP_BUDGETS[command]
+    timings = []
+    # Best of three, so a single slow start on a busy machine does not fail the test
+    for _ in range(3):
+        start = time.perf_counter()
+        result = run_python(arguments)
+        timings.append(time.perf_counter() - start)
+        assert result.returncode == 0, result.stderr
+    assert min(timings) <= budget * BUDGET_SCALE, f"{command} took {min(timings):.2f}s (budget {budget}s)"
+
+
+def test_fabfile_defers_heavy_imports():
+    result = run_python(["-c", "import sys, fabfile; print(' '.join(sorted(sys.modules)))"])
+    assert result.returncode == 0, result.stderr
+    assert not set(DEFERRED_MODULES) & set(result.stdout.split())
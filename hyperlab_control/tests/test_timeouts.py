@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+import fabfile
+from hyperlab_control import timeouts
+from hyperlab_control.fanout import for_each_host
+from hyperlab_control.timeouts import DeadlineExceeded, command_timeout, retry, task_deadline, time_left
+
+
+def test_command_timeouts_capped_by_deadline():
+    assert command_timeout("Get-VM") == 60
+    assert command_timeout("Start-VM") == timeouts.COMMAND_TIMEOUT
+    with task_deadline(5):
+        assert 4 < command_timeout("Get-VM") <= 5
+        assert command_timeout("Get-VM", timeout=2) == 2
+        # A nested deadline never extends the outer one
+        with task_deadline(60):
+            assert command_timeout("Restore-VMSnapshot") <= 5
+    assert time_left() is None
+
+    with task_deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            command_timeout("Get-VM")
+
+
+def test_deadline_is_scoped_to_its_task():
+    seen = []
+    with task_deadline(5):
+        # Another task invocation, e.g. a daemon request, does not inherit it
+        other = threading.Thread(target=lambda: seen.append(time_left()))
+        other.start()
+        other.join()
+        # Fan-out host threads do
+        results = for_each_host(lambda host: time_left(), ["atlas", "boreas"])
+    assert seen == [None]
+    assert all(0 < result.value <= 5 for result in results.values())
+
+
+def test_retry_backs_off_with_jitter(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(timeouts.time, "sleep", sleeps.append)
+    failures = iter([ConnectionError("reset"), ConnectionError("reset")])
+
+    def flaky():
+        for error in failures:
+            raise error
+        return "ok"
+
+    assert retry(flaky, "Query", attempts=3, backoff=0.5) == "ok"
+    # Full jitter: each sleep is drawn from [0, backoff * 2 ** (attempt - 1)]
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1.0
+
+
+def test_retry_doubles_the_backoff_bound(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(timeouts.time, "sleep", sleeps.append)
+    monkeypatch.setattr(timeouts.random, "uniform", lambda low, high: high)
+
+    def down():
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        retry(down, "Query", attempts=3, backoff=0.5)
+    assert sleeps == [0.5, 1.0]
+
+
+def test_retry_gives_up_early(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(timeouts.time, "sleep", sleeps.append)
+    monkeypatch.setattr(timeouts.random, "uniform", lambda low, high: high)
+
+    def failing():
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        retry(failing, "Query", should_retry=lambda e: not isinstance(e, ValueError))
+    # No retry when the backoff would run past the deadline
+    with task_deadline(0.2), pytest.raises(ValueError):
+        retry(failing, "Query", backoff=0.5)
+    assert sleeps == []
+
+
+def test_fan_out_stops_waiting_at_deadline():
+    def body(host):
+        time.sleep(2 if host == "boreas" else 0)
+        return host
+
+    start = time.monotonic()
+    with task_deadline(0.3):
+        results = for_each_host(body, ["atlas", "boreas", "castor"])
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 1
+    assert results["atlas"].value == "atlas" and results["castor"].value == "castor"
+    assert isinstance(results["boreas"].error, DeadlineExceeded)
+
+
+def test_deadline_option_accepts_fractions():
+    arguments = {argument.name: argument for argument in fabfile.ensure.get_arguments()}
+
+    assert arguments["deadline"].kind is float
@@ -0,0 +1,94 @@
+import logging
+import socket
+import time
+
+from hyperlab_control import powershell, wake
+from hyperlab_control.timeouts import time_left
+
+MAC = "58:47:CA:75:EB:98"
+
+
+def test_magic_packet_reaches_udp_listener():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.settimeout(2)
+        wake.send_magic_packet(MAC, broadcast="127.0.0.1", port=listener.getsockname()[1])
+        packet, _ = listener.recvfrom(1024)
+
+    assert packet == b"\xff" * 6 + bytes.fromhex("5847CA75EB98") * 16
+    assert len(packet) == 102
+
+
+def test_port_open(tcp_stub, closed_port):
+    assert wake.port_open("127.0.0.1", tcp_stub)
+    assert not wake.port_open("127.0.0.1", closed_port)
+
+
+def test_wait_until_succeeds_against_listening_stub(tcp_stub):
+    start = time.monotonic()
+    assert wake.wait_until(lambda: wake.port_open("127.0.0.1", tcp_stub), time.monotonic() + 5)
+    assert time.monotonic() - start < 1
+
+
+def test_wait_until_times_out_on_closed_port(closed_port):
+    retries = []
+    start = time.monotonic()
+    ready = wake.wait_until(lambda: wake.port_open("127.0.0.1", closed_port), time.monotonic() + 1.2,
+                            on_retry=lambda: retries.append(time.monotonic()))
+    elapsed = time.monotonic() - start
+
+    assert not ready
+    assert 1.2 <= elapsed < 2.5
+    # Backoff starts at PROBE_INITIAL_DELAY and doubles: 0.5s, then the 0.7s left
+    assert len(retries) == 2
+
+
+def test_wake_host_reports_phase_timings(monkeypatch, tcp_stub):
+    packets = []
+    monkeypatch.setattr(wake, "send_magic_packet", lambda mac: packets.append(mac))
+    monkeypatch.setattr(wake, "ping", lambda host: True)
+    monkeypatch.setattr(wake, "hyperv_ready", lambda host, timeout: True)
+
+    timings = wake.wake_host("127.0.0.1", MAC, timeout=5, ssh_port=tcp_stub)
+
+    assert packets == [MAC]
+    assert timings["ready"] and timings["failed_phase"] is None
+    assert set(timings) >= {"ping", "ssh", "hyperv", "total"}
+
+
+def test_wake_host_names_the_phase_it_got_stuck_in(monkeypatch, closed_port):
+    monkeypatch.setattr(wake, "send_magic_packet", lambda mac: None)
+    monkeypatch.setattr(wake, "ping", lambda host: True)
+
+    timings = wake.wake_host("127.0.0.1", MAC, timeout=0.6, ssh_port=closed_port)
+
+    assert not timings["ready"]
+    assert timings["failed_phase"] == "ssh"
+    assert "ping" in timings and "ssh" not in timings
+
+
+def test_hyperv_probe_stays_within_its_timeout(monkeypatch):
+    budgets = []
+    monkeypatch.setattr(wake.pool, "get", lambda host: object())
+    monkeypatch.setattr(wake, "run_script", lambda conn, script, quiet: budgets.append(time_left()) or "Running")
+
+    assert wake.hyperv_ready("atlas", timeout=2)
+    assert 0 < budgets[0] <= 2
+
+
+def test_hyperv_probe_failures_are_not_errors(monkeypatch, caplog, closed_port):
+    def no_session(conn):
+        raise ConnectionResetError("session closed")
+
+    monkeypatch.setattr(powershell, "USE_SESSIONS", True)
+    monkeypatch.setattr(powershell, "get_session", no_session)
+    monkeypatch.setattr(wake.pool, "get", lambda host: type("Connection", (), {"host": host})())
+
+    with caplog.at_level(logging.DEBUG):
+        assert not wake.hyperv_ready("atlas", timeout=2)
+        monkeypatch.undo()
+        assert not wake.hyperv_ready(f"127.0.0.1:{closed_port}", timeout=2)
+
+    assert "Script execution failed on atlas" in caplog.text
+    assert "Hyper-V not ready on 127.0.0.1" in caplog.text
+    assert not [record for record in caplog.records if record.levelno >= logging.WARNING]